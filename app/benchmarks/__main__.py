@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import sys
+
+from loguru import logger
+
+from benchmarks import (
+    broker,
+    codec,
+    dialog_state,
+    notifier,
+    registry,
+    render,
+    search,
+)
+from benchmarks.dataset import DatasetConfig, SyntheticDataset
+from benchmarks.harness import compare_results, print_report, save_results
+
+SUITES = {
+    "search": search.run,
+    "broker": broker.run,
+    "codec": codec.run,
+    "notifier": notifier.run,
+    "render": render.run,
+    "dialog_state": dialog_state.run,
+    "registry": registry.run,
+}
+
+
+def parse_args():
+    defaults = DatasetConfig()
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Бенчмарки на синтетическом расписании университета",
+    )
+    parser.add_argument("suites", nargs="*", help=f"наборы: {', '.join(SUITES)}")
+    parser.add_argument("--groups", type=int, default=defaults.groups)
+    parser.add_argument("--professors", type=int, default=defaults.professors)
+    parser.add_argument("--auditoriums", type=int, default=defaults.auditoriums)
+    parser.add_argument(
+        "--lessons-per-week", type=int, default=defaults.lessons_per_week
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить p95 с сохраненными результатами")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="допустимый рост p95 относительно --compare (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    return args
+
+
+async def main() -> int:
+    args = parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    dataset = SyntheticDataset(
+        DatasetConfig(
+            groups=args.groups,
+            professors=args.professors,
+            auditoriums=args.auditoriums,
+            lessons_per_week=args.lessons_per_week,
+            seed=args.seed,
+        )
+    )
+    print(
+        f"Dataset: {len(dataset.timetables)} timetables, "
+        f"{dataset.lessons_count} lessons (seed {args.seed})"
+    )
+
+    results = []
+    for name in args.suites or SUITES:
+        print(f"\n=== {name} ===")
+        suite_results = await SUITES[name](dataset, args.repeat)
+        print_report(suite_results)
+        results.extend(suite_results)
+
+    if args.save:
+        save_results(results, args.save)
+
+    if args.compare:
+        regressions = compare_results(results, args.compare, args.tolerance)
+        if regressions:
+            print("\n=== Regressions ===")
+            for line in regressions:
+                print(line)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,170 @@
+import asyncio
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import aio_pika
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.harness import BenchmarkResult, from_samples
+from broker import Broker
+from codec import encode_change
+
+HANDLER_LATENCY = 0.005
+
+
+class FakeIncomingMessage:
+    def __init__(
+        self, queue: "FakeQueue", body: bytes, headers: Optional[Dict[str, Any]] = None
+    ):
+        self._queue = queue
+        self.body = body
+        self.headers = headers or {}
+        self.message_id = None
+        self.published_at = time.perf_counter()
+        self.settled_at: Optional[float] = None
+        self.processed = False
+
+    async def ack(self, multiple: bool = False):
+        self._queue._settle(self)
+
+    async def reject(self, requeue: bool = False):
+        self._queue._settle(self)
+        if requeue:
+            self._queue.publish(self.body, self.headers)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True):
+        await self.reject(requeue=requeue)
+
+
+class FakeQueue:
+    # Минимальная замена очереди RabbitMQ: prefetch, consume/cancel, basic.get
+    def __init__(self, name: str = "timetable_changes", prefetch_count: int = 0):
+        self.name = name
+        self.prefetch_count = prefetch_count
+        self.ready: Deque[FakeIncomingMessage] = deque()
+        self.unacked = 0
+        self.settled: List[FakeIncomingMessage] = []
+        self._callback: Optional[Callable] = None
+        self._tasks = set()
+
+    def publish(self, body: bytes, headers: Optional[Dict[str, Any]] = None):
+        self.ready.append(FakeIncomingMessage(self, body, headers))
+        self._dispatch()
+
+    async def consume(self, callback: Callable, **kwargs) -> str:
+        self._callback = callback
+        self._dispatch()
+        return "fake-consumer"
+
+    async def cancel(self, consumer_tag: str, **kwargs):
+        self._callback = None
+
+    async def declare(self, **kwargs):
+        return SimpleNamespace(message_count=len(self.ready))
+
+    async def get(self, no_ack: bool = False, fail: bool = True, **kwargs):
+        if not self.ready:
+            if fail:
+                raise aio_pika.exceptions.QueueEmpty()
+            return None
+        self.unacked += 1
+        return self.ready.popleft()
+
+    def _settle(self, message: FakeIncomingMessage):
+        if message.processed:
+            raise RuntimeError("Message already processed")
+        message.processed = True
+        message.settled_at = time.perf_counter()
+        self.unacked -= 1
+        self.settled.append(message)
+        self._dispatch()
+
+    def _dispatch(self):
+        while (
+            self._callback
+            and self.ready
+            and (not self.prefetch_count or self.unacked < self.prefetch_count)
+        ):
+            message = self.ready.popleft()
+            self.unacked += 1
+            task = asyncio.get_running_loop().create_task(self._callback(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+
+def fake_broker(queue: FakeQueue, **kwargs) -> Broker:
+    broker = Broker("amqp://benchmark", queue_name=queue.name, **kwargs)
+    broker.queue = queue
+    broker.initialized = True
+    return broker
+
+
+def encode_messages(dataset: SyntheticDataset, count: int) -> List[bytes]:
+    return [encode_change(change) for change in dataset.changes(count)]
+
+
+def _latencies(queue: FakeQueue) -> List[float]:
+    return [message.settled_at - message.published_at for message in queue.settled]
+
+
+async def _drain(queue: FakeQueue, count: int):
+    while len(queue.settled) < count:
+        await asyncio.sleep(0.001)
+
+
+async def _push(bodies: List[bytes], prefetch_count: int) -> BenchmarkResult:
+    queue = FakeQueue(prefetch_count=prefetch_count)
+    broker = fake_broker(queue, prefetch_count=prefetch_count)
+
+    async def handler(change):
+        await asyncio.sleep(HANDLER_LATENCY)
+
+    start = time.perf_counter()
+    for body in bodies:
+        queue.publish(body)
+    await broker.start_consuming(handler)
+    await _drain(queue, len(bodies))
+    total = time.perf_counter() - start
+    await broker.stop_consuming()
+
+    return from_samples(
+        f"consume_push_prefetch{prefetch_count}",
+        _latencies(queue),
+        items=len(bodies),
+        total_s=total,
+    )
+
+
+async def _poll(bodies: List[bytes], interval: float) -> BenchmarkResult:
+    # Прежний цикл background_main: basic.get и пауза после каждой попытки
+    queue = FakeQueue()
+    broker = fake_broker(queue)
+
+    start = time.perf_counter()
+    for body in bodies:
+        queue.publish(body)
+
+    while len(queue.settled) < len(bodies):
+        change = await broker.get_message()
+        if change:
+            await asyncio.sleep(HANDLER_LATENCY)
+        await asyncio.sleep(interval)
+
+    return from_samples(
+        f"consume_poll_interval{interval}s",
+        _latencies(queue),
+        items=len(bodies),
+        total_s=time.perf_counter() - start,
+    )
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    bodies = encode_messages(dataset, max(repeat, 50))
+    results = [await _poll(bodies[:3], 1.0)]
+
+    for prefetch_count in [1, 20, 50]:
+        results.append(await _push(bodies, prefetch_count))
+
+    return results
@@ -0,0 +1,49 @@
+from typing import List
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.harness import BenchmarkResult, measure
+from codec import CODEC_VERSION, LEGACY_VERSION, decode_change, encode_change
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    results = []
+
+    for lessons_per_change in (5, 100, 400):
+        changes = dataset.changes(50, lessons_per_change)
+        lessons = sum(len(change.lesson_changes) for change in changes)
+
+        for version, label in ((LEGACY_VERSION, "legacy"), (CODEC_VERSION, "v2")):
+            bodies = [encode_change(change, version) for change in changes]
+            size = sum(len(body) for body in bodies) // len(bodies)
+            suffix = f"{label}_{lessons_per_change}lessons_{size}B"
+
+            results.append(
+                measure(
+                    f"encode_{suffix}",
+                    lambda: [encode_change(change, version) for change in changes],
+                    repeat=max(repeat // 10, 5),
+                    items=lessons,
+                )
+            )
+            results.append(
+                measure(
+                    f"decode_{suffix}",
+                    lambda: [decode_change(body) for body in bodies],
+                    repeat=max(repeat // 10, 5),
+                    items=lessons,
+                )
+            )
+
+        # aio-pika отдает тело как bytes; memoryview декодер сначала копирует
+        # через tobytes(), этот замер показывает цену копии
+        views = [memoryview(encode_change(change)) for change in changes]
+        results.append(
+            measure(
+                f"decode_memoryview_{lessons_per_change}lessons",
+                lambda: [decode_change(view) for view in views],
+                repeat=max(repeat // 10, 5),
+                items=lessons,
+            )
+        )
+
+    return results
@@ -0,0 +1,328 @@
+import copy
+import random
+from dataclasses import dataclass, replace
+from datetime import date, timedelta
+from typing import AsyncIterator, Dict, List, Optional
+
+from parser_types import (
+    DayName,
+    Entity,
+    EntityType,
+    Lesson,
+    LessonType,
+    Metadata,
+    ScheduleForm,
+    ScheduleType,
+    Semester,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+    ChangeType,
+    FieldChange,
+    LessonChange,
+    TimetableChangeData,
+)
+from occupancy import LESSON_SLOTS, OccupancyIndex
+
+GROUP_PREFIXES = ["БПИ", "БИС", "БПЭ", "БМТ", "БЭК", "МПИ", "ЗБИ"]
+LAST_NAMES = [
+    "Алиева",
+    "Иванов",
+    "Петрова",
+    "Сидоров",
+    "Кузнецов",
+    "Смирнова",
+    "Попов",
+    "Васильева",
+    "Соколов",
+    "Михайлова",
+]
+BUILDINGS = {
+    "Л": "пр. им. газеты Красноярский рабочий, 31",
+    "Н": "пр. им. газеты Красноярский рабочий, 31",
+    "А": "ул. Мира, 82",
+    "Б": "ул. Мира, 82",
+    "Г": "ул. Ленина, 6",
+}
+SUBJECTS = [
+    "Математический анализ",
+    "Линейная алгебра",
+    "Программирование",
+    "Базы данных",
+    "Физика",
+    "Иностранный язык",
+    "Операционные системы",
+    "Компьютерные сети",
+    "Философия",
+    "Теория вероятностей",
+]
+WORK_DAYS = [day for day in DayName if day != DayName.SUNDAY]
+
+
+@dataclass
+class DatasetConfig:
+    groups: int = 300
+    professors: int = 400
+    auditoriums: int = 250
+    lessons_per_week: int = 18
+    session_lessons: int = 6
+    seed: int = 42
+
+
+class SyntheticDataset:
+    def __init__(self, config: DatasetConfig):
+        self.config = config
+        self._random = random.Random(config.seed)
+
+        self.group_names = self._unique_names(config.groups, self._group_name)
+        self.professor_names = self._unique_names(
+            config.professors, self._professor_name
+        )
+        self.auditorium_names = self._unique_names(
+            config.auditoriums, self._auditorium_name
+        )
+
+        self._occupancy: Optional[OccupancyIndex] = None
+        self.timetables: List[TimetableData] = self._generate()
+        self.by_name: Dict[str, TimetableData] = {
+            timetable.entity.name: timetable for timetable in self.timetables
+        }
+
+    @property
+    def entities(self) -> List[Entity]:
+        return [timetable.entity for timetable in self.timetables]
+
+    @property
+    def lessons_count(self) -> int:
+        return sum(len(timetable.lessons) for timetable in self.timetables)
+
+    def largest(self, entity_type: EntityType) -> TimetableData:
+        return max(
+            (t for t in self.timetables if t.entity.type == entity_type),
+            key=lambda t: len(t.lessons),
+        )
+
+    def occupancy_index(self) -> OccupancyIndex:
+        if self._occupancy is not None:
+            return self._occupancy
+
+        index = OccupancyIndex()
+        for timetable in self.timetables:
+            index.register(timetable.entity.type, timetable.entity.name)
+            if timetable.entity.type == EntityType.GROUP:
+                for lesson in timetable.lessons:
+                    index.add_lesson(lesson)
+        self._occupancy = index
+        return index
+
+    def changes(
+        self, count: int, lessons_per_change: int = 5
+    ) -> List[TimetableChangeData]:
+        # Изменения в духе пересборки парсером: перенос аудитории, добавление, удаление
+        groups = [t for t in self.timetables if t.entity.type == EntityType.GROUP]
+        result = []
+        for number in range(count):
+            timetable = groups[number % len(groups)]
+            lesson_changes = []
+            # Крупные сообщения больше расписания группы: занятия берутся с повторами
+            lessons = (
+                self._random.sample(timetable.lessons, lessons_per_change)
+                if lessons_per_change <= len(timetable.lessons)
+                else self._random.choices(timetable.lessons, k=lessons_per_change)
+            )
+            for lesson in lessons:
+                change_type = self._random.choice(list(ChangeType)[1:])
+                new_lesson = replace(
+                    lesson, auditorium=self._random.choice(self.auditorium_names)
+                )
+                lesson_changes.append(
+                    LessonChange(
+                        change_type=change_type,
+                        field_changes=[
+                            FieldChange(
+                                "auditorium", lesson.auditorium, new_lesson.auditorium
+                            )
+                        ]
+                        if change_type == ChangeType.LESSON_MODIFIED
+                        else [],
+                        old_lesson=lesson,
+                        new_lesson=new_lesson,
+                    )
+                )
+            result.append(
+                TimetableChangeData(
+                    entity=timetable.entity, lesson_changes=lesson_changes
+                )
+            )
+        return result
+
+    def _unique_names(self, count: int, factory) -> List[str]:
+        names = []
+        seen = set()
+        while len(names) < count:
+            name = factory(len(names))
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+        return names
+
+    def _group_name(self, number: int) -> str:
+        prefix = self._random.choice(GROUP_PREFIXES)
+        year = self._random.randint(20, 25)
+        return f"{prefix}{year}-{number % 99 + 1:02d}"
+
+    def _professor_name(self, number: int) -> str:
+        last_name = self._random.choice(LAST_NAMES)
+        initials = self._random.sample("АБВГДЕИКЛМНОПРСТ", 2)
+        name = f"{last_name} {initials[0]}. {initials[1]}."
+        # Сочетаний фамилий и инициалов ~2400, дальше имена различаются суффиксом
+        return f"{name} ({number})" if number >= 2000 else name
+
+    def _auditorium_name(self, number: int) -> str:
+        building = self._random.choice(list(BUILDINGS))
+        return f"{building}-{self._random.randint(100, 520)}"
+
+    def _lesson(
+        self,
+        schedule_type: ScheduleType,
+        group: str,
+        week_number: Optional[WeekNumber],
+        day_name: Optional[DayName],
+        slot: int,
+        day_date: Optional[date] = None,
+    ) -> Lesson:
+        auditorium = self._random.choice(self.auditorium_names)
+        professors = self._random.sample(
+            self.professor_names, 2 if self._random.random() < 0.1 else 1
+        )
+        return Lesson(
+            schedule_type=schedule_type,
+            time_begin=LESSON_SLOTS[slot][0],
+            lesson_name=self._random.choice(SUBJECTS),
+            schedule_form=ScheduleForm.OFFLINE,
+            week_number=week_number,
+            day_name=day_name,
+            day_date=day_date,
+            duration=timedelta(minutes=90),
+            lesson_type=LessonType.EXAM
+            if schedule_type == ScheduleType.SESSION
+            else self._random.choice(
+                [LessonType.LECTURE, LessonType.PRACTICE, LessonType.LABORATORY]
+            ),
+            groups=[group],
+            professors=professors,
+            auditorium=auditorium,
+            location=BUILDINGS[auditorium.split("-")[0]],
+            subgroups=self._random.choice(
+                [Subgroup.COMMON, Subgroup.COMMON, Subgroup.FIRST, Subgroup.SECOND]
+            ),
+        )
+
+    def _generate(self) -> List[TimetableData]:
+        metadata = Metadata(
+            years="2024-2025",
+            date=date(2025, 3, 26),
+            week_number=WeekNumber.ODD,
+            semester=Semester.SECOND,
+        )
+        lessons_by_entity: Dict[tuple, List[Lesson]] = {}
+
+        for group in self.group_names:
+            lessons = []
+            for week_number in WeekNumber:
+                cells = [(day, slot) for day in WORK_DAYS for slot in range(6)]
+                for day_name, slot in self._random.sample(
+                    cells, min(self.config.lessons_per_week, len(cells))
+                ):
+                    lessons.append(
+                        self._lesson(
+                            ScheduleType.REGULAR, group, week_number, day_name, slot
+                        )
+                    )
+
+            for number in range(self.config.session_lessons):
+                schedule_type = (
+                    ScheduleType.CONSULTATION if number % 2 else ScheduleType.SESSION
+                )
+                lessons.append(
+                    self._lesson(
+                        schedule_type,
+                        group,
+                        None,
+                        None,
+                        self._random.randint(0, 3),
+                        date(2025, 6, 2) + timedelta(days=number * 2),
+                    )
+                )
+
+            for lesson in lessons:
+                lessons_by_entity.setdefault((EntityType.GROUP, group), []).append(
+                    lesson
+                )
+                for professor in lesson.professors:
+                    lessons_by_entity.setdefault(
+                        (EntityType.PROFESSOR, professor), []
+                    ).append(lesson)
+                lessons_by_entity.setdefault(
+                    (EntityType.AUDITORIUM, lesson.auditorium), []
+                ).append(lesson)
+
+        return [
+            TimetableData(
+                entity=Entity(type=entity_type, id=entity_id, name=name),
+                metadata=metadata,
+                lessons=lessons,
+            )
+            for entity_id, ((entity_type, name), lessons) in enumerate(
+                lessons_by_entity.items(), start=1
+            )
+        ]
+
+
+class InMemoryDatabase:
+    # Подменяет Database в поисковых билдерах: те же методы, данные из SyntheticDataset
+    def __init__(self, dataset: SyntheticDataset):
+        self._dataset = dataset
+
+    async def get_timetables(self) -> List[TimetableData]:
+        return self._dataset.timetables
+
+    async def get_all_entities(self) -> List[Entity]:
+        return self._dataset.entities
+
+    async def get_timetable_by_query(self, query: dict) -> Optional[TimetableData]:
+        if set(query) == {"entity.name"}:
+            return self._dataset.by_name.get(query["entity.name"])
+
+        for timetable in self._dataset.timetables:
+            if all(
+                _field_value(timetable, field) == value
+                for field, value in query.items()
+            ):
+                return timetable
+        return None
+
+    async def iter_timetables(
+        self, query: dict, sort=None, skip: int = 0, limit: int = 0
+    ) -> AsyncIterator[TimetableData]:
+        # Как из MongoDB: каждый раз новый объект
+        matched = [
+            timetable
+            for timetable in self._dataset.timetables
+            if all(
+                _field_value(timetable, field) == value
+                for field, value in query.items()
+            )
+        ]
+        for timetable in matched[skip : skip + limit if limit else None]:
+            yield copy.deepcopy(timetable)
+
+    async def get_occupancy_index(self) -> OccupancyIndex:
+        return self._dataset.occupancy_index()
+
+
+def _field_value(timetable: TimetableData, path: str):
+    value = timetable
+    for part in path.split("."):
+        value = getattr(value, part, None)
+    return getattr(value, "value", value)
@@ -0,0 +1,106 @@
+import pickle
+from typing import Any, Dict, List
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.harness import BenchmarkResult, measure, measure_retained
+from dialog_storage import dumps_state, loads_state
+from parser_types import DayName, EntityType, ScheduleType, Subgroup, WeekNumber
+
+DIALOGS = 10_000
+
+
+def _context(entity, user_id: int, dialog_data: Dict[str, Any]) -> Dict[str, Any]:
+    # То же, что aiogram-dialog сохраняет для открытого окна расписания
+    return {
+        "_intent_id": f"{user_id:08x}",
+        "_stack_id": "",
+        "state": "BotStates:timetable",
+        "start_data": {"entity": entity},
+        "dialog_data": dialog_data,
+        "widget_data": {},
+        "access_settings": {"user_ids": [user_id]},
+    }
+
+
+def _filters(entity_name: str) -> Dict[str, Any]:
+    return {
+        "entity_name": entity_name,
+        "filter_day_name": DayName.MONDAY,
+        "filter_day_suffix": "(Сегодня)",
+        "filter_week_number": WeekNumber.ODD,
+        "filter_schedule_type": ScheduleType.REGULAR,
+        "filter_subgroup": Subgroup.COMMON,
+        "is_first_open": False,
+        "is_subscribed": True,
+        "delivery_mode": "immediate",
+        "digest_time": None,
+        "tomorrow_push": False,
+        "day_index": 1,
+    }
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    timetable = dataset.largest(EntityType.GROUP)
+    entity = timetable.entity
+    # Прежде каждый диалог держал свою копию расписания из кеша Redis (pickle)
+    cached = pickle.dumps(timetable)
+
+    async def legacy():
+        storage = MemoryStorage()
+        for user_id in range(DIALOGS):
+            dialog_data = _filters(entity.name)
+            dialog_data["timetable_data"] = pickle.loads(cached)
+            await storage.set_data(
+                StorageKey(bot_id=1, chat_id=user_id, user_id=user_id),
+                _context(entity, user_id, dialog_data),
+            )
+        return storage
+
+    async def compact_memory():
+        storage = MemoryStorage()
+        for user_id in range(DIALOGS):
+            await storage.set_data(
+                StorageKey(bot_id=1, chat_id=user_id, user_id=user_id),
+                _context(entity, user_id, _filters(entity.name)),
+            )
+        return storage
+
+    async def compact_redis():
+        # Значения, которые RedisStorage положит в Redis
+        return [
+            dumps_state(_context(entity, user_id, _filters(entity.name))).encode()
+            for user_id in range(DIALOGS)
+        ]
+
+    payloads = await compact_redis()
+    size = sum(len(payload) for payload in payloads) // len(payloads)
+    contexts = [loads_state(payload) for payload in payloads[:1000]]
+    raw = payloads[:1000]
+
+    results = [
+        await measure_retained(
+            f"dialog_state_legacy_{DIALOGS}dialogs", legacy, DIALOGS
+        ),
+        await measure_retained(
+            f"dialog_state_memory_{DIALOGS}dialogs", compact_memory, DIALOGS
+        ),
+        await measure_retained(
+            f"dialog_state_redis_{DIALOGS}dialogs_{size}B", compact_redis, DIALOGS
+        ),
+        measure(
+            "dialog_state_encode_1000",
+            lambda: [dumps_state(context) for context in contexts],
+            repeat=max(repeat // 10, 5),
+            items=len(contexts),
+        ),
+        measure(
+            "dialog_state_decode_1000",
+            lambda: [loads_state(payload) for payload in raw],
+            repeat=max(repeat // 10, 5),
+            items=len(raw),
+        ),
+    ]
+    return results
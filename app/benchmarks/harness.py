@@ -0,0 +1,178 @@
+import json
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tabulate import tabulate
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    calls: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    peak_memory_kb: float
+    items: int = 1
+    # Для пропускной способности: общее время прогона всех items
+    total_s: Optional[float] = None
+
+    @property
+    def items_per_second(self) -> float:
+        if self.total_s is not None:
+            return self.items / self.total_s if self.total_s else 0.0
+        return self.items / (self.mean_ms / 1000) if self.mean_ms else 0.0
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if len(samples) == 1:
+        value = samples[0] * 1000
+        return {"p50": value, "p95": value, "p99": value}
+
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+    }
+
+
+def from_samples(
+    name: str,
+    samples: List[float],
+    peak_memory: int = 0,
+    items: int = 1,
+    total_s: Optional[float] = None,
+) -> BenchmarkResult:
+    percentiles = _percentiles(samples)
+    return BenchmarkResult(
+        name=name,
+        calls=len(samples),
+        p50_ms=percentiles["p50"],
+        p95_ms=percentiles["p95"],
+        p99_ms=percentiles["p99"],
+        mean_ms=statistics.fmean(samples) * 1000,
+        peak_memory_kb=peak_memory / 1024,
+        items=items,
+        total_s=total_s,
+    )
+
+
+def measure(
+    name: str,
+    func: Callable[[], Any],
+    repeat: int = 200,
+    warmup: int = 5,
+    items: int = 1,
+) -> BenchmarkResult:
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    # Память меряется отдельным вызовом: tracemalloc сильно искажает время
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return from_samples(name, samples, peak, items)
+
+
+async def measure_async(
+    name: str,
+    func: Callable[[], Awaitable[Any]],
+    repeat: int = 200,
+    warmup: int = 5,
+    items: int = 1,
+) -> BenchmarkResult:
+    for _ in range(warmup):
+        await func()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    await func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return from_samples(name, samples, peak, items)
+
+
+async def measure_retained(
+    name: str, build: Callable[[], Awaitable[Any]], items: int = 1
+) -> BenchmarkResult:
+    # Один прогон: память, которую держит результат build (а не пик сборки)
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = await build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return from_samples(name, [elapsed], current, items)
+
+
+def print_report(results: List[BenchmarkResult]):
+    headers = [
+        "Benchmark",
+        "Calls",
+        "p50 (ms)",
+        "p95 (ms)",
+        "p99 (ms)",
+        "Items/s",
+        "Peak mem (KB)",
+    ]
+    rows = [
+        [
+            result.name,
+            result.calls,
+            round(result.p50_ms, 4),
+            round(result.p95_ms, 4),
+            round(result.p99_ms, 4),
+            round(result.items_per_second, 1),
+            round(result.peak_memory_kb, 1),
+        ]
+        for result in results
+    ]
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+
+
+def save_results(results: List[BenchmarkResult], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+
+
+def compare_results(
+    results: List[BenchmarkResult], baseline_path: str, tolerance: float
+) -> List[str]:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline: Dict[str, Dict[str, Any]] = {
+            item["name"]: item for item in json.load(f)
+        }
+
+    regressions = []
+    for result in results:
+        previous: Optional[Dict[str, Any]] = baseline.get(result.name)
+        if not previous or not previous["p95_ms"]:
+            continue
+
+        ratio = result.p95_ms / previous["p95_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"{result.name}: p95 {previous['p95_ms']:.4f} ms -> "
+                f"{result.p95_ms:.4f} ms (+{(ratio - 1) * 100:.0f}%)"
+            )
+    return regressions
@@ -0,0 +1,183 @@
+import asyncio
+import time
+from typing import Dict, List, Set
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.harness import BenchmarkResult, from_samples
+from notifier import NotificationSender, TokenBucket
+
+SUBSCRIBERS = 200
+API_LATENCY = 0.03
+FLOOD_LIMIT = 100
+TOKEN = "123456:benchmark"
+
+
+class FakeBotAPI:
+    # Заглушка Bot API: задержка ответа, 429 при превышении общего лимита,
+    # 403 для чатов, заблокировавших бота
+    def __init__(
+        self,
+        latency: float = API_LATENCY,
+        flood_limit: int = FLOOD_LIMIT,
+        blocked: Set[int] = frozenset(),
+    ):
+        self.latency = latency
+        self.flood_limit = flood_limit
+        self.blocked = set(blocked)
+        self.delivered: List[int] = []
+        self.texts: Dict[int, List[str]] = {}
+        self.flood_errors = 0
+        self._window_started = time.monotonic()
+        self._window_count = 0
+        self._runner = None
+        self.url = ""
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.latency)
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+
+        now = time.monotonic()
+        if now - self._window_started >= 1:
+            self._window_started, self._window_count = now, 0
+        self._window_count += 1
+        if self._window_count > self.flood_limit:
+            self.flood_errors += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+                status=429,
+            )
+
+        if chat_id in self.blocked:
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                },
+                status=403,
+            )
+
+        self.delivered.append(chat_id)
+        self.texts.setdefault(chat_id, []).append(data.get("text", ""))
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": len(self.delivered),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": data.get("text", ""),
+                },
+            }
+        )
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._runner.cleanup()
+
+
+def _bot(api: FakeBotAPI) -> Bot:
+    return Bot(
+        token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api.url))
+    )
+
+
+async def _sequential(chat_ids: List[int]) -> BenchmarkResult:
+    # Прежний цикл receive_notification: по одному сообщению, ошибки пропускаются
+    async with FakeBotAPI() as api:
+        bot = _bot(api)
+        latencies = []
+        start = time.perf_counter()
+        for chat_id in chat_ids:
+            sent = time.perf_counter()
+            try:
+                await bot.send_message(chat_id, "benchmark")
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - sent)
+        total = time.perf_counter() - start
+        await bot.session.close()
+
+    return from_samples(
+        f"fanout_sequential_{len(chat_ids)}chats",
+        latencies,
+        items=len(api.delivered),
+        total_s=total,
+    )
+
+
+async def _sender(
+    name: str,
+    chat_ids: List[int],
+    global_rate: float,
+    blocked: Set[int] = frozenset(),
+    parts: int = 1,
+) -> BenchmarkResult:
+    texts = [f"benchmark {part}" for part in range(parts)]
+    async with FakeBotAPI(blocked=blocked) as api:
+        bot = _bot(api)
+        sender = NotificationSender(bot, global_rate=global_rate, concurrency=32)
+        result = await sender.send(chat_ids, texts)
+        await bot.session.close()
+
+    assert len(api.delivered) == (len(chat_ids) - len(blocked)) * parts
+    # Части длинного уведомления приходят в каждый чат по порядку
+    assert all(received == texts for received in api.texts.values())
+    return from_samples(
+        f"fanout_sender_{name}_{len(chat_ids)}chats",
+        result.latencies,
+        items=result.sent,
+        total_s=result.seconds,
+    )
+
+
+async def _token_bucket(rate: float, count: int) -> BenchmarkResult:
+    bucket = TokenBucket(rate)
+    samples = []
+    start = time.perf_counter()
+    for _ in range(count):
+        acquired = time.perf_counter()
+        await bucket.acquire()
+        samples.append(time.perf_counter() - acquired)
+    return from_samples(
+        f"token_bucket_rate{rate:g}",
+        samples,
+        items=count,
+        total_s=time.perf_counter() - start,
+    )
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    chat_ids = list(range(1, SUBSCRIBERS + 1))
+    blocked = set(chat_ids[::20])
+
+    return [
+        await _token_bucket(FLOOD_LIMIT, FLOOD_LIMIT * 2),
+        await _sequential(chat_ids),
+        await _sender("under_limit", chat_ids, FLOOD_LIMIT * 0.9),
+        await _sender("blocked_chats", chat_ids, FLOOD_LIMIT * 0.9, blocked),
+        await _sender("3parts", chat_ids, FLOOD_LIMIT * 0.9, parts=3),
+        # Без запаса по лимиту сервер отвечает 429 и рассылка встает на паузу
+        await _sender("over_limit", chat_ids, FLOOD_LIMIT * 3),
+    ]
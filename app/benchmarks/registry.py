@@ -0,0 +1,70 @@
+import pickle
+from typing import List
+
+from benchmarks.dataset import InMemoryDatabase, SyntheticDataset
+from benchmarks.harness import BenchmarkResult, measure_async, measure_retained
+from database_searcher import DayView
+from parser_types import EntityType
+from timetable_registry import TimetableRegistry
+
+STUDENTS = 1000
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    database = InMemoryDatabase(dataset)
+    timetable = dataset.largest(EntityType.GROUP)
+    entity_id = timetable.entity.id
+    # Прежде каждый диалог получал свою копию из кеша Redis и строил свой DayView
+    cached = pickle.dumps(timetable)
+
+    async def legacy():
+        copies = [pickle.loads(cached) for _ in range(STUDENTS)]
+        for copy in copies:
+            DayView.for_timetable(copy)
+        return copies
+
+    async def shared():
+        registry = TimetableRegistry(database)
+        views = [await registry.get(entity_id) for _ in range(STUDENTS)]
+        for view in views:
+            DayView.for_timetable(view)
+        assert all(view is views[0] for view in views)
+        return registry, views
+
+    warm = TimetableRegistry(database)
+    await warm.get(entity_id)
+
+    async def hits():
+        for _ in range(STUDENTS):
+            await warm.get(entity_id)
+
+    groups = [
+        item.entity.id
+        for item in dataset.timetables
+        if item.entity.type == EntityType.GROUP
+    ][:50]
+
+    async def mixed():
+        # 1000 студентов из 50 групп после сброса по изменениям
+        registry = TimetableRegistry(database)
+        for index in range(STUDENTS):
+            await registry.get(groups[index % len(groups)])
+        return registry
+
+    registry = await mixed()
+    stats = registry.stats()
+
+    return [
+        await measure_retained(
+            f"registry_legacy_copies_{STUDENTS}students", legacy, STUDENTS
+        ),
+        await measure_retained(f"registry_shared_{STUDENTS}students", shared, STUDENTS),
+        await measure_async(
+            f"registry_hits_{STUDENTS}", hits, max(repeat // 10, 5), items=STUDENTS
+        ),
+        await measure_retained(
+            f"registry_{len(groups)}groups_{stats['bytes'] // 1024}KB",
+            mixed,
+            STUDENTS,
+        ),
+    ]
@@ -0,0 +1,179 @@
+import time
+from itertools import product
+from typing import List
+
+from aiogram import Bot
+from aiogram.types import User
+from aiogram.utils.deep_linking import create_start_link
+
+from benchmarks.dataset import SyntheticDataset
+from benchmarks.harness import BenchmarkResult, from_samples, measure, measure_async
+from deep_links import DeepLinkBuilder
+from notification_text import notification_entity_names, render_notification
+from database_searcher import DayView
+from parser_types import (
+    DayName,
+    EntityType,
+    ScheduleType,
+    Subgroup,
+    TimetableChangeData,
+    WeekNumber,
+)
+from timetable_pages import day_pages, format_lessons, precompute_pages, render_day
+
+TOKEN = "123456:benchmark"
+
+
+def _bot() -> Bot:
+    # bot.me() кешируется aiogram, поэтому сеть не нужна и в прежнем варианте
+    bot = Bot(token=TOKEN)
+    bot._me = User(id=123456, is_bot=True, first_name="Bot", username="sibsau_bot")
+    return bot
+
+
+async def _render_per_link(bot: Bot, message: TimetableChangeData) -> str:
+    # Прежний рендер: create_start_link на каждое упоминание сущности
+    links = {}
+    for name in notification_entity_names(message):
+        links[name] = await create_start_link(bot, name, encode=True)
+    return render_notification(message, links)
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    bot = _bot()
+    results = []
+
+    for lessons_per_change in (5, 100, 400):
+        changes = dataset.changes(20, lessons_per_change)
+        lessons = sum(len(change.lesson_changes) for change in changes)
+        iterations = max(repeat // 10, 5)
+
+        async def per_link():
+            return [await _render_per_link(bot, change) for change in changes]
+
+        cold = DeepLinkBuilder()
+
+        async def cached_cold():
+            cold.clear()
+            return [
+                render_notification(
+                    change,
+                    await cold.links(bot, notification_entity_names(change)),
+                )
+                for change in changes
+            ]
+
+        warm = DeepLinkBuilder()
+        for change in changes:
+            await warm.links(bot, notification_entity_names(change))
+
+        async def cached_warm():
+            return [
+                render_notification(
+                    change,
+                    await warm.links(bot, notification_entity_names(change)),
+                )
+                for change in changes
+            ]
+
+        links = [
+            await warm.links(bot, notification_entity_names(change))
+            for change in changes
+        ]
+        pairs = list(zip(changes, links))
+
+        suffix = f"{lessons_per_change}lessons"
+        results.extend(
+            [
+                await measure_async(
+                    f"render_per_link_{suffix}", per_link, iterations, items=lessons
+                ),
+                await measure_async(
+                    f"render_cached_cold_{suffix}",
+                    cached_cold,
+                    iterations,
+                    items=lessons,
+                ),
+                await measure_async(
+                    f"render_cached_warm_{suffix}",
+                    cached_warm,
+                    iterations,
+                    items=lessons,
+                ),
+                # Только сборка текста, ссылки уже готовы
+                measure(
+                    f"render_text_only_{suffix}",
+                    lambda: [
+                        render_notification(change, link) for change, link in pairs
+                    ],
+                    iterations,
+                    items=lessons,
+                ),
+            ]
+        )
+
+    results.extend(await _day_pages(dataset, bot, repeat))
+
+    await bot.session.close()
+    return results
+
+
+async def _day_pages(
+    dataset: SyntheticDataset, bot: Bot, repeat: int
+) -> List[BenchmarkResult]:
+    # Переходы по дням окна расписания: отрисовка каждой страницы заново,
+    # страницы из RenderCache после первого прохода и после precompute_pages
+    timetable = dataset.largest(EntityType.GROUP)
+    timetable.version = 1
+    view = DayView.for_timetable(timetable)
+    pages = list(product(ScheduleType, WeekNumber, DayName, Subgroup))
+    iterations = max(repeat // 10, 5)
+
+    async def uncached():
+        return [
+            await format_lessons(timetable.entity, view.lessons(*page), bot)
+            for page in pages
+        ]
+
+    day_pages.clear()
+
+    async def cached():
+        return [await render_day(timetable, *page, bot) for page in pages]
+
+    # Сеанс пользователя: открыть окно и пролистать все дни обеих недель
+    # во всех типах расписания своей подгруппы. Время каждого перехода
+    session = list(product(ScheduleType, WeekNumber, DayName))
+    on_demand, precomputed, opens = [], [], []
+    for _ in range(iterations):
+        day_pages.clear()
+        for page in session:
+            start = time.perf_counter()
+            await render_day(timetable, *page, Subgroup.FIRST, bot)
+            on_demand.append(time.perf_counter() - start)
+
+        day_pages.clear()
+        start = time.perf_counter()
+        await precompute_pages(timetable, Subgroup.FIRST, bot)
+        opens.append(time.perf_counter() - start)
+        for page in session:
+            start = time.perf_counter()
+            await render_day(timetable, *page, Subgroup.FIRST, bot)
+            precomputed.append(time.perf_counter() - start)
+
+    return [
+        from_samples("day_click_on_demand", on_demand),
+        from_samples("day_click_precomputed", precomputed),
+        from_samples(f"day_open_precompute_{len(session)}pages", opens),
+        await measure_async(
+            f"day_pages_format_{len(pages)}pages",
+            uncached,
+            iterations,
+            items=len(pages),
+        ),
+        await measure_async(
+            f"day_pages_cached_{len(pages)}pages",
+            cached,
+            iterations,
+            items=len(pages),
+        ),
+    ]
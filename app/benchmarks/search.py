@@ -0,0 +1,177 @@
+import pickle
+from typing import List
+
+from benchmarks.dataset import InMemoryDatabase, SyntheticDataset
+from benchmarks.harness import BenchmarkResult, measure, measure_async
+from database import Database, EntityModel, LessonModel, MetadataModel, TimetableModel
+from database_searcher import (
+    DayView,
+    FilteredLessonsBuilder,
+    SearchEntityBuilder,
+    SearchOccupancyBuilder,
+)
+from parser_types import (
+    DayName,
+    EntityType,
+    ScheduleType,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+)
+
+
+def _to_document(timetable: TimetableData) -> TimetableModel:
+    # model_construct не требует init_beanie, _from_model читает только поля
+    return TimetableModel.model_construct(
+        entity=EntityModel(
+            type=timetable.entity.type.value,
+            id=timetable.entity.id,
+            name=timetable.entity.name,
+        ),
+        metadata=MetadataModel(
+            years=timetable.metadata.years,
+            date=timetable.metadata.date,
+            week_number=timetable.metadata.week_number.value,
+            semester=timetable.metadata.semester.value
+            if timetable.metadata.semester
+            else None,
+        ),
+        lessons=[
+            LessonModel(
+                schedule_type=lesson.schedule_type.value,
+                time_begin=lesson.time_begin.strftime("%H:%M"),
+                lesson_name=lesson.lesson_name,
+                schedule_form=lesson.schedule_form.value
+                if lesson.schedule_form
+                else None,
+                week_number=lesson.week_number.value if lesson.week_number else None,
+                day_name=lesson.day_name.value if lesson.day_name else None,
+                day_date=lesson.day_date,
+                duration=int(lesson.duration.total_seconds())
+                if lesson.duration
+                else None,
+                lesson_type=lesson.lesson_type.value if lesson.lesson_type else None,
+                groups=lesson.groups,
+                professors=lesson.professors,
+                auditorium=lesson.auditorium,
+                location=lesson.location,
+                subgroups=lesson.subgroups.value,
+            )
+            for lesson in timetable.lessons
+        ],
+    )
+
+
+def _day_filter(timetable: TimetableData) -> List:
+    return (
+        FilteredLessonsBuilder(timetable.lessons)
+        .week_number(WeekNumber.EVEN)
+        .day_name(DayName.TUESDAY)
+        .schedule_type(ScheduleType.REGULAR)
+        .subgroup(Subgroup.FIRST)
+        .build()
+    )
+
+
+async def run(dataset: SyntheticDataset, repeat: int) -> List[BenchmarkResult]:
+    database = InMemoryDatabase(dataset)
+    group = dataset.largest(EntityType.GROUP)
+    professor = dataset.largest(EntityType.PROFESSOR)
+    typo = group.entity.name[:-1] + "9"
+    results = []
+
+    results.append(
+        await measure_async(
+            "search_exact",
+            lambda: SearchEntityBuilder(database).name(group.entity.name).fetch(),
+            repeat=repeat,
+        )
+    )
+    results.append(
+        await measure_async(
+            "search_fuzzy",
+            lambda: (
+                SearchEntityBuilder(database).name(typo).fuzzy(True, 0.5, 0.05).fetch()
+            ),
+            repeat=max(repeat // 10, 5),
+            items=len(dataset.timetables),
+        )
+    )
+
+    for timetable in (group, professor):
+        kind = timetable.entity.type.value
+        results.append(
+            measure(
+                f"filter_scan_{kind}",
+                lambda: _day_filter(timetable),
+                repeat=repeat,
+                items=len(timetable.lessons),
+            )
+        )
+        results.append(
+            measure(
+                f"day_view_{kind}",
+                lambda: DayView.for_timetable(timetable).lessons(
+                    ScheduleType.REGULAR,
+                    WeekNumber.EVEN,
+                    DayName.TUESDAY,
+                    Subgroup.FIRST,
+                ),
+                repeat=repeat,
+            )
+        )
+        results.append(
+            measure(
+                f"day_view_build_{kind}",
+                lambda: DayView(timetable.lessons),
+                repeat=repeat,
+                items=len(timetable.lessons),
+            )
+        )
+
+    results.append(
+        await measure_async(
+            "occupancy_free_auditoriums",
+            lambda: (
+                SearchOccupancyBuilder(database)
+                .entity_type(EntityType.AUDITORIUM)
+                .name_prefix("Л")
+                .week_number(WeekNumber.ODD)
+                .day_name(DayName.TUESDAY)
+                .slot(3)
+                .fetch_free()
+            ),
+            repeat=repeat,
+        )
+    )
+
+    document = _to_document(group)
+    converter = Database("mongodb://localhost:27017")
+    results.append(
+        measure(
+            "model_from_document",
+            lambda: converter._from_model(document),
+            repeat=repeat,
+            items=len(group.lessons),
+        )
+    )
+
+    results.append(
+        measure(
+            "cache_codec_roundtrip",
+            lambda: pickle.loads(pickle.dumps(group)),
+            repeat=repeat,
+            items=len(group.lessons),
+        )
+    )
+    all_timetables = dataset.timetables
+    results.append(
+        measure(
+            "cache_codec_roundtrip_all",
+            lambda: pickle.loads(pickle.dumps(all_timetables)),
+            repeat=max(repeat // 20, 3),
+            items=len(all_timetables),
+        )
+    )
+
+    return results
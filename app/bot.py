@@ -3,8 +3,9 @@ from aiogram.filters import Command, CommandStart, CommandObject
 from aiogram.utils.deep_linking import decode_payload
 from aiogram.types import Message
 from aiogram.enums.parse_mode import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-from profiler import profile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from profiler import profile, metrics
 from config import settings
 from aiogram_dialog import (
     Dialog,
@@ -13,41 +14,89 @@ from aiogram_dialog import (
     StartMode,
     ShowMode,
 )
-from parser_types import (
-    TimetableChangeData,
-    ChangeType,
-    Lesson,
-)
+from parser_types import TimetableChangeData
 from windows.states import BotStates
 from loguru import logger
 import logging
 import sys
+from datetime import datetime
+from typing import Dict, List, Tuple
 from windows import tutorial_window, wait_for_entity_choose_window, timetable_window
 from database_searcher import SearchEntityBuilder
-from database import database
-from var_dump import var_dump
+from database import database, DELIVERY_IMMEDIATE
+from digest import DigestScheduler, next_digest_time
+from tomorrow import TomorrowPush
+from webhook import run_webhook
+from dialog_storage import create_storage, create_isolation
+from notifier import NotificationSender
+from outbox import NotificationOutbox
+from deep_links import deep_links
+from notification_text import (
+    NOTIFICATION_TITLE,
+    changes_for_subgroup,
+    notification_entity_names,
+    render_notification,
+)
 from aiogram.utils.chat_action import ChatActionSender
-from aiogram.utils.deep_linking import create_start_link
 
 dialog = Dialog(tutorial_window, wait_for_entity_choose_window, timetable_window)
 
 
-storage = MemoryStorage()
+storage = create_storage(
+    settings.FSM_STORAGE, settings.REDIS_URI, settings.FSM_STATE_TTL_SECONDS
+)
 
 
 class BotRunner:
     bot = None
     dp = None
+    sender = None
+    outbox = None
+    digests = None
+    tomorrow = None
 
     @staticmethod
     @profile(func_name="bot_runner_init")
     async def init(token: str):
-        BotRunner.bot = Bot(token=settings.BOT_TOKEN)
+        session = (
+            AiohttpSession(api=TelegramAPIServer.from_base(settings.BOT_API_SERVER))
+            if settings.BOT_API_SERVER
+            else None
+        )
+        BotRunner.bot = Bot(token=settings.BOT_TOKEN, session=session)
         BotRunner.dp = Dispatcher(storage=storage)
+        BotRunner.sender = NotificationSender(
+            BotRunner.bot,
+            global_rate=settings.NOTIFICATION_GLOBAL_RATE,
+            per_chat_rate=settings.NOTIFICATION_PER_CHAT_RATE,
+            concurrency=settings.NOTIFICATION_CONCURRENCY,
+            on_blocked=database.user_unsubscribe_all,
+        )
+        BotRunner.outbox = NotificationOutbox(
+            database,
+            BotRunner.sender,
+            lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+            poll_interval=settings.OUTBOX_POLL_INTERVAL,
+            max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+            retry_delay=settings.OUTBOX_RETRY_DELAY,
+        )
+        BotRunner.digests = DigestScheduler(
+            database,
+            BotRunner.send_changes,
+            lease_seconds=settings.OUTBOX_LEASE_SECONDS,
+            poll_interval=settings.DIGEST_POLL_INTERVAL,
+            max_attempts=settings.DIGEST_MAX_ATTEMPTS,
+        )
+        BotRunner.tomorrow = TomorrowPush(
+            database,
+            BotRunner.outbox,
+            BotRunner.bot,
+            push_time=settings.TOMORROW_PUSH_TIME,
+        )
 
         BotRunner.dp["bot_instance"] = BotRunner.bot
         BotRunner.dp.include_router(dialog)
-        setup_dialogs(BotRunner.dp)
+        setup_dialogs(BotRunner.dp, events_isolation=create_isolation(storage))
 
         BotRunner.dp.message.register(BotRunner._process_help, Command("help"))
         BotRunner.dp.message.register(
@@ -59,77 +108,37 @@ class BotRunner:
         logger.debug("Инициализация бота прошла успешно")
 
     @staticmethod
-    async def run_bot():
+    async def run_bot(worker: int = 0):
         logging.basicConfig(level=logging.INFO, stream=sys.stdout)
-        await BotRunner.dp.start_polling(BotRunner.bot, skip_updates=True)
-
-    @staticmethod
-    async def _format_lesson(lesson: Lesson, bot: Bot = None) -> str:
-        result = ""
-
-        name = lesson.lesson_name
-
-        if lesson.day_date:
-            date_str = lesson.day_date.strftime("%d.%m.%Y")
-            time_str = lesson.time_begin.strftime("%H:%M") if lesson.time_begin else ""
-            if time_str:
-                result += f"<b>{date_str}, {time_str} - {name}</b>\n"
-            else:
-                result += f"<b>{date_str} - {name}</b>\n"
+        if settings.BOT_MODE == "webhook":
+            await run_webhook(
+                BotRunner.dp,
+                BotRunner.bot,
+                settings.WEBHOOK_BASE_URL,
+                path=settings.WEBHOOK_PATH,
+                host=settings.WEBHOOK_HOST,
+                port=settings.WEBHOOK_PORT,
+                secret_token=settings.WEBHOOK_SECRET,
+                max_concurrent=settings.WEBHOOK_MAX_CONCURRENT_UPDATES,
+                max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                shutdown_timeout=settings.WEBHOOK_SHUTDOWN_TIMEOUT,
+                reuse_port=settings.WEBHOOK_WORKERS > 1,
+                # Адрес регистрирует один процесс, остальные только слушают порт
+                register=worker == 0,
+            )
         else:
-            week = lesson.week_number.value if lesson.week_number else ""
-            day = lesson.day_name.value if lesson.day_name else ""
-            time_str = lesson.time_begin.strftime("%H:%M") if lesson.time_begin else ""
-
-            header_parts = []
-            if week:
-                header_parts.append(week)
-            if day:
-                header_parts.append(day)
-            if time_str:
-                header_parts.append(time_str)
-
-            if header_parts:
-                result += f"<b>{', '.join(header_parts)} - {name}</b>\n"
-            else:
-                result += f"<b>{name}</b>\n"
-
-        if lesson.lesson_type:
-            result += f"Тип: {lesson.lesson_type.value}\n"
-
-        if lesson.auditorium:
-            if bot:
-                link = await BotRunner._get_quick_link(bot, lesson.auditorium)
-                result += f"Аудитория: <a href='{link}'>{lesson.auditorium}</a>\n"
-            else:
-                result += f"Аудитория: {lesson.auditorium}\n"
-
-        if lesson.professors:
-            if bot:
-                profs_links = []
-                for professor in lesson.professors:
-                    link = await BotRunner._get_quick_link(bot, professor)
-                    profs_links.append(f"<a href='{link}'>{professor}</a>")
-                result += f"Преподаватели: {', '.join(profs_links)}\n"
-            else:
-                result += f"Преподаватели: {', '.join(lesson.professors)}\n"
-
-        if hasattr(lesson, "subgroups") and lesson.subgroups and lesson.subgroups.value:
-            result += f"Подгруппа: {lesson.subgroups.value}\n"
-
-        if lesson.groups and bot:
-            groups_links = []
-            for group in lesson.groups:
-                link = await BotRunner._get_quick_link(bot, group)
-                groups_links.append(f"<a href='{link}'>{group}</a>")
-            if groups_links:
-                result += f"Группы: {', '.join(groups_links)}\n"
-
-        return result
+            await BotRunner.dp.start_polling(BotRunner.bot, skip_updates=True)
 
     @staticmethod
-    async def _get_quick_link(bot: Bot, entity_name: str):
-        return await create_start_link(bot, f"{entity_name}", encode=True)
+    @profile(func_name="bot_runner_render_notification")
+    async def render_notification(
+        message: TimetableChangeData, title: str = NOTIFICATION_TITLE
+    ) -> List[str]:
+        # Ссылки строятся до рендера, сам текст собирается синхронно
+        links = await deep_links.links(
+            BotRunner.bot, notification_entity_names(message)
+        )
+        return render_notification(message, links, title=title)
 
     @staticmethod
     @profile(func_name="bot_runner_receive_notification")
@@ -137,228 +146,73 @@ class BotRunner:
         if not message.lesson_changes:
             return
 
-        users = await database.get_subscribed_users(message.entity.name)
-        if not users:
+        subscriptions = await database.get_subscriptions(message.entity.name)
+        if not subscriptions:
             return
 
-        link = await BotRunner._get_quick_link(BotRunner.bot, message.entity.name)
-        text = f"🔔 <b>Изменения в расписании: <a href='{link}'>{message.entity.name}</a></b>\n\n"
-
-        for change in message.lesson_changes:
-            if change.change_type == ChangeType.LESSON_ADDED:
-                text += f"<b>➕ Добавлено занятие:</b>\n"
-                text += await BotRunner._format_lesson(change.new_lesson, BotRunner.bot)
-                text += "\n"
-            elif change.change_type == ChangeType.LESSON_REMOVED:
-                text += f"<b>➖ Удалено занятие:</b>\n"
-                text += await BotRunner._format_lesson(change.old_lesson, BotRunner.bot)
-                text += "\n"
-            else:  # LESSON_MODIFIED
-                text += f"<b>🔄 Изменено занятие:</b>\n"
-
-                old_lesson = change.old_lesson
-                new_lesson = change.new_lesson
-
-                if new_lesson.day_date:
-                    date_str = new_lesson.day_date.strftime("%d.%m.%Y")
-                    time_str = (
-                        new_lesson.time_begin.strftime("%H:%M")
-                        if new_lesson.time_begin
-                        else ""
-                    )
-                    if time_str:
-                        text += f"<b>{date_str}, {time_str} - {new_lesson.lesson_name}</b>\n"
-                    else:
-                        text += f"<b>{date_str} - {new_lesson.lesson_name}</b>\n"
-                else:
-                    week = (
-                        new_lesson.week_number.value if new_lesson.week_number else ""
-                    )
-                    day = new_lesson.day_name.value if new_lesson.day_name else ""
-                    time_str = (
-                        new_lesson.time_begin.strftime("%H:%M")
-                        if new_lesson.time_begin
-                        else ""
-                    )
-
-                    header_parts = []
-                    if week:
-                        header_parts.append(week)
-                    if day:
-                        header_parts.append(day)
-                    if time_str:
-                        header_parts.append(time_str)
-
-                    if header_parts:
-                        text += f"<b>{', '.join(header_parts)} - {new_lesson.lesson_name}</b>\n"
-                    else:
-                        text += f"<b>{new_lesson.lesson_name}</b>\n"
-
-                changes = []
-
-                old_aud = old_lesson.auditorium
-                new_aud = new_lesson.auditorium
-                if old_aud != new_aud:
-                    if BotRunner.bot:
-                        old_link = (
-                            await BotRunner._get_quick_link(BotRunner.bot, old_aud)
-                            if old_aud
-                            else ""
-                        )
-                        new_link = (
-                            await BotRunner._get_quick_link(BotRunner.bot, new_aud)
-                            if new_aud
-                            else ""
-                        )
-
-                        old_text = (
-                            f"<a href='{old_link}'>{old_aud}</a>" if old_aud else ""
-                        )
-                        new_text = (
-                            f"<a href='{new_link}'>{new_aud}</a>" if new_aud else ""
-                        )
-
-                        changes.append(
-                            f"Аудитория: <s>{old_text}</s> → <b>{new_text}</b>"
-                        )
-                    else:
-                        changes.append(
-                            f"Аудитория: <s>{old_aud}</s> → <b>{new_aud}</b>"
-                        )
-
-                old_type = (
-                    old_lesson.lesson_type.value if old_lesson.lesson_type else ""
-                )
-                new_type = (
-                    new_lesson.lesson_type.value if new_lesson.lesson_type else ""
-                )
-                if old_type != new_type and old_type and new_type:
-                    changes.append(f"Тип: <s>{old_type}</s> → <b>{new_type}</b>")
-
-                old_profs = old_lesson.professors if old_lesson.professors else []
-                new_profs = new_lesson.professors if new_lesson.professors else []
-
-                if str(old_profs) != str(new_profs):
-                    if BotRunner.bot:
-                        old_links = []
-                        for prof in old_profs:
-                            link = await BotRunner._get_quick_link(BotRunner.bot, prof)
-                            old_links.append(f"<a href='{link}'>{prof}</a>")
-
-                        new_links = []
-                        for prof in new_profs:
-                            link = await BotRunner._get_quick_link(BotRunner.bot, prof)
-                            new_links.append(f"<a href='{link}'>{prof}</a>")
-
-                        old_text = ", ".join(old_links) if old_links else ""
-                        new_text = ", ".join(new_links) if new_links else ""
-
-                        if old_text and new_text:
-                            changes.append(
-                                f"Преподаватели: <s>{old_text}</s> → <b>{new_text}</b>"
-                            )
-                    else:
-                        old_text = ", ".join(old_profs) if old_profs else ""
-                        new_text = ", ".join(new_profs) if new_profs else ""
-                        if old_text and new_text:
-                            changes.append(
-                                f"Преподаватели: <s>{old_text}</s> → <b>{new_text}</b>"
-                            )
-
-                if hasattr(old_lesson, "subgroups") and hasattr(
-                    new_lesson, "subgroups"
-                ):
-                    old_subgroup = (
-                        old_lesson.subgroups.value if old_lesson.subgroups else ""
-                    )
-                    new_subgroup = (
-                        new_lesson.subgroups.value if new_lesson.subgroups else ""
-                    )
-                    if old_subgroup != new_subgroup and old_subgroup and new_subgroup:
-                        changes.append(
-                            f"Подгруппа: <s>{old_subgroup}</s> → <b>{new_subgroup}</b>"
-                        )
-
-                if (
-                    old_lesson.day_date
-                    and new_lesson.day_date
-                    and old_lesson.day_date != new_lesson.day_date
-                ):
-                    old_date = old_lesson.day_date.strftime("%d.%m.%Y")
-                    new_date = new_lesson.day_date.strftime("%d.%m.%Y")
-                    changes.append(f"Дата: <s>{old_date}</s> → <b>{new_date}</b>")
-
-                old_time = (
-                    old_lesson.time_begin.strftime("%H:%M")
-                    if old_lesson.time_begin
-                    else ""
+        # Подписки со сводками копят изменения до своего времени отправки
+        now = datetime.now()
+        immediate: List[int] = []
+        digests: Dict[Tuple[str, datetime], List[int]] = {}
+        for subscription in subscriptions:
+            if subscription.delivery_mode == DELIVERY_IMMEDIATE:
+                immediate.append(subscription.tg_id)
+            else:
+                due_at = next_digest_time(
+                    subscription.delivery_mode, subscription.digest_time, now
                 )
-                new_time = (
-                    new_lesson.time_begin.strftime("%H:%M")
-                    if new_lesson.time_begin
-                    else ""
+                digests.setdefault((subscription.delivery_mode, due_at), []).append(
+                    subscription.tg_id
                 )
-                if old_time != new_time and old_time and new_time:
-                    changes.append(f"Время: <s>{old_time}</s> → <b>{new_time}</b>")
-
-                if not old_lesson.day_date and not new_lesson.day_date:
-                    old_day = old_lesson.day_name.value if old_lesson.day_name else ""
-                    new_day = new_lesson.day_name.value if new_lesson.day_name else ""
-                    if old_day != new_day and old_day and new_day:
-                        changes.append(f"День: <s>{old_day}</s> → <b>{new_day}</b>")
-
-                if not old_lesson.day_date and not new_lesson.day_date:
-                    old_week = (
-                        old_lesson.week_number.value if old_lesson.week_number else ""
-                    )
-                    new_week = (
-                        new_lesson.week_number.value if new_lesson.week_number else ""
-                    )
-                    if old_week != new_week and old_week and new_week:
-                        changes.append(f"Неделя: <s>{old_week}</s> → <b>{new_week}</b>")
-
-                if old_lesson.lesson_name != new_lesson.lesson_name:
-                    changes.append(
-                        f"Название: <s>{old_lesson.lesson_name}</s> → <b>{new_lesson.lesson_name}</b>"
-                    )
-
-                if old_lesson.groups != new_lesson.groups and BotRunner.bot:
-                    old_groups = old_lesson.groups if old_lesson.groups else []
-                    new_groups = new_lesson.groups if new_lesson.groups else []
 
-                    old_links = []
-                    for group in old_groups:
-                        link = await BotRunner._get_quick_link(BotRunner.bot, group)
-                        old_links.append(f"<a href='{link}'>{group}</a>")
+        for (delivery_mode, due_at), users in digests.items():
+            await BotRunner.digests.add(message, delivery_mode, due_at, users)
 
-                    new_links = []
-                    for group in new_groups:
-                        link = await BotRunner._get_quick_link(BotRunner.bot, group)
-                        new_links.append(f"<a href='{link}'>{group}</a>")
+        if immediate:
+            await BotRunner.send_changes(message, immediate)
 
-                    old_text = ", ".join(old_links) if old_links else ""
-                    new_text = ", ".join(new_links) if new_links else ""
-
-                    if old_text and new_text:
-                        changes.append(f"Группы: <s>{old_text}</s> → <b>{new_text}</b>")
-
-                if changes:
-                    text += "Изменения:\n"
-                    for change_info in changes:
-                        text += f"• {change_info}\n"
-                else:
-                    text += "<i>Нет значимых изменений</i>\n"
-
-                text += "\n"
-
-        if len(text) > 4000:
-            text = text[:3950] + "...\n\n<i>Сообщение слишком длинное</i>"
+    @staticmethod
+    @profile(func_name="bot_runner_send_changes")
+    async def send_changes(
+        message: TimetableChangeData,
+        users: List[int],
+        title: str = NOTIFICATION_TITLE,
+    ):
+        audience = await database.get_subscribers_by_subgroup(
+            message.entity.name, users
+        )
 
-        for user in users:
-            try:
-                await BotRunner.bot.send_message(user, text, parse_mode=ParseMode.HTML)
-            except Exception as e:
-                var_dump(f"Ошибка отправки: {e}")
+        # Каждый подписчик получает только изменения своей подгруппы. Подгруппы
+        # с одинаковым набором изменений получают один общий текст
+        variants: Dict[
+            Tuple[int, ...], Tuple[TimetableChangeData, List[int], List[str]]
+        ] = {}
+        for subgroup, subgroup_users in audience.items():
+            variant = changes_for_subgroup(message, subgroup)
+            if not variant.lesson_changes:
+                metrics.increment("notifications_filtered_out", len(subgroup_users))
+                continue
+            key = tuple(map(id, variant.lesson_changes))
+            if key in variants:
+                variants[key][1].extend(subgroup_users)
+                variants[key][2].append(subgroup.value)
+            else:
+                variants[key] = (variant, list(subgroup_users), [subgroup.value])
+
+        delivery_id = NotificationOutbox.delivery_identity(message)
+        for variant, variant_users, subgroups in variants.values():
+            parts = await BotRunner.render_notification(variant, title)
+
+            # Рассылка идет из outbox: после записи сообщение брокера можно
+            # подтвердить, а прерванная рассылка продолжится с недоставленных чатов
+            await BotRunner.outbox.enqueue(
+                delivery_id,
+                ",".join(sorted(subgroups)),
+                message.entity.name,
+                parts,
+                variant_users,
+                ParseMode.HTML,
+            )
 
     @staticmethod
     @profile(func_name="bot_runner_process_start")
@@ -1,61 +1,92 @@
 import aio_pika
-import json
 from typing import List, Dict, Any, Callable, Optional, Union
-from parser_types import (
-    TimetableChangeData,
-    Entity,
-    EntityType,
-    FieldChange,
-    ChangeType,
-    LessonChange,
-    Lesson,
-    ScheduleType,
-    ScheduleForm,
-    WeekNumber,
-    DayName,
-    LessonType,
-    Subgroup,
-)
-from profiler import profile
+from parser_types import TimetableChangeData
+from codec import CODEC_VERSION, encode_change, decode_change
+from profiler import profile, metrics
 from logger import trace
 from loguru import logger
 import asyncio
-from datetime import date, time, datetime, timedelta
-from enum import Enum
-
-
-class DataEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, Enum):
-            return {"__enum__": obj.value}
-        if isinstance(obj, (date, datetime)):
-            return {"__datetime__": obj.isoformat()}
-        if isinstance(obj, time):
-            return {"__time__": obj.isoformat()}
-        if isinstance(obj, timedelta):
-            return {"__timedelta__": obj.total_seconds()}
-        if isinstance(obj, Lesson):
-            return {"__lesson__": obj.__dict__}
-        if isinstance(obj, Entity):
-            return {"__entity__": obj.__dict__}
-        if isinstance(obj, FieldChange):
-            return {"__fieldchange__": obj.__dict__}
-        if isinstance(obj, LessonChange):
-            return {"__lessonchange__": obj.__dict__}
-        if isinstance(obj, TimetableChangeData):
-            return {"__timetablechangedata__": obj.__dict__}
-        return super().default(obj)
+import hashlib
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from time import perf_counter, time as timestamp
+from datetime import datetime
+
+
+@dataclass
+class PublishBatchStats:
+    messages: int
+    changes: int
+    bytes: int
+    seconds: float
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.seconds if self.seconds else 0.0
+
+
+@dataclass
+class DeadLetter:
+    body: bytes
+    attempts: int
+    reason: Optional[str]
+    failed_at: Optional[str]
+    change: Optional[TimetableChangeData]
+
+
+RETRY_COUNT_HEADER = "x-retry-count"
+ERROR_HEADER = "x-last-error"
+FAILED_AT_HEADER = "x-failed-at"
+PUBLISHED_AT_HEADER = "x-published-at"
 
 
 class Broker:
-    def __init__(self, connection_string: str, queue_name: str = "timetable_changes"):
+    def __init__(
+        self,
+        connection_string: str,
+        queue_name: str = "timetable_changes",
+        prefetch_count: int = 20,
+        shutdown_timeout: float = 30.0,
+        publish_batch_size: int = 200,
+        publish_window: int = 50,
+        publish_coalesce: bool = False,
+        codec_version: int = CODEC_VERSION,
+        max_attempts: int = 5,
+        retry_delay: float = 5.0,
+        retry_max_delay: float = 300.0,
+        metrics_interval: float = 15.0,
+        lag_alert: float = 60.0,
+    ):
         self.connection_string = connection_string
         self.queue_name = queue_name
+        self.prefetch_count = prefetch_count
+        self.shutdown_timeout = shutdown_timeout
+        self.publish_batch_size = publish_batch_size
+        self.publish_window = publish_window
+        self.publish_coalesce = publish_coalesce
+        self.codec_version = codec_version
+        self.max_attempts = max(max_attempts, 1)
+        # Задержки перед повторами растут вдвое: 5, 10, 20, ... секунд
+        self.retry_delays = [
+            min(retry_delay * 2**attempt, retry_max_delay)
+            for attempt in range(self.max_attempts - 1)
+        ]
+        self.dead_queue_name = f"{queue_name}.dead"
+        self.metrics_interval = metrics_interval
+        self.lag_alert = lag_alert
+        self.publish_stats: List[PublishBatchStats] = []
         self.connection = None
         self.channel = None
         self.initialized = False
         self.consumer_tag = None
         self.queue = None
+        self.dead_queue = None
+        self._handling = set()
+        self._entity_locks: Dict[str, List[Any]] = {}
+        self._deferred = set()
+        self._sampler_task: Optional[asyncio.Task] = None
+        self._max_age = 0.0
 
     async def __aenter__(self):
         await self.initialize()
@@ -69,13 +100,34 @@ class Broker:
         if not self.initialized:
             try:
                 self.connection = await aio_pika.connect_robust(self.connection_string)
-                self.channel = await self.connection.channel()
+                # С подтверждениями издателя publish завершается только после ack брокера
+                self.channel = await self.connection.channel(publisher_confirms=True)
+                # Сервер не отдает больше prefetch_count неподтвержденных сообщений
+                await self.channel.set_qos(prefetch_count=self.prefetch_count)
 
                 # Создаем очередь с durable=True для сохранения сообщений при перезагрузке
                 self.queue = await self.channel.declare_queue(
                     self.queue_name, durable=True
                 )
 
+                # Очереди задержки без потребителей: по истечении TTL RabbitMQ
+                # возвращает сообщение в основную очередь через default exchange.
+                # Задержка входит в имя, чтобы смена настроек не конфликтовала
+                # с аргументами уже объявленных очередей
+                for delay in sorted(set(self.retry_delays)):
+                    await self.channel.declare_queue(
+                        self._retry_queue_name(delay),
+                        durable=True,
+                        arguments={
+                            "x-message-ttl": int(delay * 1000),
+                            "x-dead-letter-exchange": "",
+                            "x-dead-letter-routing-key": self.queue_name,
+                        },
+                    )
+                self.dead_queue = await self.channel.declare_queue(
+                    self.dead_queue_name, durable=True
+                )
+
                 self.initialized = True
                 logger.debug("Подключение к RabbitMQ инициализировано успешно")
             except Exception as e:
@@ -85,33 +137,103 @@ class Broker:
                 self.connection = None
                 self.channel = None
                 self.queue = None
+                self.dead_queue = None
                 self.initialized = False
                 raise e
 
+    @staticmethod
+    def merge_changes(changes: List[TimetableChangeData]) -> List[TimetableChangeData]:
+        merged: Dict[tuple, TimetableChangeData] = {}
+        for change in changes:
+            key = (change.entity.type, change.entity.id)
+            target = merged.get(key)
+            if target is None:
+                merged[key] = TimetableChangeData(
+                    entity=change.entity,
+                    metadata_changes=list(change.metadata_changes)
+                    if change.metadata_changes is not None
+                    else None,
+                    lesson_changes=list(change.lesson_changes)
+                    if change.lesson_changes is not None
+                    else None,
+                )
+                continue
+
+            if change.metadata_changes:
+                target.metadata_changes = (
+                    target.metadata_changes or []
+                ) + change.metadata_changes
+            if change.lesson_changes:
+                target.lesson_changes = (
+                    target.lesson_changes or []
+                ) + change.lesson_changes
+
+        return list(merged.values())
+
     @profile(func_name="broker_send_changes")
-    async def send_changes(self, changes: List[TimetableChangeData]) -> bool:
+    async def send_changes(
+        self,
+        changes: List[TimetableChangeData],
+        batch_size: Optional[int] = None,
+        window: Optional[int] = None,
+        coalesce: Optional[bool] = None,
+    ) -> bool:
+        self.publish_stats = []
         if not changes:
             return True
 
+        batch_size = max(batch_size or self.publish_batch_size, 1)
+        window = asyncio.Semaphore(max(window or self.publish_window, 1))
+        if coalesce if coalesce is not None else self.publish_coalesce:
+            changes = Broker.merge_changes(changes)
+
         try:
             await self.initialize()
 
-            for change in changes:
-                try:
-                    message = aio_pika.Message(
-                        body=json.dumps(change, cls=DataEncoder).encode(),
-                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                    )
+            for offset in range(0, len(changes), batch_size):
+                batch = changes[offset : offset + batch_size]
+                started = perf_counter()
+
+                bodies = [encode_change(change, self.codec_version) for change in batch]
+
+                async def publish(body: bytes):
+                    async with window:
+                        await self.channel.default_exchange.publish(
+                            aio_pika.Message(
+                                body=body,
+                                headers={PUBLISHED_AT_HEADER: timestamp()},
+                                message_id=uuid.uuid4().hex,
+                                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                            ),
+                            routing_key=self.queue_name,
+                        )
 
-                    await self.channel.default_exchange.publish(
-                        message, routing_key=self.queue_name
+                # Публикации пакета идут конвейером: ждем подтверждения всех разом
+                results = await asyncio.gather(
+                    *(publish(body) for body in bodies), return_exceptions=True
+                )
+                errors = [result for result in results if isinstance(result, Exception)]
+                if errors:
+                    logger.error(
+                        f"Ошибка при отправке изменений: {len(errors)} из "
+                        f"{len(bodies)} сообщений пакета не подтверждены: {errors[0]!r}"
                     )
-                except Exception as e:
-                    logger.error(f"Ошибка при сериализации/отправке изменения: {e}")
-                    import traceback
+                    return False
 
-                    logger.error(traceback.format_exc())
-                    raise
+                stats = PublishBatchStats(
+                    messages=len(bodies),
+                    changes=sum(len(change.lesson_changes or []) for change in batch),
+                    bytes=sum(len(body) for body in bodies),
+                    seconds=perf_counter() - started,
+                )
+                self.publish_stats.append(stats)
+                metrics.increment("broker_published", stats.messages)
+                metrics.observe("broker_publish_batch_time", stats.seconds)
+                logger.debug(
+                    f"Отправлен пакет из {stats.messages} сообщений "
+                    f"({stats.bytes} байт) за {stats.seconds:.3f} с, "
+                    f"{stats.messages_per_second:.0f} сообщ./с"
+                )
 
             return True
         except Exception as e:
@@ -120,53 +242,319 @@ class Broker:
 
     @profile(func_name="broker_start_consuming")
     async def start_consuming(
-        self, callback: Callable[[Dict[str, Any]], Union[bool, None]]
+        self,
+        callback: Callable[[TimetableChangeData], Union[bool, None, asyncio.Future]],
     ):
         try:
             await self.initialize()
 
-            async def process_message(message: aio_pika.IncomingMessage):
-                async with message.process():
-                    try:
-                        body = message.body.decode()
-                        data = Broker.process_message(body)
-                        logger.debug(f"Получено сообщение из RabbitMQ: {data}")
-
-                        result = (
-                            await callback(data)
-                            if asyncio.iscoroutinefunction(callback)
-                            else callback(data)
-                        )
-
-                        if result is False:
-                            await message.reject(requeue=True)
-                            logger.debug("Сообщение отклонено и возвращено в очередь")
-                        else:
-                            await message.ack()
-                            logger.debug("Сообщение успешно обработано и подтверждено")
-                    except Exception as e:
-                        logger.error(f"Ошибка обработки сообщения: {e}")
-                        await message.reject(requeue=True)
-                        logger.debug(
-                            "Сообщение отклонено из-за ошибки и возвращено в очередь"
-                        )
-
-            self.consumer_tag = await self.queue.consume(process_message)
-            logger.info(f"Начато потребление сообщений из очереди {self.queue_name}")
+            # aio-pika обрабатывает каждое сообщение в своей задаче, параллельность
+            # ограничивает prefetch. Изменения одной сущности идут по очереди (см.
+            # _entity_turn), но только внутри процесса: второй потребитель той же
+            # очереди (процесс webhook, реплика) получит часть изменений сущности
+            # и обработает их параллельно, поэтому потребитель у очереди один
+            async def on_message(message: aio_pika.abc.AbstractIncomingMessage):
+                task = asyncio.current_task()
+                self._handling.add(task)
+                try:
+                    self._observe_age(message)
+                    started = perf_counter()
+                    data = Broker.process_message(message.body)
+                    metrics.observe("broker_decode_time", perf_counter() - started)
+                    if data is not None:
+                        data.delivery_id = Broker.delivery_id(message)
+                    async with self._entity_turn(data):
+                        await self._handle_message(message, data, callback)
+                finally:
+                    self._handling.discard(task)
+
+            self.consumer_tag = await self.queue.consume(on_message)
+            logger.info(
+                f"Начато потребление сообщений из очереди {self.queue_name} "
+                f"(prefetch={self.prefetch_count})"
+            )
+            if self.metrics_interval > 0:
+                self._sampler_task = asyncio.create_task(self._sample_metrics())
 
         except Exception as e:
             logger.error(f"Ошибка при настройке потребления сообщений: {e}")
             raise
 
+    @staticmethod
+    def delivery_id(message: aio_pika.abc.AbstractIncomingMessage) -> str:
+        # Повторная доставка и повтор через очередь задержки сохраняют id,
+        # а новое сообщение с тем же содержанием получает свой
+        if message.message_id:
+            return message.message_id
+        # Издатели без message_id: тело вместе со временем публикации
+        digest = hashlib.sha256(message.body)
+        published_at = (message.headers or {}).get(PUBLISHED_AT_HEADER)
+        digest.update(repr(published_at).encode())
+        return digest.hexdigest()
+
+    def _observe_age(self, message: aio_pika.abc.AbstractIncomingMessage):
+        # Возраст сообщения включает и ожидание в очередях повторов
+        published_at = (message.headers or {}).get(PUBLISHED_AT_HEADER)
+        if not isinstance(published_at, (int, float)):
+            return
+        age = max(timestamp() - published_at, 0.0)
+        metrics.observe("broker_message_age", age)
+        metrics.gauge("broker_consume_lag", age)
+        self._max_age = max(self._max_age, age)
+
+    async def _sample_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                # Повторное объявление с теми же аргументами возвращает глубину очереди
+                declared = await self.queue.declare()
+                metrics.gauge("broker_queue_depth", declared.message_count)
+                if self.dead_queue is not None:
+                    declared = await self.dead_queue.declare()
+                    metrics.gauge("broker_dead_queue_depth", declared.message_count)
+            except Exception as e:
+                logger.warning(f"Не удалось получить глубину очереди: {e}")
+
+            metrics.gauge("broker_handling", len(self._handling))
+            metrics.gauge("broker_deferred", len(self._deferred))
+
+            max_age, self._max_age = self._max_age, 0.0
+            if self.lag_alert > 0 and max_age > self.lag_alert:
+                logger.warning(
+                    f"Отставание обработки очереди {self.queue_name}: "
+                    f"{max_age:.1f} с (порог {self.lag_alert:g} с), "
+                    f"в очереди {metrics.gauges.get('broker_queue_depth', 0)} сообщений"
+                )
+
+    @asynccontextmanager
+    async def _entity_turn(self, data: Optional[TimetableChangeData]):
+        # Lock пропускает ожидающих в порядке прихода, а задачи сообщений
+        # доходят до него в порядке доставки: изменения сущности не обгоняют
+        # друг друга, разные сущности обрабатываются параллельно
+        if data is None:
+            yield
+            return
+
+        key = f"{data.entity.type.value}:{data.entity.id}"
+        entry = self._entity_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._entity_locks[key]
+
+    @profile(func_name="broker_handle_message")
+    async def _handle_message(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        data: Optional[TimetableChangeData],
+        callback: Callable[[TimetableChangeData], Any],
+    ):
+        try:
+            if data is None:
+                # Повтор не поможет: сразу в очередь недоставленных
+                await self._dead_letter(message, "Сообщение не удалось декодировать")
+                return
+
+            logger.debug(f"Получено сообщение из RabbitMQ: {data}")
+
+            # Повторы идут здесь же, а не через очередь задержки: пока сообщение
+            # ждет повтора, более поздние изменения сущности ждут своей очереди
+            # в _entity_turn и не обгоняют его
+            attempts = Broker._attempts(message)
+            started = perf_counter()
+            while True:
+                try:
+                    result = callback(data)
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                    reason = "Обработчик отклонил сообщение"
+                except Exception as e:
+                    metrics.increment("broker_handler_errors")
+                    logger.error(f"Ошибка обработки сообщения: {e}")
+                    result, reason = False, f"{type(e).__name__}: {e}"
+
+                if isinstance(result, asyncio.Future):
+                    # Обработчик отложил результат (см. coalescer): сущность
+                    # освобождается сразу, а сообщение подтверждается, когда результат
+                    # будет готов. Повторы с удержанием сущности - на обработчике
+                    task = asyncio.create_task(
+                        self._settle_deferred(message, result, started)
+                    )
+                    self._deferred.add(task)
+                    task.add_done_callback(self._deferred.discard)
+                    return
+
+                if result is not False:
+                    metrics.observe("broker_handler_time", perf_counter() - started)
+                    await message.ack()
+                    metrics.increment("broker_acked")
+                    logger.debug("Сообщение успешно обработано и подтверждено")
+                    return
+
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    await self._dead_letter(message, reason, attempts)
+                    return
+
+                delay = self.retry_delays[min(attempts, len(self.retry_delays)) - 1]
+                metrics.increment("broker_retried")
+                logger.warning(
+                    f"Сообщение не обработано ({reason}), попытка {attempts} из "
+                    f"{self.max_attempts}, повтор через {delay:g} с"
+                )
+                await asyncio.sleep(delay)
+        except Exception as e:
+            # Неподтвержденное сообщение RabbitMQ доставит заново
+            logger.error(f"Ошибка подтверждения сообщения: {e}")
+
+    def _retry_queue_name(self, delay: float) -> str:
+        return f"{self.queue_name}.retry.{int(delay * 1000)}ms"
+
+    @staticmethod
+    def _attempts(message: aio_pika.abc.AbstractIncomingMessage) -> int:
+        try:
+            return int((message.headers or {}).get(RETRY_COUNT_HEADER, 0))
+        except (TypeError, ValueError):
+            return 0
+
+    async def _republish(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        routing_key: str,
+        headers: Dict[str, Any],
+    ):
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers={**(message.headers or {}), **headers},
+                message_id=message.message_id,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=routing_key,
+        )
+
+    async def _retry(self, message: aio_pika.abc.AbstractIncomingMessage, reason: str):
+        attempts = Broker._attempts(message) + 1
+        if attempts >= self.max_attempts:
+            await self._dead_letter(message, reason, attempts)
+            return
+
+        delay = self.retry_delays[min(attempts, len(self.retry_delays)) - 1]
+        try:
+            # Сначала публикация с подтверждением, потом ack: при сбое между ними
+            # сообщение будет обработано повторно, но не потеряно
+            await self._republish(
+                message,
+                self._retry_queue_name(delay),
+                {RETRY_COUNT_HEADER: attempts, ERROR_HEADER: reason[:500]},
+            )
+            await message.ack()
+            metrics.increment("broker_retried")
+            logger.warning(
+                f"Сообщение не обработано ({reason}), попытка {attempts} из "
+                f"{self.max_attempts}, повтор через {delay:g} с"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отложить повтор сообщения: {e}")
+            await message.reject(requeue=True)
+            metrics.increment("broker_requeued")
+
+    async def _dead_letter(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        reason: str,
+        attempts: Optional[int] = None,
+    ):
+        try:
+            await self._republish(
+                message,
+                self.dead_queue_name,
+                {
+                    RETRY_COUNT_HEADER: attempts
+                    if attempts is not None
+                    else Broker._attempts(message),
+                    ERROR_HEADER: reason[:500],
+                    FAILED_AT_HEADER: datetime.now().isoformat(),
+                },
+            )
+            await message.ack()
+            metrics.increment("broker_dead_lettered")
+            logger.error(
+                f"Сообщение перемещено в очередь {self.dead_queue_name}: {reason}"
+            )
+        except Exception as e:
+            logger.error(
+                f"Не удалось переместить сообщение в {self.dead_queue_name}: {e}"
+            )
+            await message.reject(requeue=True)
+            metrics.increment("broker_requeued")
+
+    async def _settle_deferred(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        future: asyncio.Future,
+        started: float,
+    ):
+        try:
+            result = await future
+        except Exception as e:
+            logger.error(f"Ошибка отложенной обработки сообщения: {e}")
+            result = False
+        # Для отложенных сообщений время включает окно объединения
+        metrics.observe("broker_handler_time", perf_counter() - started)
+
+        try:
+            if result is False:
+                # Обработчик уже повторял, удерживая сущность: повтор через очередь
+                # задержки пропустил бы вперед более поздние изменения
+                await self._dead_letter(
+                    message, "Обработчик отклонил сообщение", self.max_attempts
+                )
+            else:
+                await message.ack()
+                metrics.increment("broker_acked")
+        except Exception as e:
+            logger.error(f"Ошибка подтверждения сообщения: {e}")
+
     @profile(func_name="broker_stop_consuming")
     async def stop_consuming(self):
-        if self.channel and self.consumer_tag:
-            await self.channel.cancel(self.consumer_tag)
+        if self._sampler_task:
+            self._sampler_task.cancel()
+            await asyncio.gather(self._sampler_task, return_exceptions=True)
+            self._sampler_task = None
+
+        if self.queue and self.consumer_tag:
+            await self.queue.cancel(self.consumer_tag)
             self.consumer_tag = None
             logger.info(
                 f"Потребление сообщений из очереди {self.queue_name} остановлено"
             )
 
+        if self._handling:
+            # Дорабатываем уже полученные сообщения, остальные RabbitMQ отдаст заново
+            _, pending = await asyncio.wait(
+                list(self._handling), timeout=self.shutdown_timeout
+            )
+            if pending:
+                logger.warning(
+                    f"Не дождались обработки {len(pending)} сообщений, "
+                    "они будут доставлены повторно"
+                )
+
+        if self._deferred:
+            _, pending = await asyncio.wait(
+                list(self._deferred), timeout=self.shutdown_timeout
+            )
+            if pending:
+                logger.warning(
+                    f"Не дождались {len(pending)} отложенных подтверждений, "
+                    "сообщения будут доставлены повторно"
+                )
+
     @profile(func_name="broker_get_message")
     @trace
     async def get_message(self) -> Optional[TimetableChangeData]:
@@ -175,15 +563,22 @@ class Broker:
 
             message = await self.queue.get(no_ack=False)
             if message:
+                self._observe_age(message)
                 try:
-                    body = message.body.decode()
-                    data = Broker.process_message(body)
+                    data = Broker.process_message(message.body)
+                    if data is None:
+                        await self._dead_letter(
+                            message, "Сообщение не удалось декодировать"
+                        )
+                        return None
+                    data.delivery_id = Broker.delivery_id(message)
                     await message.ack()
+                    metrics.increment("broker_acked")
 
                     return data
                 except Exception as e:
                     logger.error(f"Ошибка при обработке полученного сообщения: {e}")
-                    await message.reject(requeue=True)
+                    await self._retry(message, f"{type(e).__name__}: {e}")
             return None
 
         except aio_pika.exceptions.QueueEmpty:
@@ -192,9 +587,75 @@ class Broker:
             logger.error(f"Ошибка при получении сообщения: {e}")
             return None
 
+    @staticmethod
+    def _to_dead_letter(message: aio_pika.abc.AbstractIncomingMessage) -> DeadLetter:
+        headers = message.headers or {}
+        return DeadLetter(
+            body=message.body,
+            attempts=Broker._attempts(message),
+            reason=headers.get(ERROR_HEADER),
+            failed_at=headers.get(FAILED_AT_HEADER),
+            change=Broker.process_message(message.body),
+        )
+
+    @profile(func_name="broker_peek_dead_letters")
+    async def peek_dead_letters(self, limit: int = 10) -> List[DeadLetter]:
+        await self.initialize()
+
+        # Сообщения держим неподтвержденными до конца просмотра, иначе basic.get
+        # вернет то же сообщение снова; затем возвращаем их на место
+        messages = []
+        try:
+            while len(messages) < limit:
+                message = await self.dead_queue.get(no_ack=False, fail=False)
+                if message is None:
+                    break
+                messages.append(message)
+            return [Broker._to_dead_letter(message) for message in messages]
+        finally:
+            for message in messages:
+                await message.reject(requeue=True)
+
+    @profile(func_name="broker_replay_dead_letters")
+    async def replay_dead_letters(self, limit: Optional[int] = None) -> int:
+        await self.initialize()
+
+        replayed = 0
+        while limit is None or replayed < limit:
+            message = await self.dead_queue.get(no_ack=False, fail=False)
+            if message is None:
+                break
+            try:
+                # Счетчик попыток сбрасывается: сообщение получает полный набор повторов
+                await self._republish(message, self.queue_name, {RETRY_COUNT_HEADER: 0})
+                await message.ack()
+                replayed += 1
+            except Exception as e:
+                logger.error(
+                    f"Ошибка повторной отправки недоставленного сообщения: {e}"
+                )
+                await message.reject(requeue=True)
+                break
+
+        logger.info(
+            f"Из очереди {self.dead_queue_name} повторно отправлено {replayed} сообщений"
+        )
+        return replayed
+
+    @profile(func_name="broker_purge_dead_letters")
+    async def purge_dead_letters(self) -> int:
+        await self.initialize()
+
+        result = await self.dead_queue.purge()
+        count = getattr(result, "message_count", 0)
+        logger.info(
+            f"Очередь {self.dead_queue_name} очищена, удалено {count} сообщений"
+        )
+        return count
+
     @profile(func_name="broker_close")
     async def close(self):
-        if self.consumer_tag:
+        if self.consumer_tag or self._handling:
             await self.stop_consuming()
 
         if self.connection:
@@ -202,85 +663,26 @@ class Broker:
             self.connection = None
             self.channel = None
             self.queue = None
+            self.dead_queue = None
             self.initialized = False
 
         logger.debug("RabbitMQ соединение закрыто")
 
     @staticmethod
     @profile(func_name="broker_process_message")
-    def process_message(message_body):
+    def process_message(message_body) -> Optional[TimetableChangeData]:
         try:
-            if isinstance(message_body, bytes):
-                message_body = message_body.decode("utf-8")
-
-            return json.loads(message_body, object_hook=Broker.object_hook)
+            data = decode_change(message_body)
+            if not isinstance(data, TimetableChangeData):
+                # Корректный JSON, но не изменение расписания (например, {"foo": 1})
+                logger.error(
+                    f"Сообщение не является изменением расписания: {type(data).__name__}"
+                )
+                return None
+            return data
         except Exception as e:
             logger.error(f"Ошибка обработки сообщения: {e}")
             import traceback
 
             logger.error(traceback.format_exc())
             return None
-
-    @staticmethod
-    def object_hook(obj):
-        if "__enum__" in obj:
-            for enum_type in [
-                ScheduleType,
-                ScheduleForm,
-                WeekNumber,
-                DayName,
-                LessonType,
-                Subgroup,
-                EntityType,
-                ChangeType,
-            ]:
-                try:
-                    return enum_type(obj["__enum__"])
-                except (ValueError, TypeError):
-                    continue
-            return obj["__enum__"]
-        elif "__datetime__" in obj:
-            return datetime.fromisoformat(obj["__datetime__"])
-        elif "__time__" in obj:
-            return time.fromisoformat(obj["__time__"])
-        elif "__timedelta__" in obj:
-            return timedelta(seconds=obj["__timedelta__"])
-        elif "__lesson__" in obj:
-            lesson_dict = obj["__lesson__"]
-            # Обработка вложенных типов в Lesson
-            for key, value in lesson_dict.items():
-                if isinstance(value, dict):
-                    lesson_dict[key] = Broker.object_hook(value)
-                elif isinstance(value, list) and value and isinstance(value[0], dict):
-                    lesson_dict[key] = [Broker.object_hook(item) for item in value]
-            return Lesson(**lesson_dict)
-        elif "__entity__" in obj:
-            entity_dict = obj["__entity__"]
-            for key, value in entity_dict.items():
-                if isinstance(value, dict):
-                    entity_dict[key] = Broker.object_hook(value)
-            return Entity(**entity_dict)
-        elif "__fieldchange__" in obj:
-            fc_dict = obj["__fieldchange__"]
-            for key, value in fc_dict.items():
-                if isinstance(value, dict):
-                    fc_dict[key] = Broker.object_hook(value)
-            return FieldChange(**fc_dict)
-        elif "__lessonchange__" in obj:
-            lc_dict = obj["__lessonchange__"]
-            for key, value in lc_dict.items():
-                if isinstance(value, dict):
-                    lc_dict[key] = Broker.object_hook(value)
-                elif isinstance(value, list) and value and isinstance(value[0], dict):
-                    lc_dict[key] = [Broker.object_hook(item) for item in value]
-            return LessonChange(**lc_dict)
-        elif "__timetablechangedata__" in obj:
-            tcd_dict = obj["__timetablechangedata__"]
-            for key, value in tcd_dict.items():
-                if isinstance(value, dict):
-                    tcd_dict[key] = Broker.object_hook(value)
-                elif isinstance(value, list) and value and isinstance(value[0], dict):
-                    tcd_dict[key] = [Broker.object_hook(item) for item in value]
-            return TimetableChangeData(**tcd_dict)
-
-        return obj
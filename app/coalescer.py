@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import math
+from dataclasses import dataclass, field, fields
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from parser_types import (
+    ChangeType,
+    EntityType,
+    FieldChange,
+    Lesson,
+    LessonChange,
+    TimetableChangeData,
+)
+from profiler import profile
+
+
+def lesson_field_changes(old: Lesson, new: Lesson) -> List[FieldChange]:
+    return [
+        FieldChange(item.name, getattr(old, item.name), getattr(new, item.name))
+        for item in fields(Lesson)
+        if getattr(old, item.name) != getattr(new, item.name)
+    ]
+
+
+def _current_lesson(change: LessonChange) -> Optional[Lesson]:
+    # Состояние занятия после изменения; у удаленного его нет
+    if change.change_type == ChangeType.LESSON_REMOVED:
+        return None
+    return change.new_lesson
+
+
+def collapse_lesson_changes(changes: List[LessonChange]) -> List[LessonChange]:
+    # Сворачивает цепочки изменений одного занятия в итоговое:
+    # добавлено+удалено -> ничего, добавлено+изменено -> добавлено,
+    # изменено a->b + изменено b->c -> изменено a->c, изменено+удалено -> удалено
+    result: List[LessonChange] = []
+
+    for change in changes:
+        if change in result:
+            # Повторная доставка того же сообщения
+            continue
+
+        if change.change_type == ChangeType.LESSON_ADDED:
+            restored = next(
+                (
+                    item
+                    for item in result
+                    if item.change_type == ChangeType.LESSON_REMOVED
+                    and item.old_lesson == change.new_lesson
+                ),
+                None,
+            )
+            if restored is not None:
+                result.remove(restored)
+            else:
+                result.append(change)
+            continue
+
+        previous = next(
+            (
+                item
+                for item in reversed(result)
+                if _current_lesson(item) is not None
+                and _current_lesson(item) == change.old_lesson
+            ),
+            None,
+        )
+        if previous is None:
+            result.append(change)
+            continue
+
+        index = result.index(previous)
+        if change.change_type == ChangeType.LESSON_REMOVED:
+            if previous.change_type == ChangeType.LESSON_ADDED:
+                del result[index]
+            else:
+                result[index] = LessonChange(
+                    change_type=ChangeType.LESSON_REMOVED,
+                    field_changes=[],
+                    old_lesson=previous.old_lesson,
+                    new_lesson=None,
+                )
+            continue
+
+        if previous.change_type == ChangeType.LESSON_ADDED:
+            result[index] = LessonChange(
+                change_type=ChangeType.LESSON_ADDED,
+                field_changes=[],
+                old_lesson=None,
+                new_lesson=change.new_lesson,
+            )
+        elif previous.old_lesson == change.new_lesson:
+            # Занятие вернулось в исходное состояние
+            del result[index]
+        else:
+            result[index] = LessonChange(
+                change_type=ChangeType.LESSON_MODIFIED,
+                field_changes=lesson_field_changes(
+                    previous.old_lesson, change.new_lesson
+                ),
+                old_lesson=previous.old_lesson,
+                new_lesson=change.new_lesson,
+            )
+
+    return result
+
+
+def collapse_field_changes(changes: List[FieldChange]) -> List[FieldChange]:
+    # Для каждого поля остается первое старое и последнее новое значение
+    merged: Dict[str, FieldChange] = {}
+    for change in changes:
+        previous = merged.get(change.field_name)
+        if previous is None:
+            merged[change.field_name] = FieldChange(
+                change.field_name, change.old_value, change.new_value
+            )
+        else:
+            previous.new_value = change.new_value
+
+    return [
+        change for change in merged.values() if change.old_value != change.new_value
+    ]
+
+
+def merged_delivery_id(changes: List[TimetableChangeData]) -> Optional[str]:
+    # Объединение определяется набором исходных доставок
+    ids = [change.delivery_id for change in changes]
+    if not all(ids):
+        return None
+    if len(ids) == 1:
+        return ids[0]
+    return hashlib.sha256("\0".join(ids).encode()).hexdigest()
+
+
+def coalesce_changes(changes: List[TimetableChangeData]) -> TimetableChangeData:
+    metadata_changes = [
+        item for change in changes for item in change.metadata_changes or []
+    ]
+    lesson_changes = [
+        item for change in changes for item in change.lesson_changes or []
+    ]
+
+    merged = TimetableChangeData(
+        # Берем последнюю сущность: название могло поменяться
+        entity=changes[-1].entity,
+        metadata_changes=collapse_field_changes(metadata_changes)
+        if any(change.metadata_changes is not None for change in changes)
+        else None,
+        lesson_changes=collapse_lesson_changes(lesson_changes)
+        if any(change.lesson_changes is not None for change in changes)
+        else None,
+    )
+    merged.delivery_id = merged_delivery_id(changes)
+    return merged
+
+
+def coalescing_prefetch(
+    prefetch: int, rate: float, window: float, max_delay: float
+) -> int:
+    # Сообщение остается неподтвержденным, пока копится его пачка: от window
+    # до max_delay секунд. С prefetch N потребитель пропускает не больше
+    # N / window сообщений в секунду (20 при окне 5 с - 4 сообщения в секунду),
+    # а при непрерывном потоке одной сущности - N / max_delay. Для rate
+    # сообщений в секунду в худшем случае нужно rate * max_delay
+    if window <= 0:
+        return prefetch
+    return max(prefetch, math.ceil(rate * max(max_delay, window)))
+
+
+@dataclass
+class _Bucket:
+    first_at: float
+    changes: List[TimetableChangeData] = field(default_factory=list)
+    futures: List[asyncio.Future] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class ChangeCoalescer:
+    # Копит изменения одной сущности, пока они приходят чаще раза в window секунд,
+    # но не дольше max_delay, и отдает обработчику одно объединенное изменение.
+    # submit возвращает future с результатом обработчика: брокер подтверждает
+    # сообщения только после отправки объединенного уведомления
+    def __init__(
+        self,
+        handler: Callable[[TimetableChangeData], Awaitable[Any]],
+        window: float = 5.0,
+        max_delay: float = 30.0,
+        retry_delays: Optional[List[float]] = None,
+    ):
+        self.handler = handler
+        self.window = window
+        self.max_delay = max(max_delay, window)
+        # Неудачная пачка повторяется здесь же: следующая пачка сущности ждет ее,
+        # поэтому повтор не обгоняют более поздние изменения
+        self.retry_delays = list(retry_delays or [])
+        self.closed = False
+        self._closing = asyncio.Event()
+        self._buckets: Dict[Tuple[EntityType, int], _Bucket] = {}
+        self._tasks = set()
+        self._delivering: Dict[Tuple[EntityType, int], asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(bucket.changes) for bucket in self._buckets.values())
+
+    def submit(self, change: TimetableChangeData) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (change.entity.type, change.entity.id)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(first_at=loop.time())
+        bucket.changes.append(change)
+        bucket.futures.append(future)
+
+        if self.closed or self.window <= 0:
+            self._flush(key)
+            return future
+
+        # Каждое новое изменение откладывает отправку, но не дальше max_delay
+        if bucket.timer:
+            bucket.timer.cancel()
+        deadline = min(loop.time() + self.window, bucket.first_at + self.max_delay)
+        bucket.timer = loop.call_at(deadline, self._flush, key)
+        return future
+
+    def _flush(self, key: Tuple[EntityType, int]):
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            return
+        if bucket.timer:
+            bucket.timer.cancel()
+
+        # Следующая пачка сущности ждет предыдущую, чтобы не нарушить порядок
+        previous = self._delivering.get(key)
+        task = asyncio.get_running_loop().create_task(self._deliver(bucket, previous))
+        self._delivering[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(lambda done: self._forget(key, done))
+
+    def _forget(self, key: Tuple[EntityType, int], task: asyncio.Task):
+        if self._delivering.get(key) is task:
+            del self._delivering[key]
+
+    @profile(func_name="coalescer_deliver")
+    async def _deliver(self, bucket: _Bucket, previous: Optional[asyncio.Task] = None):
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        change = None
+        for delay in [*self.retry_delays, None]:
+            try:
+                if change is None:
+                    change = coalesce_changes(bucket.changes)
+                    if len(bucket.changes) > 1:
+                        logger.debug(
+                            f"Объединено {len(bucket.changes)} сообщений для "
+                            f"{change.entity.name}: "
+                            f"{len(change.lesson_changes or [])} изменений занятий"
+                        )
+                result = await self.handler(change)
+            except Exception as e:
+                logger.error(f"Ошибка обработки объединенных изменений: {e}")
+                result = False
+            if result is not False or delay is None:
+                break
+
+            logger.warning(f"Повтор объединенных изменений через {delay:g} с")
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+            except asyncio.TimeoutError:
+                continue
+            # Остановка: сообщения останутся неподтвержденными и придут снова
+            for future in bucket.futures:
+                future.cancel()
+            return
+
+        for future in bucket.futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        # Отправляет все накопленное сразу; новые изменения дальше идут без задержки
+        self.closed = True
+        self._closing.set()
+        for key in list(self._buckets):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
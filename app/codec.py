@@ -0,0 +1,356 @@
+import json
+from dataclasses import fields
+from datetime import date, datetime, time, timedelta
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import get_args, get_type_hints
+
+from parser_types import (
+    ChangeType,
+    DayName,
+    Entity,
+    EntityType,
+    FieldChange,
+    Lesson,
+    LessonChange,
+    LessonType,
+    ScheduleForm,
+    ScheduleType,
+    Semester,
+    Subgroup,
+    TimetableChangeData,
+    WeekNumber,
+)
+
+# 1 - исходный формат DataEncoder с тегами "__enum__", "__lesson__", ...
+# 2 - схема: занятия позиционными массивами, перечисления по типу поля
+CODEC_VERSION = 2
+LEGACY_VERSION = 1
+
+ENUM_TYPES: Dict[str, type] = {
+    enum_type.__name__: enum_type
+    for enum_type in (
+        EntityType,
+        Semester,
+        WeekNumber,
+        ScheduleType,
+        ScheduleForm,
+        DayName,
+        LessonType,
+        Subgroup,
+        ChangeType,
+    )
+}
+_ENUM_LOOKUP: Dict[str, Dict[Any, Enum]] = {
+    name: {member.value: member for member in enum_type}
+    for name, enum_type in ENUM_TYPES.items()
+}
+
+# В старом формате тип перечисления не передается: побеждает первый тип из списка,
+# в котором нашлось значение (тот же порядок, что и в прежнем Broker.object_hook)
+_LEGACY_ENUM_LOOKUP: Dict[Any, Enum] = {}
+for _enum_type in (
+    ScheduleType,
+    ScheduleForm,
+    WeekNumber,
+    DayName,
+    LessonType,
+    Subgroup,
+    EntityType,
+    ChangeType,
+):
+    for _member in _enum_type:
+        _LEGACY_ENUM_LOOKUP.setdefault(_member.value, _member)
+
+
+class DataEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Enum):
+            return {"__enum__": obj.value}
+        if isinstance(obj, (date, datetime)):
+            return {"__datetime__": obj.isoformat()}
+        if isinstance(obj, time):
+            return {"__time__": obj.isoformat()}
+        if isinstance(obj, timedelta):
+            return {"__timedelta__": obj.total_seconds()}
+        if isinstance(obj, Lesson):
+            return {"__lesson__": obj.__dict__}
+        if isinstance(obj, Entity):
+            return {"__entity__": obj.__dict__}
+        if isinstance(obj, FieldChange):
+            return {"__fieldchange__": obj.__dict__}
+        if isinstance(obj, LessonChange):
+            return {"__lessonchange__": obj.__dict__}
+        if isinstance(obj, TimetableChangeData):
+            return {
+                "__timetablechangedata__": {
+                    item.name: getattr(obj, item.name)
+                    for item in fields(obj)
+                    if item.init
+                }
+            }
+        return super().default(obj)
+
+
+def _identity(value):
+    return value
+
+
+def _encode_date(value: date) -> str:
+    return value.isoformat()
+
+
+def _decode_date(value: str) -> date:
+    return datetime.fromisoformat(value) if "T" in value else date.fromisoformat(value)
+
+
+def _encode_time(value: time) -> str:
+    return value.isoformat()
+
+
+def _encode_timedelta(value: timedelta) -> float:
+    return value.total_seconds()
+
+
+def _decode_timedelta(value: float) -> timedelta:
+    return timedelta(seconds=value)
+
+
+def _encode_enum(value: Enum):
+    return value.value
+
+
+def _optional(converter: Callable[[Any], Any]) -> Callable[[Any], Any]:
+    def convert(value):
+        return None if value is None else converter(value)
+
+    return convert
+
+
+def _field_codec(hint) -> Tuple[Callable[[Any], Any], Callable[[Any], Any]]:
+    args = [arg for arg in get_args(hint) if arg is not type(None)]
+    if args and getattr(hint, "__origin__", None) is Union:
+        hint = args[0]
+
+    if isinstance(hint, type) and issubclass(hint, Enum):
+        return _encode_enum, _ENUM_LOOKUP[hint.__name__].__getitem__
+    if hint is time:
+        return _encode_time, time.fromisoformat
+    if hint is date:
+        return _encode_date, _decode_date
+    if hint is timedelta:
+        return _encode_timedelta, _decode_timedelta
+    return _identity, _identity
+
+
+def _dataclass_schema(cls) -> List[Tuple[str, Callable, Callable]]:
+    hints = get_type_hints(cls)
+    schema = []
+    for field in fields(cls):
+        if not field.init:
+            continue
+        encode, decode = _field_codec(hints[field.name])
+        if encode is not _identity:
+            encode = _optional(encode)
+        schema.append((field.name, encode, decode))
+    return schema
+
+
+_LESSON_SCHEMA = _dataclass_schema(Lesson)
+_LESSON_ENCODERS = tuple((name, encode) for name, encode, _ in _LESSON_SCHEMA)
+# При разборе конвертируются только поля, которым это нужно; строки, списки
+# и None из json.loads передаются в Lesson как есть
+_LESSON_CONVERSIONS = tuple(
+    (index, decode)
+    for index, (_, _, decode) in enumerate(_LESSON_SCHEMA)
+    if decode is not _identity
+)
+
+
+def _encode_lesson(lesson: Optional[Lesson]) -> Optional[list]:
+    if lesson is None:
+        return None
+    return [encode(getattr(lesson, name)) for name, encode in _LESSON_ENCODERS]
+
+
+def _decode_lesson(row: Optional[list]) -> Optional[Lesson]:
+    if row is None:
+        return None
+    for index, decode in _LESSON_CONVERSIONS:
+        value = row[index]
+        if value is not None:
+            row[index] = decode(value)
+    return Lesson(*row)
+
+
+def _encode_value(value: Any) -> Any:
+    # Значения FieldChange нетипизированы, поэтому несут тег типа
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, Enum):
+        return {"e": type(value).__name__, "v": value.value}
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"d": value.isoformat()}
+    if isinstance(value, time):
+        return {"t": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"td": value.total_seconds()}
+    if isinstance(value, Lesson):
+        return {"l": _encode_lesson(value)}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {"m": {key: _encode_value(item) for key, item in value.items()}}
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    if "e" in value:
+        return _ENUM_LOOKUP[value["e"]][value["v"]]
+    if "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    if "d" in value:
+        return date.fromisoformat(value["d"])
+    if "t" in value:
+        return time.fromisoformat(value["t"])
+    if "td" in value:
+        return timedelta(seconds=value["td"])
+    if "l" in value:
+        return _decode_lesson(value["l"])
+    if "m" in value:
+        return {key: _decode_value(item) for key, item in value["m"].items()}
+    raise ValueError(f"Unknown value tag: {list(value)}")
+
+
+def _encode_field_changes(changes: Optional[List[FieldChange]]) -> Optional[list]:
+    if changes is None:
+        return None
+    return [
+        [
+            change.field_name,
+            _encode_value(change.old_value),
+            _encode_value(change.new_value),
+        ]
+        for change in changes
+    ]
+
+
+def _decode_field_changes(rows: Optional[list]) -> Optional[List[FieldChange]]:
+    if rows is None:
+        return None
+    return [
+        FieldChange(name, _decode_value(old_value), _decode_value(new_value))
+        for name, old_value, new_value in rows
+    ]
+
+
+def to_payload(change: TimetableChangeData) -> Dict[str, Any]:
+    return {
+        "v": CODEC_VERSION,
+        "entity": [change.entity.type.value, change.entity.id, change.entity.name],
+        "metadata_changes": _encode_field_changes(change.metadata_changes),
+        "lesson_changes": None
+        if change.lesson_changes is None
+        else [
+            [
+                lesson_change.change_type.value,
+                _encode_field_changes(lesson_change.field_changes),
+                _encode_lesson(lesson_change.old_lesson),
+                _encode_lesson(lesson_change.new_lesson),
+            ]
+            for lesson_change in change.lesson_changes
+        ],
+    }
+
+
+def from_payload(payload: Dict[str, Any]) -> TimetableChangeData:
+    version = payload.get("v")
+    if version != CODEC_VERSION:
+        # Неизвестную версию нельзя читать по схеме v2: брокер отправит
+        # сообщение в очередь недоставленных
+        raise ValueError(f"Unsupported codec version: {version!r}")
+
+    entity_type, entity_id, entity_name = payload["entity"]
+    change_types = _ENUM_LOOKUP["ChangeType"]
+    lesson_rows = payload.get("lesson_changes")
+
+    return TimetableChangeData(
+        entity=Entity(
+            type=_ENUM_LOOKUP["EntityType"][entity_type],
+            id=entity_id,
+            name=entity_name,
+        ),
+        metadata_changes=_decode_field_changes(payload.get("metadata_changes")),
+        lesson_changes=None
+        if lesson_rows is None
+        else [
+            LessonChange(
+                change_type=change_types[change_type],
+                field_changes=_decode_field_changes(field_changes),
+                old_lesson=_decode_lesson(old_lesson),
+                new_lesson=_decode_lesson(new_lesson),
+            )
+            for change_type, field_changes, old_lesson, new_lesson in lesson_rows
+        ],
+    )
+
+
+def legacy_object_hook(obj: Dict[str, Any]) -> Any:
+    # json вызывает hook снизу вверх, так что вложенные объекты уже разобраны
+    if len(obj) != 1:
+        return obj
+
+    if "__enum__" in obj:
+        value = obj["__enum__"]
+        try:
+            return _LEGACY_ENUM_LOOKUP.get(value, value)
+        except TypeError:
+            return value
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__time__" in obj:
+        return time.fromisoformat(obj["__time__"])
+    if "__timedelta__" in obj:
+        return timedelta(seconds=obj["__timedelta__"])
+    if "__lesson__" in obj:
+        return Lesson(**obj["__lesson__"])
+    if "__entity__" in obj:
+        return Entity(**obj["__entity__"])
+    if "__fieldchange__" in obj:
+        return FieldChange(**obj["__fieldchange__"])
+    if "__lessonchange__" in obj:
+        return LessonChange(**obj["__lessonchange__"])
+    if "__timetablechangedata__" in obj:
+        return TimetableChangeData(**obj["__timetablechangedata__"])
+    return obj
+
+
+def encode_change(change: TimetableChangeData, version: int = CODEC_VERSION) -> bytes:
+    if version == LEGACY_VERSION:
+        return json.dumps(change, cls=DataEncoder).encode()
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported codec version: {version}")
+    return json.dumps(
+        to_payload(change), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def decode_change(body: Union[bytes, bytearray, memoryview, str]) -> Any:
+    # json.loads разбирает bytes сам, без промежуточной строки; memoryview
+    # он не принимает, такой буфер приходится скопировать
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    # Один разбор для обоих форматов: старый собирается hook-ом, а версия
+    # нового берется из поля "v", а не из порядка байтов в начале тела.
+    # Объекты схемы v2 hook не трогает: у них нет тегов старого формата
+    payload = json.loads(body, object_hook=legacy_object_hook)
+    if isinstance(payload, dict) and "v" in payload:
+        return from_payload(payload)
+    return payload
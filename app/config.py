@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -9,6 +11,86 @@ class Settings(BaseSettings):
     REDIS_URI: str
 
     BOT_TOKEN: str
+    # Адрес собственного Bot API сервера (или тестового), по умолчанию api.telegram.org
+    BOT_API_SERVER: Optional[str] = None
+
+    # polling - один процесс с long polling; webhook - aiohttp сервер, за общим
+    # адресом может работать несколько процессов и контейнеров. Очередь изменений
+    # читает только процесс 0: контейнеров-потребителей тоже должен быть один,
+    # иначе изменения одной сущности обрабатываются параллельно и не по порядку
+    BOT_MODE: str = "polling"
+    WEBHOOK_BASE_URL: Optional[str] = None
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_SECRET: Optional[str] = None
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_WORKERS: int = 1
+    # Одновременно обрабатываемые обновления в процессе и соединения от Telegram
+    WEBHOOK_MAX_CONCURRENT_UPDATES: int = 64
+    WEBHOOK_MAX_CONNECTIONS: int = 40
+    WEBHOOK_SHUTDOWN_TIMEOUT: float = 30.0
+
+    # Хранилище состояния диалогов: memory (один процесс) или redis (общее для
+    # процессов webhook и переживает перезапуск); состояние без активности
+    # удаляется через FSM_STATE_TTL_SECONDS
+    FSM_STORAGE: str = "memory"
+    FSM_STATE_TTL_SECONDS: int = 604800
+
+    BROKER_PREFETCH_COUNT: int = 20
+    BROKER_SHUTDOWN_TIMEOUT: float = 30.0
+    BROKER_PUBLISH_BATCH_SIZE: int = 200
+    BROKER_PUBLISH_WINDOW: int = 50
+    BROKER_PUBLISH_COALESCE: bool = False
+    BROKER_CODEC_VERSION: int = 2
+    BROKER_MAX_ATTEMPTS: int = 5
+    BROKER_RETRY_DELAY: float = 5.0
+    BROKER_RETRY_MAX_DELAY: float = 300.0
+    # Период опроса глубины очереди и порог отставания для предупреждения в логе
+    BROKER_METRICS_INTERVAL: float = 15.0
+    BROKER_LAG_ALERT_SECONDS: float = 60.0
+    # Снимок счетчиков и замеров в лог раз в столько секунд (0 - не писать);
+    # в режиме webhook те же метрики отдает /metrics
+    METRICS_LOG_INTERVAL: float = 60.0
+
+    # Изменения одной сущности объединяются, пока приходят чаще раза в окно;
+    # 0 отключает объединение. Сообщение подтверждается после отправки пачки,
+    # поэтому при prefetch N поток не больше N / окно сообщений в секунду:
+    # prefetch поднимается до NOTIFICATION_EXPECTED_RATE * MAX_DELAY
+    NOTIFICATION_COALESCE_WINDOW: float = 5.0
+    NOTIFICATION_COALESCE_MAX_DELAY: float = 30.0
+    NOTIFICATION_EXPECTED_RATE: float = 20.0
+    # Ограничения Telegram: ~30 сообщений в секунду на бота, 1 в секунду в один чат
+    NOTIFICATION_GLOBAL_RATE: float = 25.0
+    NOTIFICATION_PER_CHAT_RATE: float = 1.0
+    NOTIFICATION_CONCURRENCY: int = 16
+    # Сколько ссылок на сущности держать в памяти (по одной на группу,
+    # преподавателя и аудиторию)
+    DEEP_LINK_CACHE_SIZE: int = 4096
+    # Расписания, открытые в диалогах: сколько держать в памяти процесса и
+    # через сколько секунд перечитывать (изменения приходят в один процесс)
+    TIMETABLE_REGISTRY_SIZE: int = 256
+    TIMETABLE_REGISTRY_TTL: float = 600.0
+    # Отрисованные страницы дней (сущность, версия, тип, неделя, день, подгруппа);
+    # при первом открытии окна можно сразу отрисовать все 42 страницы подгруппы
+    RENDER_CACHE_SIZE: int = 16384
+    TIMETABLE_PRECOMPUTE_PAGES: bool = True
+
+    # Очередь отправки уведомлений в MongoDB: аренда на время рассылки,
+    # повтор недоставленного и срок хранения завершенных (окно дедупликации)
+    OUTBOX_LEASE_SECONDS: float = 120.0
+    OUTBOX_POLL_INTERVAL: float = 5.0
+    OUTBOX_MAX_ATTEMPTS: int = 5
+    OUTBOX_RETRY_DELAY: float = 30.0
+    OUTBOX_RETENTION_HOURS: float = 24.0
+
+    # Сводки изменений: как часто проверять наступившие, сколько раз пытаться
+    # отправить одну сводку и варианты времени ежедневной сводки, между
+    # которыми переключается кнопка в расписании
+    DIGEST_POLL_INTERVAL: float = 30.0
+    DIGEST_MAX_ATTEMPTS: int = 5
+    DIGEST_DAILY_TIMES: List[str] = ["07:00", "20:00"]
+    # Время вечерней рассылки расписания на завтра ("ЧЧ:ММ"), пусто - выключена
+    TOMORROW_PUSH_TIME: Optional[str] = "19:00"
 
     class Config:
         env_file = ".env"
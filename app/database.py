@@ -14,7 +14,7 @@ from parser_types import (
     LessonType,
     Subgroup,
 )
-from typing import List, Optional, Any
+from typing import Dict, List, Optional, Any, AsyncIterator, Tuple
 from pydantic import BaseModel
 import pymongo
 import pymongo.errors
@@ -23,6 +23,7 @@ from loguru import logger
 from datetime import time, timedelta, datetime
 from profiler import profile
 from cacher import Cacher
+from occupancy import OccupancyIndex
 from config import settings
 
 
@@ -71,10 +72,20 @@ class TimetableModel(Document):
         ]
 
 
+DELIVERY_IMMEDIATE = "immediate"
+DELIVERY_HOURLY = "hourly"
+DELIVERY_DAILY = "daily"
+
+
 class SubscriptionModel(Document):
     tg_id: int
     entity_name: str
     created_at: datetime = datetime.now()
+    # Сразу, сводкой раз в час или сводкой раз в день в digest_time ("ЧЧ:ММ")
+    delivery_mode: str = DELIVERY_IMMEDIATE
+    digest_time: Optional[str] = None
+    # Вечерняя рассылка расписания на завтра
+    tomorrow_push: bool = False
 
     class Settings:
         name = "subscriptions"
@@ -108,6 +119,77 @@ class UserSettingsModel(Document):
         ]
 
 
+OUTBOX_PENDING = "pending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+
+class OutboxModel(Document):
+    # Одно уведомление и прогресс его рассылки: done - чаты, которым оно уже
+    # доставлено (или которые недоступны), поэтому после сбоя рассылка продолжается
+    key: str
+    entity_name: str
+    # Части длинного уведомления отправляются по порядку
+    parts: List[str]
+    parse_mode: Optional[str] = None
+    recipients: List[int]
+    done: List[int] = []
+    status: str = OUTBOX_PENDING
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+    lease_until: Optional[datetime] = None
+    created_at: datetime = datetime.now()
+    completed_at: Optional[datetime] = None
+
+    class Settings:
+        name = "notification_outbox"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel([("key", pymongo.ASCENDING)], unique=True),
+            [
+                ("status", pymongo.ASCENDING),
+                ("lease_until", pymongo.ASCENDING),
+            ],
+            # Завершенные уведомления хранятся ради дедупликации, затем удаляются
+            pymongo.IndexModel(
+                [("completed_at", pymongo.ASCENDING)],
+                expireAfterSeconds=int(settings.OUTBOX_RETENTION_HOURS * 3600),
+            ),
+        ]
+
+
+class DigestModel(Document):
+    # Изменения одной сущности, накопленные до общей отправки сводки: одна запись
+    # на режим и время отправки, recipients - кому сводка предназначена,
+    # sent - сколько изменений уже отправлено и убрано из changes,
+    # attempts - захваты с последней успешной отправки
+    entity_name: str
+    delivery_mode: str
+    due_at: datetime
+    changes: List[Dict[str, Any]] = []
+    recipients: List[int] = []
+    sent: int = 0
+    attempts: int = 0
+    lease_owner: Optional[str] = None
+    lease_until: Optional[datetime] = None
+    created_at: datetime = datetime.now()
+
+    class Settings:
+        name = "notification_digests"
+        use_revision = False
+        indexes = [
+            pymongo.IndexModel(
+                [
+                    ("entity_name", pymongo.ASCENDING),
+                    ("delivery_mode", pymongo.ASCENDING),
+                    ("due_at", pymongo.ASCENDING),
+                ],
+                unique=True,
+            ),
+            "due_at",
+        ]
+
+
 class Database:
     def __init__(self, connection_string, db_name="sibsau-timetable"):
         self.connection_string = connection_string
@@ -136,6 +218,8 @@ class Database:
                         TimetableModel,
                         SubscriptionModel,
                         UserSettingsModel,
+                        OutboxModel,
+                        DigestModel,
                     ],
                     allow_index_dropping=True,
                 )
@@ -181,6 +265,102 @@ class Database:
             )
         return result
 
+    @staticmethod
+    def _find_query(
+        query: dict,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        skip: int = 0,
+        limit: int = 0,
+    ):
+        return TimetableModel.find(
+            query,
+            sort=list(sort) if sort else None,
+            skip=skip or None,
+            limit=limit or None,
+        )
+
+    @profile(func_name="database_find_timetables")
+    async def find_timetables(
+        self,
+        query: dict,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> List[TimetableData]:
+        await self.initialize()
+        models = await self._find_query(query, sort, skip, limit).to_list()
+        return [self._from_model(model) for model in models]
+
+    async def iter_timetables(
+        self,
+        query: dict,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        skip: int = 0,
+        limit: int = 0,
+    ) -> AsyncIterator[TimetableData]:
+        await self.initialize()
+        async for model in self._find_query(query, sort, skip, limit):
+            yield self._from_model(model)
+
+    @profile(func_name="database_get_occupancy_index")
+    @Cacher.cache(expire=21600)
+    async def get_occupancy_index(self) -> OccupancyIndex:
+        await self.initialize()
+
+        collection = TimetableModel.get_motor_collection()
+        timetables_data = await collection.find(
+            {},
+            {
+                "_id": 0,
+                "entity": 1,
+                "lessons.schedule_type": 1,
+                "lessons.week_number": 1,
+                "lessons.day_name": 1,
+                "lessons.time_begin": 1,
+                "lessons.duration": 1,
+                "lessons.groups": 1,
+                "lessons.professors": 1,
+                "lessons.auditorium": 1,
+            },
+        ).to_list(length=None)
+
+        index = OccupancyIndex()
+        for data in timetables_data:
+            entity_data = data.get("entity", {})
+            index.register(EntityType(entity_data.get("type")), entity_data.get("name"))
+
+            for lesson_data in data.get("lessons", []):
+                if (
+                    lesson_data.get("schedule_type") != ScheduleType.REGULAR.value
+                    or not lesson_data.get("week_number")
+                    or not lesson_data.get("day_name")
+                ):
+                    continue
+
+                try:
+                    args = (
+                        WeekNumber(lesson_data["week_number"]),
+                        DayName(lesson_data["day_name"]),
+                        datetime.strptime(
+                            lesson_data.get("time_begin"), "%H:%M"
+                        ).time(),
+                        timedelta(seconds=lesson_data["duration"])
+                        if lesson_data.get("duration") is not None
+                        else None,
+                    )
+                except (TypeError, ValueError):
+                    continue
+
+                index.occupy(
+                    EntityType.AUDITORIUM, lesson_data.get("auditorium"), *args
+                )
+                for professor in lesson_data.get("professors") or []:
+                    index.occupy(EntityType.PROFESSOR, professor, *args)
+                for group in lesson_data.get("groups") or []:
+                    index.occupy(EntityType.GROUP, group, *args)
+
+        return index
+
     @profile(func_name="database_get_timetable_by_query")
     @Cacher.cache(expire=21600)
     async def get_timetable_by_query(self, query: dict) -> Optional[TimetableData]:
@@ -359,6 +539,103 @@ class Database:
             self.initialized = False
             logger.debug("MongoDB соединение закрыто")
 
+    @profile(func_name="database.enqueue_notification")
+    async def enqueue_notification(
+        self,
+        key: str,
+        entity_name: str,
+        parts: List[str],
+        recipients: List[int],
+        parse_mode: Optional[str] = None,
+    ) -> bool:
+        # Ошибки не перехватываются: сообщение брокера подтверждается только
+        # после записи в outbox, иначе оно будет доставлено повторно
+        await self.initialize()
+
+        try:
+            await OutboxModel(
+                key=key,
+                entity_name=entity_name,
+                parts=parts,
+                parse_mode=parse_mode,
+                recipients=recipients,
+                created_at=datetime.now(),
+            ).insert()
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            logger.debug(f"Уведомление {key} уже в очереди отправки")
+            return False
+
+    @profile(func_name="database.claim_notification")
+    async def claim_notification(
+        self, owner: str, lease_seconds: float
+    ) -> Optional[OutboxModel]:
+        await self.initialize()
+
+        now = datetime.now()
+        document = await OutboxModel.get_motor_collection().find_one_and_update(
+            {
+                "status": OUTBOX_PENDING,
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+            },
+            {
+                "$set": {
+                    "lease_owner": owner,
+                    "lease_until": now + timedelta(seconds=lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        return OutboxModel.model_validate(document) if document else None
+
+    @profile(func_name="database.record_notification_progress")
+    async def record_notification_progress(
+        self,
+        notification: OutboxModel,
+        owner: str,
+        done: List[int],
+        lease_seconds: float,
+    ) -> bool:
+        await self.initialize()
+
+        result = await OutboxModel.get_motor_collection().update_one(
+            {"_id": notification.id, "lease_owner": owner},
+            {
+                "$addToSet": {"done": {"$each": done}},
+                "$set": {
+                    "lease_until": datetime.now() + timedelta(seconds=lease_seconds)
+                },
+            },
+        )
+        # 0 совпадений: аренду перехватил другой обработчик
+        return result.matched_count > 0
+
+    @profile(func_name="database.finish_notification")
+    async def finish_notification(
+        self,
+        notification: OutboxModel,
+        owner: str,
+        status: str,
+        retry_at: Optional[datetime] = None,
+    ):
+        await self.initialize()
+
+        await OutboxModel.get_motor_collection().update_one(
+            {"_id": notification.id, "lease_owner": owner},
+            {
+                "$set": {
+                    "status": status,
+                    "lease_owner": None,
+                    "lease_until": retry_at,
+                    "completed_at": datetime.now()
+                    if status != OUTBOX_PENDING
+                    else None,
+                }
+            },
+        )
+
     @profile(func_name="database.user_subscribe")
     async def user_subscribe(self, tg_id: int, entity_name: str) -> bool:
         await self.initialize()
@@ -403,6 +680,20 @@ class Database:
             logger.error(f"Ошибка при отписке пользователя: {e}")
             return False
 
+    @profile(func_name="database.user_unsubscribe_all")
+    async def user_unsubscribe_all(self, tg_id: int) -> int:
+        await self.initialize()
+
+        try:
+            result = await SubscriptionModel.find({"tg_id": tg_id}).delete()
+            count = result.deleted_count if result else 0
+            logger.debug(f"Пользователь {tg_id} отписан от всех расписаний ({count})")
+            return count
+
+        except Exception as e:
+            logger.error(f"Ошибка при отписке пользователя от всех расписаний: {e}")
+            return 0
+
     @profile(func_name="database.user_is_subscribed")
     async def user_is_subscribed(self, tg_id: int, entity_name: str) -> bool:
         await self.initialize()
@@ -433,6 +724,214 @@ class Database:
             logger.error(f"Ошибка при получении подписанных пользователей: {e}")
             return []
 
+    @profile(func_name="database.get_subscribers_by_subgroup")
+    async def get_subscribers_by_subgroup(
+        self, entity_name: str, tg_ids: Optional[List[int]] = None
+    ) -> Dict[Subgroup, List[int]]:
+        # Подписчики вместе с сохраненной подгруппой: два запроса на сущность,
+        # а не по запросу на пользователя. Без настроек - общая подгруппа.
+        # tg_ids - уже известные получатели, тогда подписки не запрашиваются.
+        # Ошибки не перехватываются: пустой результат молча потерял бы рассылку,
+        # а исключение вернет сообщение брокеру на повтор
+        await self.initialize()
+
+        if tg_ids is None:
+            subscriptions = await SubscriptionModel.find(
+                {"entity_name": entity_name}
+            ).to_list()
+            tg_ids = [subscription.tg_id for subscription in subscriptions]
+        users = list(dict.fromkeys(tg_ids))
+        if not users:
+            return {}
+
+        user_settings = await UserSettingsModel.find(
+            {"entity_name": entity_name, "tg_id": {"$in": users}}
+        ).to_list()
+        known = {subgroup.value: subgroup for subgroup in Subgroup}
+        subgroups = {
+            item.tg_id: known.get(item.subgroup, Subgroup.COMMON)
+            for item in user_settings
+        }
+
+        result: Dict[Subgroup, List[int]] = {}
+        for tg_id in users:
+            result.setdefault(subgroups.get(tg_id, Subgroup.COMMON), []).append(tg_id)
+        return result
+
+    @profile(func_name="database.get_subscriptions")
+    async def get_subscriptions(self, entity_name: str) -> List[SubscriptionModel]:
+        # Без перехвата ошибок: пустой список подтвердил бы сообщение брокера
+        # без рассылки и без записи в сводки
+        await self.initialize()
+
+        return await SubscriptionModel.find({"entity_name": entity_name}).to_list()
+
+    @profile(func_name="database.save_delivery_mode")
+    async def save_delivery_mode(
+        self,
+        tg_id: int,
+        entity_name: str,
+        delivery_mode: str,
+        digest_time: Optional[str] = None,
+    ) -> bool:
+        await self.initialize()
+
+        try:
+            result = await SubscriptionModel.get_motor_collection().update_many(
+                {"tg_id": tg_id, "entity_name": entity_name},
+                {
+                    "$set": {
+                        "delivery_mode": delivery_mode,
+                        "digest_time": digest_time,
+                    }
+                },
+            )
+            return result.matched_count > 0
+
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении режима уведомлений: {e}")
+            return False
+
+    @profile(func_name="database.get_subscription")
+    async def get_subscription(
+        self, tg_id: int, entity_name: str
+    ) -> Optional[SubscriptionModel]:
+        await self.initialize()
+
+        try:
+            return await SubscriptionModel.find_one(
+                {"tg_id": tg_id, "entity_name": entity_name}
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при получении подписки: {e}")
+            return None
+
+    @profile(func_name="database.save_tomorrow_push")
+    async def save_tomorrow_push(
+        self, tg_id: int, entity_name: str, enabled: bool
+    ) -> bool:
+        await self.initialize()
+
+        try:
+            result = await SubscriptionModel.get_motor_collection().update_many(
+                {"tg_id": tg_id, "entity_name": entity_name},
+                {"$set": {"tomorrow_push": enabled}},
+            )
+            return result.matched_count > 0
+
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении рассылки на завтра: {e}")
+            return False
+
+    @profile(func_name="database.get_tomorrow_push_subscribers")
+    async def get_tomorrow_push_subscribers(self) -> Dict[str, List[int]]:
+        # Один запрос на все сущности: название -> подписчики вечерней рассылки
+        await self.initialize()
+
+        try:
+            cursor = SubscriptionModel.get_motor_collection().find(
+                {"tomorrow_push": True}, {"tg_id": 1, "entity_name": 1, "_id": 0}
+            )
+            result: Dict[str, List[int]] = {}
+            async for document in cursor:
+                result.setdefault(document["entity_name"], []).append(document["tg_id"])
+            return {name: list(dict.fromkeys(users)) for name, users in result.items()}
+
+        except Exception as e:
+            logger.error(f"Ошибка при получении подписчиков рассылки на завтра: {e}")
+            return {}
+
+    @profile(func_name="database.add_to_digest")
+    async def add_to_digest(
+        self,
+        entity_name: str,
+        delivery_mode: str,
+        due_at: datetime,
+        change: Dict[str, Any],
+        recipients: List[int],
+    ):
+        # Как и enqueue_notification, ошибки не перехватываются: брокер повторит
+        # сообщение. Повтор того же изменения сворачивается при сборке сводки
+        await self.initialize()
+
+        await DigestModel.get_motor_collection().update_one(
+            {
+                "entity_name": entity_name,
+                "delivery_mode": delivery_mode,
+                "due_at": due_at,
+            },
+            {
+                "$push": {"changes": change},
+                "$addToSet": {"recipients": {"$each": recipients}},
+                "$setOnInsert": {
+                    "sent": 0,
+                    "attempts": 0,
+                    "lease_owner": None,
+                    "lease_until": None,
+                    "created_at": datetime.now(),
+                },
+            },
+            upsert=True,
+        )
+
+    @profile(func_name="database.claim_due_digest")
+    async def claim_due_digest(
+        self, owner: str, lease_seconds: float, max_attempts: int = 5
+    ) -> Optional[DigestModel]:
+        # Изменение, для которого due_at посчитали до его наступления, может
+        # дописаться в уже захваченную сводку: finish_digest его сохранит.
+        # Сводка, не отправленная за max_attempts захватов, больше не берется
+        await self.initialize()
+
+        now = datetime.now()
+        document = await DigestModel.get_motor_collection().find_one_and_update(
+            {
+                "due_at": {"$lte": now},
+                "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+                "attempts": {"$not": {"$gte": max_attempts}},
+            },
+            {
+                "$set": {
+                    "lease_owner": owner,
+                    "lease_until": now + timedelta(seconds=lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("due_at", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        return DigestModel.model_validate(document) if document else None
+
+    @profile(func_name="database.finish_digest")
+    async def finish_digest(self, digest: DigestModel, owner: str):
+        # Убираются только прочитанные при захвате изменения; дописанные после
+        # захвата остаются, и запись снова будет захвачена как наступившая
+        await self.initialize()
+
+        collection = DigestModel.get_motor_collection()
+        read = len(digest.changes)
+        await collection.update_one(
+            {"_id": digest.id, "lease_owner": owner},
+            [
+                {
+                    "$set": {
+                        "changes": {
+                            "$slice": [
+                                "$changes",
+                                read,
+                                {"$max": [{"$size": "$changes"}, 1]},
+                            ]
+                        },
+                        "sent": {"$add": [{"$ifNull": ["$sent", 0]}, read]},
+                        "attempts": 0,
+                        "lease_owner": None,
+                        "lease_until": None,
+                    }
+                }
+            ],
+        )
+        await collection.delete_one({"_id": digest.id, "changes": {"$size": 0}})
+
     @profile(func_name="database.save_user_subgroup")
     async def save_user_subgroup(
         self, tg_id: int, entity_name: str, subgroup: Subgroup
@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict, Any, Union, Callable
+from typing import List, Optional, Dict, Any, Union, Callable, AsyncIterator
 from parser_types import (
     Entity,
     EntityType,
@@ -13,6 +13,7 @@ from parser_types import (
     Subgroup,
 )
 from database import Database
+from occupancy import SLOTS_PER_DAY
 from datetime import date, datetime, time
 from difflib import SequenceMatcher
 from profiler import profile
@@ -78,18 +79,17 @@ class SearchEntityBuilder:
         if scored_entities[0][1] > scored_entities[1][1] * self._choose_threshold:
             return scored_entities[0][0]
         else:
-            entities = [entity for entity, _ in scored_entities]
-
-            if len(entities) > 7:
-                return entities[:7]
-
-            return entities
+            # Весь список листает ScrollingGroup в окне выбора
+            return [entity for entity, _ in scored_entities]
 
 
 class SearchTimetableDataBuilder:
     def __init__(self, database: Database):
         self._database = database
         self._query = {}
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
 
     def entity_type(self, entity_type: EntityType) -> "SearchTimetableDataBuilder":
         self._query["entity.type"] = entity_type.value
@@ -129,13 +129,206 @@ class SearchTimetableDataBuilder:
     async def fetch(self) -> Optional[TimetableData]:
         return await self._database.get_timetable_by_query(self._query)
 
+    @profile(func_name="search_timetable_data_builder_fetch_fresh")
+    async def fetch_fresh(self) -> Optional[TimetableData]:
+        # Мимо кеша Redis: для тех, кто сам сбрасывает устаревшие данные
+        async for timetable in self._database.iter_timetables(
+            self._normalized_query(), None, 0, 1
+        ):
+            return timetable
+        return None
+
+    def sort(
+        self, field: str, descending: bool = False
+    ) -> "SearchTimetableDataBuilder":
+        self._sort.append((field, -1 if descending else 1))
+        return self
+
+    def skip(self, count: int) -> "SearchTimetableDataBuilder":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "SearchTimetableDataBuilder":
+        self._limit = count
+        return self
+
+    def _normalized_query(self) -> Dict[str, Any]:
+        # Одинаковые запросы с разным порядком условий дают одинаковый запрос
+        return dict(sorted(self._query.items()))
+
     @profile(func_name="search_timetable_data_builder_fetch_all")
     async def fetch_all(self) -> List[TimetableData]:
-        if not self._query:
+        if not self._query and not self._sort and not self._skip and not self._limit:
             return await self._database.get_timetables()
 
-        result = await self._database.get_timetable_by_query(self._query)
-        return [result] if result else []
+        return await self._database.find_timetables(
+            self._normalized_query(), self._sort or None, self._skip, self._limit
+        )
+
+    async def stream(self) -> AsyncIterator[TimetableData]:
+        async for timetable in self._database.iter_timetables(
+            self._normalized_query(), self._sort or None, self._skip, self._limit
+        ):
+            yield timetable
+
+
+class SearchOccupancyBuilder:
+    def __init__(self, database: Database):
+        self._database = database
+        self._entity_type = EntityType.AUDITORIUM
+        self._name = None
+        self._name_prefix = None
+        self._week_number = None
+        self._day_name = None
+        self._first_slot = 1
+        self._last_slot = SLOTS_PER_DAY
+
+    def entity_type(self, entity_type: EntityType) -> "SearchOccupancyBuilder":
+        self._entity_type = entity_type
+        return self
+
+    def name(self, name: str) -> "SearchOccupancyBuilder":
+        self._name = name
+        return self
+
+    def name_prefix(self, prefix: str) -> "SearchOccupancyBuilder":
+        self._name_prefix = prefix
+        return self
+
+    def week_number(self, week_number: WeekNumber) -> "SearchOccupancyBuilder":
+        self._week_number = week_number
+        return self
+
+    def day_name(self, day_name: DayName) -> "SearchOccupancyBuilder":
+        self._day_name = day_name
+        return self
+
+    def slot(self, slot: int) -> "SearchOccupancyBuilder":
+        return self.slots(slot, slot)
+
+    def slots(self, first_slot: int, last_slot: int) -> "SearchOccupancyBuilder":
+        self._first_slot = first_slot
+        self._last_slot = last_slot
+        return self
+
+    def _days(self) -> List[tuple]:
+        weeks = [self._week_number] if self._week_number else list(WeekNumber)
+        days = [self._day_name] if self._day_name else list(DayName)
+        return [(week, day) for week in weeks for day in days]
+
+    @profile(func_name="search_occupancy_builder_fetch_free")
+    async def fetch_free(self) -> List[str]:
+        if not self._week_number or not self._day_name:
+            raise ValueError("Week number and day name are required")
+
+        index = await self._database.get_occupancy_index()
+        names = None
+        if self._name_prefix:
+            prefix = self._name_prefix.lower()
+            names = [
+                name
+                for name in index.masks[self._entity_type]
+                if name.lower().startswith(prefix)
+            ]
+
+        return index.free_entities(
+            self._entity_type,
+            self._week_number,
+            self._day_name,
+            self._first_slot,
+            self._last_slot,
+            names,
+        )
+
+    @profile(func_name="search_occupancy_builder_fetch_free_slots")
+    async def fetch_free_slots(self) -> Dict[tuple, List[int]]:
+        if not self._name:
+            raise ValueError("Entity name is required")
+
+        index = await self._database.get_occupancy_index()
+        return {
+            (week, day): index.free_slots(
+                self._entity_type,
+                self._name,
+                week,
+                day,
+                self._first_slot,
+                self._last_slot,
+            )
+            for week, day in self._days()
+        }
+
+    @profile(func_name="search_occupancy_builder_is_free")
+    async def is_free(self) -> bool:
+        if not self._name or not self._week_number or not self._day_name:
+            raise ValueError("Entity name, week number and day name are required")
+
+        index = await self._database.get_occupancy_index()
+        return index.is_free(
+            self._entity_type,
+            self._name,
+            self._week_number,
+            self._day_name,
+            self._first_slot,
+            self._last_slot,
+        )
+
+
+class DayView:
+    # Подгруппа в ключе - выбранная пользователем: COMMON означает "все занятия дня",
+    # FIRST/SECOND - занятия подгруппы вместе с общими
+    def __init__(self, lessons: List["Lesson"]):
+        self.size = len(lessons)
+        self.buckets: Dict[
+            ScheduleType,
+            Dict[WeekNumber, Dict[DayName, Dict[Subgroup, List["Lesson"]]]],
+        ] = {}
+
+        for lesson in lessons:
+            days = self.buckets.setdefault(lesson.schedule_type, {}).setdefault(
+                lesson.week_number, {}
+            )
+            day = days.get(lesson.day_name)
+            if day is None:
+                day = days[lesson.day_name] = {subgroup: [] for subgroup in Subgroup}
+
+            day[Subgroup.COMMON].append(lesson)
+            if lesson.subgroups == Subgroup.COMMON:
+                day[Subgroup.FIRST].append(lesson)
+                day[Subgroup.SECOND].append(lesson)
+            else:
+                day[lesson.subgroups].append(lesson)
+
+        for weeks in self.buckets.values():
+            for days in weeks.values():
+                for subgroups in days.values():
+                    for bucket in subgroups.values():
+                        bucket.sort(key=_lesson_sort_key)
+
+    @staticmethod
+    @profile(func_name="day_view_for_timetable")
+    def for_timetable(timetable: TimetableData) -> "DayView":
+        view = timetable.day_view
+        if view is None or view.size != len(timetable.lessons):
+            view = DayView(timetable.lessons)
+            timetable.day_view = view
+        return view
+
+    def lessons(
+        self,
+        schedule_type: ScheduleType,
+        week_number: WeekNumber,
+        day_name: DayName,
+        subgroup: Subgroup = Subgroup.COMMON,
+    ) -> List["Lesson"]:
+        try:
+            return self.buckets[schedule_type][week_number][day_name][subgroup]
+        except KeyError:
+            return []
+
+
+def _lesson_sort_key(lesson: "Lesson"):
+    return lesson.time_begin or time.min
 
 
 class FilteredLessonsBuilder:
@@ -289,11 +482,27 @@ class FilteredLessonsBuilder:
         self._filters.append(predicate)
         return self
 
+    def _compile(self) -> Optional[Callable[["Lesson"], bool]]:
+        predicates = tuple(self._filters)
+
+        if not predicates:
+            return None
+        if len(predicates) == 1:
+            return predicates[0]
+
+        def predicate(lesson):
+            for check in predicates:
+                if not check(lesson):
+                    return False
+            return True
+
+        return predicate
+
     @profile(func_name="filtered_lessons_builder_build")
     def build(self) -> List["Lesson"]:
-        result = self._lessons
+        predicate = self._compile()
 
-        for filter_func in self._filters:
-            result = [lesson for lesson in result if filter_func(lesson)]
+        if predicate is None:
+            return self._lessons
 
-        return result
+        return [lesson for lesson in self._lessons if predicate(lesson)]
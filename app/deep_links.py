@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.utils.deep_linking import create_deep_link
+
+from config import settings
+from profiler import metrics
+
+
+class DeepLinkBuilder:
+    # Ссылки t.me/<bot>?start=<payload> на сущности расписания. Имя бота
+    # запрашивается один раз, готовые ссылки хранятся в LRU: одни и те же
+    # аудитории, преподаватели и группы встречаются в каждом уведомлении
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = max(maxsize, 1)
+        self._usernames: Dict[int, str] = {}
+        self._links: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+
+    async def username(self, bot: Bot) -> str:
+        username = self._usernames.get(bot.id)
+        if username is None:
+            username = self._usernames[bot.id] = (await bot.me()).username
+        return username
+
+    def _cached(self, bot: Bot, entity_name: str) -> Optional[str]:
+        key = (bot.id, entity_name)
+        link = self._links.get(key)
+        if link is not None:
+            self._links.move_to_end(key)
+            metrics.increment("deep_link_hits")
+        return link
+
+    def _store(self, bot: Bot, entity_name: str, link: str):
+        self._links[(bot.id, entity_name)] = link
+        if len(self._links) > self.maxsize:
+            self._links.popitem(last=False)
+        metrics.increment("deep_link_misses")
+
+    async def link(self, bot: Bot, entity_name: str) -> str:
+        link = self._cached(bot, entity_name)
+        if link is None:
+            link = create_deep_link(
+                username=await self.username(bot),
+                link_type="start",
+                payload=entity_name,
+                encode=True,
+            )
+            self._store(bot, entity_name, link)
+        return link
+
+    async def links(self, bot: Bot, entity_names: Iterable[str]) -> Dict[str, str]:
+        return {
+            name: await self.link(bot, name)
+            for name in dict.fromkeys(entity_names)
+            if name
+        }
+
+    def clear(self):
+        self._usernames.clear()
+        self._links.clear()
+
+
+deep_links = DeepLinkBuilder(settings.DEEP_LINK_CACHE_SIZE)
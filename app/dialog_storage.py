@@ -0,0 +1,70 @@
+import json
+from enum import Enum
+from typing import Any, Optional, Union
+
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+from loguru import logger
+
+from codec import ENUM_TYPES
+from parser_types import Entity, EntityType
+
+# Состояние диалогов хранит только фильтры (перечисления) и сущности
+# (тип, id, имя). Все остальное сохранить нельзя: расписание окна загружают
+# по id сущности, а не кладут в dialog_data
+ENUM_TAG = "$e"
+ENTITY_TAG = "$n"
+
+
+def _default(obj):
+    if isinstance(obj, Enum):
+        return {ENUM_TAG: [type(obj).__name__, obj.value]}
+    if isinstance(obj, Entity):
+        return {ENTITY_TAG: [obj.type.value, obj.id, obj.name]}
+    raise TypeError(f"{type(obj).__name__} нельзя сохранить в состоянии диалога")
+
+
+def _object_hook(obj: dict):
+    if len(obj) == 1:
+        if ENUM_TAG in obj:
+            enum_name, value = obj[ENUM_TAG]
+            return ENUM_TYPES[enum_name](value)
+        if ENTITY_TAG in obj:
+            entity_type, entity_id, name = obj[ENTITY_TAG]
+            return Entity(type=EntityType(entity_type), id=entity_id, name=name)
+    return obj
+
+
+def dumps_state(data: Any) -> str:
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads_state(raw: Union[str, bytes]) -> Any:
+    return json.loads(raw, object_hook=_object_hook)
+
+
+def create_storage(kind: str, redis_uri: str, ttl: Optional[int] = None) -> BaseStorage:
+    # memory - состояние в памяти процесса, теряется при перезапуске;
+    # redis - общее для всех процессов, записи живут ttl секунд с изменения
+    if kind == "redis":
+        logger.info(f"Состояние диалогов в Redis (TTL {ttl} с)")
+        return RedisStorage.from_url(
+            redis_uri,
+            # aiogram-dialog хранит стек и контексты под разными destiny
+            key_builder=DefaultKeyBuilder(prefix="fsm", with_destiny=True),
+            state_ttl=ttl,
+            data_ttl=ttl,
+            json_dumps=dumps_state,
+            json_loads=loads_state,
+        )
+
+    return MemoryStorage()
+
+
+def create_isolation(storage: BaseStorage) -> Optional[BaseEventIsolation]:
+    # Блокировка стека диалогов между процессами; для памяти подходит
+    # стандартная блокировка aiogram-dialog внутри процесса
+    if isinstance(storage, RedisStorage):
+        return storage.create_isolation()
+    return None
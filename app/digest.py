@@ -0,0 +1,145 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, List, Optional
+
+from loguru import logger
+
+from codec import from_payload, to_payload
+from coalescer import coalesce_changes
+from database import (
+    Database,
+    DigestModel,
+    DELIVERY_DAILY,
+    DELIVERY_HOURLY,
+)
+from parser_types import TimetableChangeData
+from profiler import profile, metrics
+
+DIGEST_TITLES = {
+    DELIVERY_HOURLY: "Сводка изменений за час",
+    DELIVERY_DAILY: "Сводка изменений за день",
+}
+
+
+def next_digest_time(
+    delivery_mode: str, digest_time: Optional[str], now: datetime
+) -> datetime:
+    # Ближайшее время отправки строго после now: начало следующего часа
+    # или ближайшее digest_time ("ЧЧ:ММ")
+    if delivery_mode == DELIVERY_DAILY and digest_time:
+        hour, minute = map(int, digest_time.split(":"))
+        due_at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return due_at if due_at > now else due_at + timedelta(days=1)
+
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
+class DigestScheduler:
+    # Копит изменения для подписок со сводками и по наступлении времени отдает
+    # объединенное изменение в deliver (рассылка через outbox). Несколько
+    # реплик делят сводки через аренду записи, как в NotificationOutbox
+    def __init__(
+        self,
+        database: Database,
+        deliver: Callable[[TimetableChangeData, List[int], str], Awaitable[Any]],
+        lease_seconds: float = 120.0,
+        poll_interval: float = 30.0,
+        max_attempts: int = 5,
+    ):
+        self.database = database
+        self.deliver = deliver
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max(max_attempts, 1)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+
+    @profile(func_name="digest_scheduler_add")
+    async def add(
+        self,
+        message: TimetableChangeData,
+        delivery_mode: str,
+        due_at: datetime,
+        recipients: List[int],
+    ):
+        await self.database.add_to_digest(
+            message.entity.name, delivery_mode, due_at, to_payload(message), recipients
+        )
+        metrics.increment("digest_changes_added")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Запущена отправка сводок изменений ({self.owner})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while digest := await self.database.claim_due_digest(
+                    self.owner, self.lease_seconds, self.max_attempts
+                ):
+                    try:
+                        await self._send(digest)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # Аренда остается: повтор после ее истечения
+                        self._failed(digest, e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводок: {e}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    def _failed(self, digest: DigestModel, error: Exception):
+        if digest.attempts >= self.max_attempts:
+            metrics.increment("digest_failed")
+            logger.error(
+                f"Сводка для {digest.entity_name} ({digest.delivery_mode}) "
+                f"прекращена после {digest.attempts} попыток: {error}"
+            )
+        else:
+            logger.error(
+                f"Ошибка отправки сводки для {digest.entity_name}, попытка "
+                f"{digest.attempts} из {self.max_attempts}: {error}"
+            )
+
+    @profile(func_name="digest_scheduler_send")
+    async def _send(self, digest: DigestModel):
+        # Сбой до завершения приведет к повторной отправке после истечения
+        # аренды; ее отсеет ключ outbox. В ключ входит время сводки: вечерняя и
+        # утренняя сводки с одинаковым содержимым - разные доставки. Изменения,
+        # дописанные после захвата, уходят следующей доставкой той же сводки
+        message = coalesce_changes([from_payload(change) for change in digest.changes])
+        message.delivery_id = (
+            f"digest:{digest.delivery_mode}:{digest.due_at.isoformat()}:"
+            f"{digest.sent}:{len(digest.changes)}"
+        )
+        if message.lesson_changes:
+            title = DIGEST_TITLES.get(
+                digest.delivery_mode, DIGEST_TITLES[DELIVERY_HOURLY]
+            )
+            await self.deliver(
+                message, digest.recipients, f"{title} ({digest.due_at:%d.%m %H:%M})"
+            )
+            metrics.increment("digest_sent")
+            logger.debug(
+                f"Сводка для {digest.entity_name} ({digest.delivery_mode}): "
+                f"{len(digest.changes)} сообщений -> {len(message.lesson_changes)} "
+                f"изменений, {len(digest.recipients)} получателей"
+            )
+        else:
+            # Изменения за период взаимно погасились
+            metrics.increment("digest_empty")
+
+        await self.database.finish_digest(digest, self.owner)
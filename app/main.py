@@ -7,41 +7,100 @@ from config import settings
 from database import database
 from broker import Broker
 from bot import BotRunner
+from coalescer import ChangeCoalescer, coalescing_prefetch
+from parser_types import TimetableChangeData
+from profiler import metrics_logger
+from timetable_registry import timetables
+from timetable_pages import day_pages
+from webhook import run_worker_processes
 
 
-async def background_main(broker: Broker):
-    logger.info("Starting message consumer")
-    while True:
-        if BotRunner.bot is None or BotRunner.dp is None:
-            BotRunner.init(settings.BOT_TOKEN)
-            await asyncio.sleep(1)
-            continue
-
-        changes = await broker.get_message()
-        if changes:
-            await BotRunner.receive_notification(changes)
-        await asyncio.sleep(1)
-
-
-async def main():
-    logger.info("Starting up")
+async def main(worker: int = 0):
+    logger.info(f"Starting up (worker {worker})")
     await BotRunner.init(settings.BOT_TOKEN)
 
     await database.initialize()
-    async with Broker(connection_string=settings.RABBITMQ_URI) as broker:
-        asyncio.create_task(background_main(broker))
+    metrics_logger.start()
+    BotRunner.outbox.start()
+    BotRunner.digests.start()
+    if worker == 0:
+        # Рассылка на завтра обходит все подписки: одного процесса достаточно
+        BotRunner.tomorrow.start()
+    prefetch_count = coalescing_prefetch(
+        settings.BROKER_PREFETCH_COUNT,
+        settings.NOTIFICATION_EXPECTED_RATE,
+        settings.NOTIFICATION_COALESCE_WINDOW,
+        settings.NOTIFICATION_COALESCE_MAX_DELAY,
+    )
+    if prefetch_count > settings.BROKER_PREFETCH_COUNT:
+        logger.info(
+            f"prefetch {settings.BROKER_PREFETCH_COUNT} -> {prefetch_count}: "
+            "сообщения ждут окна объединения неподтвержденными"
+        )
+    async with Broker(
+        connection_string=settings.RABBITMQ_URI,
+        prefetch_count=prefetch_count,
+        shutdown_timeout=settings.BROKER_SHUTDOWN_TIMEOUT,
+        publish_batch_size=settings.BROKER_PUBLISH_BATCH_SIZE,
+        publish_window=settings.BROKER_PUBLISH_WINDOW,
+        publish_coalesce=settings.BROKER_PUBLISH_COALESCE,
+        codec_version=settings.BROKER_CODEC_VERSION,
+        max_attempts=settings.BROKER_MAX_ATTEMPTS,
+        retry_delay=settings.BROKER_RETRY_DELAY,
+        retry_max_delay=settings.BROKER_RETRY_MAX_DELAY,
+        metrics_interval=settings.BROKER_METRICS_INTERVAL,
+        lag_alert=settings.BROKER_LAG_ALERT_SECONDS,
+    ) as broker:
+        coalescer = ChangeCoalescer(
+            BotRunner.receive_notification,
+            window=settings.NOTIFICATION_COALESCE_WINDOW,
+            max_delay=settings.NOTIFICATION_COALESCE_MAX_DELAY,
+            retry_delays=broker.retry_delays,
+        )
+
+        def on_change(change: TimetableChangeData):
+            # Открытые окна сразу видят новое расписание, а уведомление
+            # ждет окна объединения изменений
+            timetables.invalidate(change.entity.id)
+            day_pages.invalidate(change.entity.id)
+            return coalescer.submit(change)
+
+        # Порядок изменений сущности держится только внутри процесса (см.
+        # Broker.start_consuming), поэтому очередь читает один процесс
+        if worker == 0:
+            logger.info("Starting message consumer")
+            await broker.start_consuming(on_change)
 
         logger.info("Starting bot")
-        await BotRunner.run_bot()
+        try:
+            await BotRunner.run_bot(worker)
+        finally:
+            await coalescer.close()
+            await BotRunner.tomorrow.stop()
+            await BotRunner.digests.stop()
+            await BotRunner.outbox.stop()
+            await metrics_logger.stop()
     await database.close()
 
 
-if __name__ == "__main__":
+def run(worker: int = 0):
     configure_logging()
 
     try:
-        asyncio.run(main())
+        asyncio.run(main(worker))
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt")
     except Exception as e:
         logger.exception(f"Error when starting: {e}")
+
+
+if __name__ == "__main__":
+    if settings.BOT_MODE == "webhook" and settings.WEBHOOK_WORKERS > 1:
+        configure_logging()
+        if settings.FSM_STORAGE != "redis":
+            # Обновления одного пользователя попадают в разные процессы,
+            # а состояние диалогов в памяти у каждого свое
+            logger.warning("Несколько процессов без FSM_STORAGE=redis")
+        run_worker_processes(run, settings.WEBHOOK_WORKERS)
+    else:
+        run()
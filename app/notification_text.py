@@ -0,0 +1,317 @@
+import re
+from dataclasses import replace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from parser_types import (
+    ChangeType,
+    Lesson,
+    LessonChange,
+    Subgroup,
+    TimetableChangeData,
+)
+
+# Ограничение Telegram на длину сообщения; считается по тексту с тегами, с запасом
+MAX_MESSAGE_LENGTH = 4096
+NOTIFICATION_TITLE = "Изменения в расписании"
+
+_TAG = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>")
+
+
+def notification_entity_names(message: TimetableChangeData) -> Iterable[str]:
+    # Все сущности, на которые в уведомлении могут быть ссылки
+    yield message.entity.name
+    for change in message.lesson_changes:
+        for lesson in (change.old_lesson, change.new_lesson):
+            if lesson is None:
+                continue
+            if lesson.auditorium:
+                yield lesson.auditorium
+            yield from lesson.professors or ()
+            yield from lesson.groups or ()
+
+
+def lesson_visible(lesson: Optional[Lesson], subgroup: Subgroup) -> bool:
+    # Те же правила, что в DayView: без подгруппы видны все занятия,
+    # с подгруппой - ее занятия и общие
+    if lesson is None:
+        return False
+    return subgroup == Subgroup.COMMON or lesson.subgroups in (
+        Subgroup.COMMON,
+        subgroup,
+    )
+
+
+def change_visible(change: LessonChange, subgroup: Subgroup) -> bool:
+    if change.change_type == ChangeType.LESSON_ADDED:
+        return lesson_visible(change.new_lesson, subgroup)
+    if change.change_type == ChangeType.LESSON_REMOVED:
+        return lesson_visible(change.old_lesson, subgroup)
+    # Занятие, перенесенное в другую подгруппу, касается обеих
+    return lesson_visible(change.old_lesson, subgroup) or lesson_visible(
+        change.new_lesson, subgroup
+    )
+
+
+def changes_for_subgroup(
+    message: TimetableChangeData, subgroup: Subgroup
+) -> TimetableChangeData:
+    return replace(
+        message,
+        lesson_changes=[
+            change
+            for change in message.lesson_changes or []
+            if change_visible(change, subgroup)
+        ],
+    )
+
+
+def _linked(name: str, links: Dict[str, str]) -> str:
+    return f"<a href='{links[name]}'>{name}</a>"
+
+
+def _lesson_header(lesson: Lesson) -> str:
+    name = lesson.lesson_name
+    time_str = lesson.time_begin.strftime("%H:%M") if lesson.time_begin else ""
+
+    if lesson.day_date:
+        date_str = lesson.day_date.strftime("%d.%m.%Y")
+        if time_str:
+            return f"<b>{date_str}, {time_str} - {name}</b>\n"
+        return f"<b>{date_str} - {name}</b>\n"
+
+    header_parts = [
+        part
+        for part in (
+            lesson.week_number.value if lesson.week_number else "",
+            lesson.day_name.value if lesson.day_name else "",
+            time_str,
+        )
+        if part
+    ]
+    if header_parts:
+        return f"<b>{', '.join(header_parts)} - {name}</b>\n"
+    return f"<b>{name}</b>\n"
+
+
+def format_lesson(lesson: Lesson, links: Optional[Dict[str, str]] = None) -> str:
+    parts = [_lesson_header(lesson)]
+
+    if lesson.lesson_type:
+        parts.append(f"Тип: {lesson.lesson_type.value}\n")
+
+    if lesson.auditorium:
+        auditorium = (
+            _linked(lesson.auditorium, links)
+            if links is not None
+            else lesson.auditorium
+        )
+        parts.append(f"Аудитория: {auditorium}\n")
+
+    if lesson.professors:
+        professors = (
+            [_linked(professor, links) for professor in lesson.professors]
+            if links is not None
+            else lesson.professors
+        )
+        parts.append(f"Преподаватели: {', '.join(professors)}\n")
+
+    if lesson.subgroups and lesson.subgroups.value:
+        parts.append(f"Подгруппа: {lesson.subgroups.value}\n")
+
+    if lesson.groups and links is not None:
+        groups = [_linked(group, links) for group in lesson.groups]
+        parts.append(f"Группы: {', '.join(groups)}\n")
+
+    return "".join(parts)
+
+
+def _modified_fields(
+    old_lesson: Lesson, new_lesson: Lesson, links: Optional[Dict[str, str]]
+) -> List[str]:
+    changes = []
+
+    old_aud = old_lesson.auditorium
+    new_aud = new_lesson.auditorium
+    if old_aud != new_aud:
+        if links is not None:
+            old_text = _linked(old_aud, links) if old_aud else ""
+            new_text = _linked(new_aud, links) if new_aud else ""
+            changes.append(f"Аудитория: <s>{old_text}</s> → <b>{new_text}</b>")
+        else:
+            changes.append(f"Аудитория: <s>{old_aud}</s> → <b>{new_aud}</b>")
+
+    old_type = old_lesson.lesson_type.value if old_lesson.lesson_type else ""
+    new_type = new_lesson.lesson_type.value if new_lesson.lesson_type else ""
+    if old_type != new_type and old_type and new_type:
+        changes.append(f"Тип: <s>{old_type}</s> → <b>{new_type}</b>")
+
+    old_profs = old_lesson.professors if old_lesson.professors else []
+    new_profs = new_lesson.professors if new_lesson.professors else []
+    if str(old_profs) != str(new_profs):
+        if links is not None:
+            old_text = ", ".join(_linked(prof, links) for prof in old_profs)
+            new_text = ", ".join(_linked(prof, links) for prof in new_profs)
+        else:
+            old_text = ", ".join(old_profs)
+            new_text = ", ".join(new_profs)
+        if old_text and new_text:
+            changes.append(f"Преподаватели: <s>{old_text}</s> → <b>{new_text}</b>")
+
+    old_subgroup = old_lesson.subgroups.value if old_lesson.subgroups else ""
+    new_subgroup = new_lesson.subgroups.value if new_lesson.subgroups else ""
+    if old_subgroup != new_subgroup and old_subgroup and new_subgroup:
+        changes.append(f"Подгруппа: <s>{old_subgroup}</s> → <b>{new_subgroup}</b>")
+
+    if (
+        old_lesson.day_date
+        and new_lesson.day_date
+        and old_lesson.day_date != new_lesson.day_date
+    ):
+        old_date = old_lesson.day_date.strftime("%d.%m.%Y")
+        new_date = new_lesson.day_date.strftime("%d.%m.%Y")
+        changes.append(f"Дата: <s>{old_date}</s> → <b>{new_date}</b>")
+
+    old_time = old_lesson.time_begin.strftime("%H:%M") if old_lesson.time_begin else ""
+    new_time = new_lesson.time_begin.strftime("%H:%M") if new_lesson.time_begin else ""
+    if old_time != new_time and old_time and new_time:
+        changes.append(f"Время: <s>{old_time}</s> → <b>{new_time}</b>")
+
+    if not old_lesson.day_date and not new_lesson.day_date:
+        old_day = old_lesson.day_name.value if old_lesson.day_name else ""
+        new_day = new_lesson.day_name.value if new_lesson.day_name else ""
+        if old_day != new_day and old_day and new_day:
+            changes.append(f"День: <s>{old_day}</s> → <b>{new_day}</b>")
+
+        old_week = old_lesson.week_number.value if old_lesson.week_number else ""
+        new_week = new_lesson.week_number.value if new_lesson.week_number else ""
+        if old_week != new_week and old_week and new_week:
+            changes.append(f"Неделя: <s>{old_week}</s> → <b>{new_week}</b>")
+
+    if old_lesson.lesson_name != new_lesson.lesson_name:
+        changes.append(
+            f"Название: <s>{old_lesson.lesson_name}</s> → <b>{new_lesson.lesson_name}</b>"
+        )
+
+    if old_lesson.groups != new_lesson.groups and links is not None:
+        old_text = ", ".join(_linked(group, links) for group in old_lesson.groups or [])
+        new_text = ", ".join(_linked(group, links) for group in new_lesson.groups or [])
+        if old_text and new_text:
+            changes.append(f"Группы: <s>{old_text}</s> → <b>{new_text}</b>")
+
+    return changes
+
+
+def _change_block(change: LessonChange, links: Optional[Dict[str, str]]) -> str:
+    if change.change_type == ChangeType.LESSON_ADDED:
+        parts = [
+            "<b>➕ Добавлено занятие:</b>\n",
+            format_lesson(change.new_lesson, links),
+        ]
+    elif change.change_type == ChangeType.LESSON_REMOVED:
+        parts = [
+            "<b>➖ Удалено занятие:</b>\n",
+            format_lesson(change.old_lesson, links),
+        ]
+    else:  # LESSON_MODIFIED
+        parts = ["<b>🔄 Изменено занятие:</b>\n", _lesson_header(change.new_lesson)]
+
+        changes = _modified_fields(change.old_lesson, change.new_lesson, links)
+        if changes:
+            parts.append("Изменения:\n")
+            parts.extend(f"• {change_info}\n" for change_info in changes)
+        else:
+            parts.append("<i>Нет значимых изменений</i>\n")
+    parts.append("\n")
+    return "".join(parts)
+
+
+def _split_block(block: str, limit: int) -> List[str]:
+    # Блок длиннее лимита режется по строкам, а очень длинная строка - по символам.
+    # Открытые теги закрываются в конце части и открываются заново в следующей
+    chunks = []
+    stack: List[Tuple[str, str]] = []
+    current = ""
+    fresh = True
+
+    def closing() -> str:
+        return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+    def flush():
+        nonlocal current, fresh
+        chunks.append(current + closing())
+        current = "".join(tag for _, tag in stack)
+        fresh = True
+
+    position = 0
+    tokens = []
+    for match in _TAG.finditer(block):
+        tokens.append((None, block[position : match.start()]))
+        tokens.append((match, match.group(0)))
+        position = match.end()
+    tokens.append((None, block[position:]))
+
+    for match, token in tokens:
+        if match is None:
+            text = token
+            while text:
+                room = limit - len(current) - len(closing())
+                if len(text) <= room:
+                    current += text
+                    fresh = False
+                    break
+                cut = text.rfind("\n", 0, room) + 1
+                if not cut:
+                    if not fresh:
+                        flush()
+                        continue
+                    cut = max(room, 1)
+                current += text[:cut]
+                text = text[cut:]
+                flush()
+        elif match.group(1):
+            while stack:
+                if stack.pop()[0] == match.group(2):
+                    break
+            current += token
+        else:
+            required = len(token) + len(match.group(2)) + 3
+            if not fresh and len(current) + len(closing()) + required > limit:
+                flush()
+            current += token
+            stack.append((match.group(2), token))
+
+    if not fresh:
+        chunks.append(current + closing())
+    return chunks
+
+
+def paginate_html(blocks: Iterable[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    # Блоки с закрытыми тегами складываются в сообщения не длиннее limit;
+    # граница сообщения проходит между блоками, то есть между занятиями
+    pages = []
+    current = ""
+    for block in blocks:
+        for piece in [block] if len(block) <= limit else _split_block(block, limit):
+            if current and len(current) + len(piece) > limit:
+                pages.append(current)
+                current = ""
+            current += piece
+    if current:
+        pages.append(current)
+    return pages
+
+
+def render_notification(
+    message: TimetableChangeData,
+    links: Optional[Dict[str, str]] = None,
+    limit: int = MAX_MESSAGE_LENGTH,
+    title: str = NOTIFICATION_TITLE,
+) -> List[str]:
+    # Текст собирается один раз на изменение и рассылается всем подписчикам;
+    # links - заранее построенные ссылки на сущности (None - без ссылок).
+    # Большое изменение делится на несколько сообщений по границам занятий
+    entity_name = message.entity.name
+    entity = _linked(entity_name, links) if links is not None else entity_name
+    blocks = [f"🔔 <b>{title}: {entity}</b>\n\n"]
+    blocks.extend(_change_block(change, links) for change in message.lesson_changes)
+    return paginate_html(blocks, limit)
@@ -0,0 +1,226 @@
+import asyncio
+from dataclasses import dataclass, field
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from loguru import logger
+
+from profiler import profile, metrics
+
+# Ошибки, после которых писать в чат бессмысленно: пользователь заблокировал бота
+# или удалил аккаунт
+UNREACHABLE_CHAT_ERRORS = ("chat not found", "user is deactivated")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        # Под блокировкой ожидающие получают токены строго по очереди
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class FanoutResult:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    blocked: List[int] = field(default_factory=list)
+    latencies: List[float] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.sent / self.seconds if self.seconds else 0.0
+
+
+class NotificationSender:
+    # Рассылка одного сообщения многим чатам с учетом ограничений Telegram:
+    # общий поток сообщений, не чаще per_chat_rate в один чат, пауза на RetryAfter
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25.0,
+        per_chat_rate: float = 1.0,
+        concurrency: int = 16,
+        max_attempts: int = 3,
+        on_blocked: Optional[Callable[[int], Awaitable[Any]]] = None,
+    ):
+        self.bot = bot
+        # Без запаса на всплеск: Telegram считает сообщения по секундам, и полная
+        # корзина в начале рассылки дала бы почти двойной поток в первую секунду
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.per_chat_rate = per_chat_rate
+        self.concurrency = max(concurrency, 1)
+        self.max_attempts = max(max_attempts, 1)
+        self.on_blocked = on_blocked
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Полные корзины ничего не ограничивают, их можно выбросить
+                self._chat_buckets = {
+                    key: value
+                    for key, value in self._chat_buckets.items()
+                    if not value.idle
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        return bucket
+
+    async def _wait_pause(self):
+        # RetryAfter от Telegram относится ко всему боту, поэтому ждут все отправки
+        delay = self._paused_until - monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._paused_until - monotonic()
+
+    @profile(func_name="notification_sender_send")
+    async def send(
+        self,
+        chat_ids: Iterable[int],
+        text: Union[str, List[str]],
+        progress: Optional[Callable[[int], Awaitable[Any]]] = None,
+        **kwargs,
+    ) -> FanoutResult:
+        # text - одно сообщение или части длинного: части уходят в чат строго
+        # по порядку, разные чаты обрабатываются параллельно.
+        # progress вызывается для каждого чата, с которым рассылка закончена:
+        # доставлены все части или чат недоступен
+        parts = [text] if isinstance(text, str) else list(text)
+        result = FanoutResult()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = perf_counter()
+
+        async def send_one(chat_id: int):
+            async with semaphore:
+                if await self._send_one(chat_id, parts, kwargs, result) and progress:
+                    await progress(chat_id)
+
+        await asyncio.gather(
+            *(send_one(chat_id) for chat_id in dict.fromkeys(chat_ids))
+        )
+
+        result.seconds = perf_counter() - started
+        metrics.observe("notifier_fanout_time", result.seconds)
+        logger.debug(
+            f"Рассылка: отправлено {result.sent}, ошибок {result.failed}, "
+            f"заблокировали бота {len(result.blocked)}, повторов {result.retries} "
+            f"за {result.seconds:.2f} с ({result.messages_per_second:.1f} сообщ./с)"
+        )
+        return result
+
+    async def _send_one(
+        self,
+        chat_id: int,
+        parts: List[str],
+        kwargs: Dict[str, Any],
+        result: FanoutResult,
+    ) -> bool:
+        for part in parts:
+            delivered = await self._send_part(chat_id, part, kwargs, result)
+            if delivered is None:
+                return True
+            if not delivered:
+                # Остальные части без пропущенной не имеют смысла
+                return False
+        return True
+
+    async def _send_part(
+        self, chat_id: int, text: str, kwargs: Dict[str, Any], result: FanoutResult
+    ) -> Optional[bool]:
+        # None - чат недоступен, дальше в него не пишем
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_pause()
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+
+            started = perf_counter()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                latency = perf_counter() - started
+                result.sent += 1
+                result.latencies.append(latency)
+                metrics.increment("notifier_sent")
+                metrics.observe("notifier_send_time", latency)
+                return True
+            except TelegramRetryAfter as e:
+                result.retries += 1
+                metrics.increment("notifier_retry_after")
+                self._paused_until = max(
+                    self._paused_until, monotonic() + e.retry_after
+                )
+                logger.warning(
+                    f"Telegram ограничил отправку, пауза {e.retry_after} с "
+                    f"(чат {chat_id}, попытка {attempt})"
+                )
+            except TelegramForbiddenError:
+                await self._blocked(chat_id, result)
+                return None
+            except TelegramBadRequest as e:
+                if any(error in e.message.lower() for error in UNREACHABLE_CHAT_ERRORS):
+                    await self._blocked(chat_id, result)
+                    return None
+                result.failed += 1
+                metrics.increment("notifier_failed")
+                logger.error(f"Ошибка отправки в чат {chat_id}: {e.message}")
+                return False
+            except (TelegramNetworkError, TelegramServerError) as e:
+                result.retries += 1
+                metrics.increment("notifier_transient_errors")
+                logger.warning(f"Временная ошибка отправки в чат {chat_id}: {e}")
+                await asyncio.sleep(min(2**attempt, 30))
+            except Exception as e:
+                result.failed += 1
+                metrics.increment("notifier_failed")
+                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+                return False
+
+        result.failed += 1
+        metrics.increment("notifier_failed")
+        logger.error(
+            f"Не удалось отправить сообщение в чат {chat_id} "
+            f"за {self.max_attempts} попыток"
+        )
+        return False
+
+    async def _blocked(self, chat_id: int, result: FanoutResult):
+        result.blocked.append(chat_id)
+        metrics.increment("notifier_blocked")
+        logger.info(f"Чат {chat_id} недоступен для бота, подписки будут удалены")
+        if self.on_blocked:
+            try:
+                await self.on_blocked(chat_id)
+            except Exception as e:
+                logger.error(f"Ошибка при отписке недоступного чата {chat_id}: {e}")
@@ -0,0 +1,157 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import time, timedelta
+from bisect import bisect_right
+from parser_types import EntityType, WeekNumber, DayName, Lesson, ScheduleType
+
+
+LESSON_SLOTS: List[Tuple[time, time]] = [
+    (time(8, 0), time(9, 30)),
+    (time(9, 40), time(11, 10)),
+    (time(11, 30), time(13, 0)),
+    (time(13, 30), time(15, 0)),
+    (time(15, 10), time(16, 40)),
+    (time(16, 50), time(18, 20)),
+    (time(18, 30), time(20, 0)),
+    (time(20, 10), time(21, 40)),
+]
+
+SLOTS_PER_DAY = len(LESSON_SLOTS)
+WEEKS = list(WeekNumber)
+DAYS = list(DayName)
+
+_WEEK_INDEX = {week: index for index, week in enumerate(WEEKS)}
+_DAY_INDEX = {day: index for index, day in enumerate(DAYS)}
+_SLOT_BEGINS = [begin.hour * 60 + begin.minute for begin, _ in LESSON_SLOTS]
+_SLOT_ENDS = [end.hour * 60 + end.minute for _, end in LESSON_SLOTS]
+_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+
+def slot_number(time_begin: Optional[time]) -> Optional[int]:
+    # Номер пары (с единицы) по времени начала, если оно совпадает с сеткой звонков
+    if time_begin is None:
+        return None
+    minutes = time_begin.hour * 60 + time_begin.minute
+    index = bisect_right(_SLOT_BEGINS, minutes) - 1
+    if index >= 0 and _SLOT_BEGINS[index] == minutes:
+        return index + 1
+    return None
+
+
+def _slots_mask(time_begin: time, duration: Optional[timedelta]) -> int:
+    begin = time_begin.hour * 60 + time_begin.minute
+    end = begin + (int(duration.total_seconds()) // 60 if duration else 90)
+
+    mask = 0
+    for index in range(SLOTS_PER_DAY):
+        if _SLOT_BEGINS[index] < end and begin < _SLOT_ENDS[index]:
+            mask |= 1 << index
+    return mask
+
+
+def _range_mask(first_slot: int, last_slot: int) -> int:
+    if not 1 <= first_slot <= last_slot <= SLOTS_PER_DAY:
+        raise ValueError(f"Invalid slot range: {first_slot}-{last_slot}")
+    return ((1 << (last_slot - first_slot + 1)) - 1) << (first_slot - 1)
+
+
+class OccupancyIndex:
+    # Для каждой сущности - битовая маска занятости: неделя × день × пара
+    def __init__(self):
+        self.masks: Dict[EntityType, Dict[str, int]] = {
+            entity_type: {} for entity_type in EntityType
+        }
+
+    @staticmethod
+    def _shift(week_number: WeekNumber, day_name: DayName) -> int:
+        return (
+            _WEEK_INDEX[week_number] * len(DAYS) + _DAY_INDEX[day_name]
+        ) * SLOTS_PER_DAY
+
+    def register(self, entity_type: EntityType, name: str):
+        if name:
+            self.masks[entity_type].setdefault(name, 0)
+
+    def occupy(
+        self,
+        entity_type: EntityType,
+        name: str,
+        week_number: WeekNumber,
+        day_name: DayName,
+        time_begin: time,
+        duration: Optional[timedelta] = None,
+    ):
+        if not name:
+            return
+        mask = _slots_mask(time_begin, duration) << self._shift(week_number, day_name)
+        masks = self.masks[entity_type]
+        masks[name] = masks.get(name, 0) | mask
+
+    def add_lesson(self, lesson: Lesson):
+        if (
+            lesson.schedule_type != ScheduleType.REGULAR
+            or lesson.week_number is None
+            or lesson.day_name is None
+            or lesson.time_begin is None
+        ):
+            return
+
+        args = (lesson.week_number, lesson.day_name, lesson.time_begin, lesson.duration)
+        self.occupy(EntityType.AUDITORIUM, lesson.auditorium, *args)
+        for professor in lesson.professors or []:
+            self.occupy(EntityType.PROFESSOR, professor, *args)
+        for group in lesson.groups or []:
+            self.occupy(EntityType.GROUP, group, *args)
+
+    def day_mask(
+        self,
+        entity_type: EntityType,
+        name: str,
+        week_number: WeekNumber,
+        day_name: DayName,
+    ) -> int:
+        mask = self.masks[entity_type].get(name, 0)
+        return (mask >> self._shift(week_number, day_name)) & _DAY_MASK
+
+    def is_free(
+        self,
+        entity_type: EntityType,
+        name: str,
+        week_number: WeekNumber,
+        day_name: DayName,
+        first_slot: int,
+        last_slot: Optional[int] = None,
+    ) -> bool:
+        wanted = _range_mask(first_slot, last_slot or first_slot)
+        return not self.day_mask(entity_type, name, week_number, day_name) & wanted
+
+    def free_entities(
+        self,
+        entity_type: EntityType,
+        week_number: WeekNumber,
+        day_name: DayName,
+        first_slot: int,
+        last_slot: Optional[int] = None,
+        names: Optional[Iterable[str]] = None,
+    ) -> List[str]:
+        wanted = _range_mask(first_slot, last_slot or first_slot) << self._shift(
+            week_number, day_name
+        )
+        masks = self.masks[entity_type]
+        candidates = masks.keys() if names is None else names
+        return sorted(name for name in candidates if not masks.get(name, 0) & wanted)
+
+    def free_slots(
+        self,
+        entity_type: EntityType,
+        name: str,
+        week_number: WeekNumber,
+        day_name: DayName,
+        first_slot: int = 1,
+        last_slot: int = SLOTS_PER_DAY,
+    ) -> List[int]:
+        busy = self.day_mask(entity_type, name, week_number, day_name)
+        return [
+            slot
+            for slot in range(first_slot, last_slot + 1)
+            if not busy & (1 << (slot - 1))
+        ]
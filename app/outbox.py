@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from loguru import logger
+
+from codec import encode_change
+from database import (
+    Database,
+    OutboxModel,
+    OUTBOX_FAILED,
+    OUTBOX_PENDING,
+    OUTBOX_SENT,
+)
+from notifier import NotificationSender
+from parser_types import TimetableChangeData
+from profiler import profile, metrics
+
+
+class NotificationOutbox:
+    # Уведомления сначала записываются в MongoDB, затем рассылаются фоновой задачей.
+    # Несколько реплик делят очередь через аренду записи: после сбоя рассылку
+    # подхватит любая реплика, начиная с чатов, которым сообщение еще не ушло
+    def __init__(
+        self,
+        database: Database,
+        sender: NotificationSender,
+        lease_seconds: float = 120.0,
+        poll_interval: float = 5.0,
+        max_attempts: int = 5,
+        retry_delay: float = 30.0,
+        progress_batch: int = 25,
+    ):
+        self.database = database
+        self.sender = sender
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_delay = retry_delay
+        self.progress_batch = max(progress_batch, 1)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def delivery_identity(change: TimetableChangeData) -> str:
+        # id сообщения брокера (или сводки); без него - само изменение
+        if change.delivery_id:
+            return change.delivery_id
+        return hashlib.sha256(encode_change(change)).hexdigest()
+
+    @staticmethod
+    def notification_key(
+        delivery_id: str, variant: str, entity_name: str, recipients: List[int]
+    ) -> str:
+        # Ключ - доставка и ее получатели, а не текст: повтор той же доставки
+        # отсеивается, а то же изменение, пришедшее снова (аудитория 101 -> 102,
+        # откат, снова 101 -> 102), отправляется
+        digest = hashlib.sha256()
+        for part in (delivery_id, variant, entity_name):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        digest.update(",".join(map(str, sorted(set(recipients)))).encode())
+        return digest.hexdigest()
+
+    @profile(func_name="notification_outbox_enqueue")
+    async def enqueue(
+        self,
+        delivery_id: str,
+        variant: str,
+        entity_name: str,
+        parts: List[str],
+        recipients: List[int],
+        parse_mode: Optional[str] = None,
+    ) -> bool:
+        inserted = await self.database.enqueue_notification(
+            NotificationOutbox.notification_key(
+                delivery_id, variant, entity_name, recipients
+            ),
+            entity_name,
+            parts,
+            list(dict.fromkeys(recipients)),
+            parse_mode,
+        )
+        if inserted:
+            metrics.increment("outbox_enqueued")
+            self._wakeup.set()
+        else:
+            metrics.increment("outbox_duplicates")
+        return inserted
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Запущена отправка уведомлений из outbox ({self.owner})")
+
+    async def stop(self):
+        # Незавершенная рассылка останется в outbox и продолжится после истечения аренды
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while notification := await self.database.claim_notification(
+                    self.owner, self.lease_seconds
+                ):
+                    await self._deliver(notification)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обработки outbox: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @profile(func_name="notification_outbox_deliver")
+    async def _deliver(self, notification: OutboxModel):
+        done = set(notification.done)
+        pending = [
+            chat_id for chat_id in notification.recipients if chat_id not in done
+        ]
+        if done:
+            logger.info(
+                f"Продолжение рассылки {notification.key[:12]} для "
+                f"{notification.entity_name}: осталось {len(pending)} из "
+                f"{len(notification.recipients)} (попытка {notification.attempts})"
+            )
+
+        buffer: List[int] = []
+        lease_lost = asyncio.Event()
+
+        async def flush():
+            if not buffer or lease_lost.is_set():
+                return
+            chunk = buffer[:]
+            buffer.clear()
+            held = await self.database.record_notification_progress(
+                notification, self.owner, chunk, self.lease_seconds
+            )
+            if not held:
+                # Рассылку продолжает реплика, перехватившая аренду: дальнейшая
+                # отправка отсюда дала бы получателям дубли
+                lease_lost.set()
+                sending.cancel()
+
+        async def progress(chat_id: int):
+            buffer.append(chat_id)
+            if len(buffer) >= self.progress_batch:
+                await flush()
+
+        sending = asyncio.create_task(
+            self.sender.send(
+                pending,
+                notification.parts,
+                progress=progress,
+                parse_mode=notification.parse_mode,
+            )
+        )
+        try:
+            result = await sending
+        except asyncio.CancelledError:
+            if not lease_lost.is_set():
+                # Остановка outbox: рассылка прерывается вместе с задачей
+                sending.cancel()
+                raise
+            metrics.increment("outbox_lease_lost")
+            logger.warning(
+                f"Аренда рассылки {notification.key[:12]} потеряна, "
+                "рассылка остановлена"
+            )
+            return
+        finally:
+            # Прогресс сохраняется и при остановке посреди рассылки
+            await asyncio.shield(flush())
+
+        if result.failed == 0:
+            status, retry_at = OUTBOX_SENT, None
+        elif notification.attempts >= self.max_attempts:
+            status, retry_at = OUTBOX_FAILED, None
+            logger.error(
+                f"Рассылка {notification.key[:12]} для {notification.entity_name} "
+                f"прекращена после {notification.attempts} попыток: "
+                f"{result.failed} чатов не получили уведомление"
+            )
+        else:
+            status = OUTBOX_PENDING
+            retry_at = datetime.now() + timedelta(
+                seconds=self.retry_delay * 2 ** (notification.attempts - 1)
+            )
+
+        await self.database.finish_notification(
+            notification, self.owner, status, retry_at
+        )
+        metrics.increment(f"outbox_{status}")
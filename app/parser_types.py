@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, List, Any
 from enum import Enum
 from datetime import date, time, timedelta
@@ -94,6 +94,10 @@ class TimetableData:
     entity: Entity
     metadata: Metadata
     lessons: list[Lesson]
+    # занятия по дням строятся лениво (см. database_searcher.DayView)
+    day_view: Optional[Any] = field(default=None, init=False, repr=False, compare=False)
+    # поколение объекта в TimetableRegistry: часть ключа кеша отрисованных дней
+    version: int = field(default=0, init=False, repr=False, compare=False)
 
 
 class ChangeType(Enum):
@@ -123,3 +127,8 @@ class TimetableChangeData:
     entity: Entity
     metadata_changes: Optional[List[FieldChange]] = None
     lesson_changes: Optional[List[LessonChange]] = None
+    # идентичность доставки (сообщение брокера, сводка): из нее строится ключ
+    # outbox; в тело сообщения не кодируется
+    delivery_id: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False
+    )
@@ -1,8 +1,11 @@
 import time
 import asyncio
 import atexit
+import json
+import re
+from typing import Optional
 from functools import wraps
-from collections import defaultdict
+from collections import defaultdict, deque
 from config import settings
 import psutil
 import os
@@ -17,6 +20,158 @@ RED = "\033[91m"
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
+METRICS_WINDOW = 1024
+
+
+class Metrics:
+    # Метрики времени выполнения, в отличие от Profiler, собираются всегда:
+    # счетчики, текущие значения и распределения последних METRICS_WINDOW замеров.
+    # Число и сумма замеров копятся за все время: их ждет summary в Prometheus
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.timings = defaultdict(lambda: deque(maxlen=METRICS_WINDOW))
+        self.timing_totals = defaultdict(lambda: [0, 0.0])
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        self.timings[name].append(seconds)
+        totals = self.timing_totals[name]
+        totals[0] += 1
+        totals[1] += seconds
+
+    @staticmethod
+    def _summary(samples) -> dict:
+        ordered = sorted(samples)
+        if not ordered:
+            return {"count": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": len(ordered),
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+            "max": ordered[-1],
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "timings": {
+                name: Metrics._summary(samples)
+                for name, samples in self.timings.items()
+            },
+            "timing_totals": {
+                name: tuple(totals) for name, totals in self.timing_totals.items()
+            },
+        }
+
+    def render_prometheus(self, prefix: str = "timetable_bot") -> str:
+        # Текстовый формат Prometheus для /metrics. Распределения отдаются
+        # summary: квантили по последним METRICS_WINDOW замерам, а _count и
+        # _sum за все время процесса
+        snapshot = self.snapshot()
+        pid = os.getpid()
+        lines = []
+
+        def metric(name: str, kind: str, samples):
+            name = f"{prefix}_{_METRIC_NAME.sub('_', name)}"
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                labels = ",".join([f'pid="{pid}"', *labels])
+                lines.append(f"{name}{suffix}{{{labels}}} {value}")
+
+        for name, value in sorted(snapshot["counters"].items()):
+            metric(f"{name}_total", "counter", [("", (), value)])
+        for name, value in sorted(snapshot["gauges"].items()):
+            metric(name, "gauge", [("", (), value)])
+        for name, summary in sorted(snapshot["timings"].items()):
+            count, total = snapshot["timing_totals"][name]
+            metric(
+                f"{name}_seconds",
+                "summary",
+                [
+                    ("", ('quantile="0.5"',), summary["p50"]),
+                    ("", ('quantile="0.95"',), summary["p95"]),
+                    ("", ('quantile="1"',), summary["max"]),
+                    ("_count", (), count),
+                    ("_sum", (), total),
+                ],
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def print_stats(self):
+        snapshot = self.snapshot()
+        if not any(snapshot.values()):
+            return
+
+        print("\n=== Runtime Metrics ===")
+        rows = [[name, value] for name, value in sorted(snapshot["counters"].items())]
+        rows += [
+            [name, round(value, 4)]
+            for name, value in sorted(snapshot["gauges"].items())
+        ]
+        if rows:
+            print(tabulate(rows, headers=["Metric", "Value"], tablefmt="grid"))
+
+        rows = [
+            [
+                name,
+                summary["count"],
+                round(summary["p50"], 4),
+                round(summary["p95"], 4),
+                round(summary["max"], 4),
+            ]
+            for name, summary in sorted(snapshot["timings"].items())
+        ]
+        if rows:
+            print(
+                tabulate(
+                    rows,
+                    headers=["Timing", "Samples", "p50 (s)", "p95 (s)", "Max (s)"],
+                    tablefmt="grid",
+                )
+            )
+
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class MetricsLogger:
+    # Раз в interval секунд пишет снимок метрик одной строкой JSON: в режиме
+    # polling нет /metrics, а логи собираются всегда
+    def __init__(self, metrics: Metrics, interval: float = 60.0):
+        self.metrics = metrics
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = self.metrics.snapshot()
+            logger.bind(metrics=snapshot).info(
+                "metrics " + json.dumps(snapshot, separators=(",", ":"))
+            )
+
+
+metrics = Metrics()
+metrics_logger = MetricsLogger(metrics, settings.METRICS_LOG_INTERVAL)
+
 if settings.DEBUG:
 
     class Profiler:
@@ -161,6 +316,8 @@ if settings.DEBUG:
 
             print(tabulate(resource_table, headers=resource_headers, tablefmt="grid"))
 
+            metrics.print_stats()
+
     profiler = Profiler()
 
 
@@ -0,0 +1,253 @@
+from collections import OrderedDict
+from itertools import product
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+
+from config import settings
+from database_searcher import DayView
+from deep_links import deep_links
+from parser_types import (
+    DayName,
+    EntityType,
+    ScheduleType,
+    Subgroup,
+    TimetableData,
+    WeekNumber,
+)
+from profiler import profile, metrics
+
+
+class RenderCache:
+    # Готовые HTML фрагменты расписания (страница дня) в LRU. Первый элемент
+    # ключа - id сущности: изменение сущности сбрасывает все ее страницы,
+    # а версия объекта расписания в ключе отсекает отрисовки прежних загрузок
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = max(maxsize, 1)
+        self._pages: "OrderedDict[Tuple[Hashable, ...], str]" = OrderedDict()
+        self._by_entity: Dict[int, Set[Tuple[Hashable, ...]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __contains__(self, key: Tuple[Hashable, ...]) -> bool:
+        return key in self._pages
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[str]:
+        page = self._pages.get(key)
+        if page is None:
+            metrics.increment("render_cache_misses")
+            return None
+
+        self._pages.move_to_end(key)
+        metrics.increment("render_cache_hits")
+        return page
+
+    def put(self, key: Tuple[Hashable, ...], page: str):
+        self._pages[key] = page
+        self._pages.move_to_end(key)
+        self._by_entity.setdefault(key[0], set()).add(key)
+        while len(self._pages) > self.maxsize:
+            self._forget(self._pages.popitem(last=False)[0])
+
+    def invalidate(self, entity_id: int):
+        for key in self._by_entity.pop(entity_id, ()):
+            self._pages.pop(key, None)
+        metrics.gauge("render_cache_pages", len(self._pages))
+
+    def clear(self):
+        self._pages.clear()
+        self._by_entity.clear()
+
+    def _forget(self, key: Tuple[Hashable, ...]):
+        keys = self._by_entity.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_entity[key[0]]
+
+
+day_pages = RenderCache(settings.RENDER_CACHE_SIZE)
+
+
+def week_number_for(day) -> WeekNumber:
+    # Неделя расписания по дате: окно расписания и рассылка на завтра
+    return WeekNumber.EVEN if day.isocalendar()[1] % 2 != 0 else WeekNumber.ODD
+
+
+def _html_link(text, url):
+    return f"<a href='{url}'>{text}</a>"
+
+
+# Номер пары по времени начала
+LESSON_NUMBERS = {
+    "08:00": "1️⃣",
+    "09:40": "2️⃣",
+    "11:30": "3️⃣",
+    "13:30": "4️⃣",
+    "15:10": "5️⃣",
+    "16:50": "6️⃣",
+    "18:30": "7️⃣",
+    "20:10": "8️⃣",
+}
+
+
+def _lesson_time_range(lesson) -> Tuple[str, str]:
+    begin = lesson.time_begin
+    if not begin:
+        return "??:??", "??:??"
+
+    duration = int(lesson.duration.total_seconds() // 60) if lesson.duration else 90
+    end = (begin.hour * 60 + begin.minute + duration) % (24 * 60)
+    return (
+        f"{begin.hour:02d}:{begin.minute:02d}",
+        f"{end // 60:02d}:{end % 60:02d}",
+    )
+
+
+EMPTY_DAY = "Занятия не найдены для выбранных фильтров"
+
+
+def _link_names(entity, lessons) -> List[str]:
+    names = []
+    for lesson in lessons:
+        if lesson.auditorium and entity.type != EntityType.AUDITORIUM:
+            names.append(lesson.auditorium)
+        names.extend(lesson.professors or ())
+        names.extend(lesson.groups or ())
+    return names
+
+
+async def _links(bot: Optional[Bot], entity, lessons) -> Dict[str, str]:
+    if not bot:
+        return {}
+    return {
+        name: await deep_links.link(bot, name)
+        for name in dict.fromkeys(_link_names(entity, lessons))
+    }
+
+
+def _format_lessons(entity, lessons, links: Dict[str, str], bot=None) -> str:
+    if not lessons:
+        return EMPTY_DAY
+
+    parts = []
+    for lesson in lessons:
+        time_str, end_time_str = _lesson_time_range(lesson)
+        parts.append(f"<b>{lesson.lesson_name}</b>\n")
+        parts.append(f"{LESSON_NUMBERS.get(time_str, '🔹')} ")
+        parts.append(f"<b>{time_str}-{end_time_str}</b>")
+        if lesson.lesson_type:
+            parts.append(f" | {lesson.lesson_type.value}")
+        if lesson.subgroups and lesson.subgroups != Subgroup.COMMON:
+            parts.append(f" | {lesson.subgroups.value}")
+        parts.append("\n")
+
+        if lesson.auditorium and entity.type != EntityType.AUDITORIUM and bot:
+            twogis_link_sign = (
+                f'<a href="https://2gis.ru/krasnoyarsk/search/{lesson.location}">📍</a>'
+            )
+            parts.append(
+                f"{_html_link(lesson.auditorium, links[lesson.auditorium])} "
+                f"{twogis_link_sign} \n"
+            )
+
+        if lesson.professors:
+            parts.append(
+                ", ".join(
+                    _html_link(professor, links[professor])
+                    for professor in lesson.professors
+                    if bot
+                )
+                + "\n"
+            )
+
+        if lesson.groups:
+            parts.append(
+                ", ".join(
+                    _html_link(group, links[group]) for group in lesson.groups if bot
+                )
+                + "\n"
+            )
+
+        parts.append("\n")
+
+    return "".join(parts)
+
+
+@profile(func_name="timetable_format_lessons")
+async def format_lessons(entity, lessons, bot=None):
+    if not lessons:
+        return EMPTY_DAY
+    return _format_lessons(entity, lessons, await _links(bot, entity, lessons), bot)
+
+
+def _page_key(
+    timetable_data: TimetableData,
+    schedule_type: ScheduleType,
+    week_number: WeekNumber,
+    day_name: DayName,
+    subgroup: Subgroup,
+) -> Tuple[Hashable, ...]:
+    return (
+        timetable_data.entity.id,
+        timetable_data.version,
+        schedule_type,
+        week_number,
+        day_name,
+        subgroup,
+    )
+
+
+@profile(func_name="timetable_render_day")
+async def render_day(
+    timetable_data: TimetableData,
+    schedule_type: ScheduleType,
+    week_number: WeekNumber,
+    day_name: DayName,
+    subgroup: Subgroup,
+    bot: Optional[Bot],
+) -> str:
+    # Страница дня одинакова для всех, кто смотрит эту сущность с теми же
+    # фильтрами: отрисовывается один раз на версию расписания
+    key = _page_key(timetable_data, schedule_type, week_number, day_name, subgroup)
+    page = day_pages.get(key)
+    if page is None:
+        lessons = DayView.for_timetable(timetable_data).lessons(
+            schedule_type, week_number, day_name, subgroup
+        )
+        page = await format_lessons(timetable_data.entity, lessons, bot)
+        day_pages.put(key, page)
+    return page
+
+
+@profile(func_name="timetable_precompute_pages")
+async def precompute_pages(
+    timetable_data: TimetableData, subgroup: Subgroup, bot: Optional[Bot]
+) -> int:
+    # Все страницы подгруппы (тип расписания x неделя x день) за один проход:
+    # ссылки на все сущности расписания запрашиваются один раз, занятия
+    # берутся из корзин DayView. Уже отрисованные страницы пропускаются
+    pages = [
+        (schedule_type, week_number, day_name)
+        for schedule_type, week_number, day_name in product(
+            ScheduleType, WeekNumber, DayName
+        )
+        if _page_key(timetable_data, schedule_type, week_number, day_name, subgroup)
+        not in day_pages
+    ]
+    if not pages:
+        return 0
+
+    entity = timetable_data.entity
+    view = DayView.for_timetable(timetable_data)
+    links = await _links(bot, entity, timetable_data.lessons)
+    for schedule_type, week_number, day_name in pages:
+        lessons = view.lessons(schedule_type, week_number, day_name, subgroup)
+        day_pages.put(
+            _page_key(timetable_data, schedule_type, week_number, day_name, subgroup),
+            _format_lessons(entity, lessons, links, bot),
+        )
+
+    metrics.increment("render_cache_precomputed", len(pages))
+    return len(pages)
@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import fields, is_dataclass
+from enum import Enum
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+from config import settings
+from database import Database, database
+from database_searcher import SearchTimetableDataBuilder
+from parser_types import TimetableData
+from profiler import profile, metrics
+
+
+def estimate_size(obj, seen: Optional[set] = None) -> int:
+    # Приблизительный размер в куче: объект, поля dataclass и содержимое
+    # контейнеров; общие объекты и перечисления считаются один раз
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, Enum):
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if is_dataclass(obj):
+        size += sys.getsizeof(obj.__dict__)
+        for field in fields(obj):
+            size += estimate_size(getattr(obj, field.name), seen)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, seen) + estimate_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, seen)
+    return size
+
+
+class TimetableRegistry:
+    # Один объект расписания на сущность в процессе. Диалоги хранят только
+    # id сущности и берут расписание отсюда, поэтому тысяча студентов одной
+    # группы делят одно расписание (и построенный на нем DayView).
+    # Недавно запрошенные расписания держатся в LRU не дольше ttl, остальные
+    # живут, пока на них есть ссылки (рендер, рассылка). Изменение сущности
+    # сбрасывает запись и увеличивает ее версию
+    def __init__(
+        self, database: Database, maxsize: int = 256, ttl: Optional[float] = 600.0
+    ):
+        self.database = database
+        self.maxsize = max(maxsize, 1)
+        self.ttl = ttl
+        self._recent: "OrderedDict[int, TimetableData]" = OrderedDict()
+        self._live: "weakref.WeakValueDictionary[int, TimetableData]" = (
+            weakref.WeakValueDictionary()
+        )
+        # entity_id -> (время загрузки, размер в байтах)
+        self._entries: Dict[int, Tuple[float, int]] = {}
+        self._versions: Dict[int, int] = {}
+        # Версии объектов, которые не попали в реестр: отрицательные и
+        # не повторяются, поэтому их отрисовки не достанутся другим загрузкам
+        self._detached_versions = itertools.count(-1, -1)
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    def version(self, entity_id: int) -> int:
+        return self._versions.get(entity_id, 0)
+
+    @profile(func_name="timetable_registry_get")
+    async def get(self, entity_id: int) -> Optional[TimetableData]:
+        timetable = self._cached(entity_id)
+        if timetable is not None:
+            metrics.increment("timetable_registry_hits")
+            return timetable
+
+        # Одновременные запросы одной сущности ждут одну загрузку
+        loading = self._loading.get(entity_id)
+        if loading is not None:
+            metrics.increment("timetable_registry_waits")
+            return await asyncio.shield(loading)
+
+        metrics.increment("timetable_registry_misses")
+        loading = self._loading[entity_id] = asyncio.get_running_loop().create_future()
+        version = self.version(entity_id)
+        try:
+            timetable = await self._load(entity_id)
+        except asyncio.CancelledError:
+            loading.cancel()
+            raise
+        except Exception as e:
+            loading.set_exception(e)
+            # Ошибку получат ожидающие; без них future не должен ругаться в лог
+            loading.exception()
+            raise
+        else:
+            # Изменение во время загрузки: отдаем прочитанное, но не запоминаем
+            if timetable is not None:
+                if version == self.version(entity_id):
+                    self._store(entity_id, timetable)
+                else:
+                    timetable.version = next(self._detached_versions)
+            loading.set_result(timetable)
+        finally:
+            del self._loading[entity_id]
+
+        return timetable
+
+    def invalidate(self, entity_id: int):
+        self._versions[entity_id] = self.version(entity_id) + 1
+        self._drop(entity_id)
+        metrics.increment("timetable_registry_invalidations")
+        self._account()
+
+    def clear(self):
+        self._recent.clear()
+        self._live.clear()
+        self._entries.clear()
+        self._account()
+
+    def stats(self) -> Dict[str, int]:
+        self._account()
+        return {
+            "recent": len(self._recent),
+            "live": len(self._entries),
+            "bytes": sum(size for _, size in self._entries.values()),
+        }
+
+    def _cached(self, entity_id: int) -> Optional[TimetableData]:
+        # В LRU только живые объекты, поэтому достаточно слабого словаря:
+        # вытесненное из LRU, но еще используемое расписание тоже найдется
+        timetable = self._live.get(entity_id)
+        if timetable is None:
+            return None
+
+        loaded_at, _ = self._entries[entity_id]
+        if self.ttl is not None and time.monotonic() - loaded_at >= self.ttl:
+            # Другие процессы могли получить изменение, а этот нет
+            self._drop(entity_id)
+            return None
+
+        self._remember(entity_id, timetable)
+        return timetable
+
+    async def _load(self, entity_id: int) -> Optional[TimetableData]:
+        # Мимо кеша Redis: свежесть обеспечивают invalidate и ttl
+        return (
+            await SearchTimetableDataBuilder(self.database)
+            .entity_id(entity_id)
+            .fetch_fresh()
+        )
+
+    def _store(self, entity_id: int, timetable: TimetableData):
+        # Каждый загруженный объект получает новую версию: отрисовки прежнего
+        # объекта (до изменения или истечения ttl) больше не подходят
+        self._versions[entity_id] = self.version(entity_id) + 1
+        timetable.version = self._versions[entity_id]
+        size = estimate_size(timetable)
+        self._live[entity_id] = timetable
+        self._entries[entity_id] = (time.monotonic(), size)
+        self._remember(entity_id, timetable)
+        self._account()
+        logger.debug(
+            f"Расписание {timetable.entity.name} загружено ({size // 1024} КБ)"
+        )
+
+    def _remember(self, entity_id: int, timetable: TimetableData):
+        self._recent[entity_id] = timetable
+        self._recent.move_to_end(entity_id)
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+
+    def _drop(self, entity_id: int):
+        self._recent.pop(entity_id, None)
+        self._live.pop(entity_id, None)
+        self._entries.pop(entity_id, None)
+
+    def _account(self):
+        # Записи о расписаниях, которые уже собрал сборщик мусора
+        for entity_id in set(self._entries) - set(self._live.keys()):
+            del self._entries[entity_id]
+        metrics.gauge("timetable_registry_entries", len(self._entries))
+        metrics.gauge(
+            "timetable_registry_bytes",
+            sum(size for _, size in self._entries.values()),
+        )
+
+
+timetables = TimetableRegistry(
+    database, settings.TIMETABLE_REGISTRY_SIZE, settings.TIMETABLE_REGISTRY_TTL
+)
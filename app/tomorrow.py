@@ -0,0 +1,166 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from loguru import logger
+
+from database import Database, DELIVERY_DAILY
+from database_searcher import DayView, SearchTimetableDataBuilder
+from deep_links import deep_links
+from digest import next_digest_time
+from notification_text import paginate_html
+from outbox import NotificationOutbox
+from parser_types import DayName, ScheduleType, TimetableData
+from profiler import profile, metrics
+from timetable_pages import format_lessons, week_number_for
+
+DAY_NAMES = list(DayName)
+
+
+@dataclass
+class TomorrowPushReport:
+    day: date
+    entities: int = 0
+    renders: int = 0
+    sends: int = 0
+    empty: int = 0
+    seconds: float = 0.0
+
+
+class TomorrowPush:
+    # Вечерняя рассылка расписания на завтра. День каждой сущности считается
+    # один раз на подгруппу, одинаковые варианты рендерятся один раз, рассылка
+    # идет через outbox и NotificationSender. Из процессов webhook задачу
+    # запускает только первый; реплики запускают ее одновременно, повторную
+    # рассылку того же дня отсеивает ключ outbox
+    def __init__(
+        self,
+        database: Database,
+        outbox: NotificationOutbox,
+        bot: Bot,
+        push_time: Optional[str] = "19:00",
+    ):
+        self.database = database
+        self.outbox = outbox
+        self.bot = bot
+        self.push_time = push_time
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.push_time and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Рассылка расписания на завтра в {self.push_time}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = datetime.now()
+            run_at = next_digest_time(DELIVERY_DAILY, self.push_time, now)
+            await asyncio.sleep((run_at - now).total_seconds())
+            try:
+                await self.run(run_at.date() + timedelta(days=1))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка рассылки расписания на завтра: {e}")
+
+    @profile(func_name="tomorrow_push_run")
+    async def run(self, day: date) -> TomorrowPushReport:
+        report = TomorrowPushReport(day=day)
+        started = perf_counter()
+
+        subscribers = await self.database.get_tomorrow_push_subscribers()
+        if subscribers:
+            async for timetable in (
+                SearchTimetableDataBuilder(self.database)
+                .custom_query({"entity.name": {"$in": list(subscribers)}})
+                .stream()
+            ):
+                report.entities += 1
+                try:
+                    await self._push_entity(
+                        timetable, subscribers[timetable.entity.name], day, report
+                    )
+                except Exception as e:
+                    # Остальные сущности рассылаются; повтор - при следующем запуске
+                    metrics.increment("tomorrow_push_errors")
+                    logger.error(
+                        f"Ошибка рассылки на завтра для {timetable.entity.name}: {e}"
+                    )
+
+        report.seconds = perf_counter() - started
+        metrics.observe("tomorrow_push_time", report.seconds)
+        metrics.increment("tomorrow_push_sends", report.sends)
+        logger.info(
+            f"Расписание на {day:%d.%m.%Y}: сущностей {report.entities}, "
+            f"рендеров {report.renders}, получателей {report.sends}, "
+            f"без занятий {report.empty}, {report.seconds:.2f} с"
+        )
+        return report
+
+    async def _push_entity(
+        self,
+        timetable: TimetableData,
+        users: List[int],
+        day: date,
+        report: TomorrowPushReport,
+    ):
+        entity_name = timetable.entity.name
+        audience = await self.database.get_subscribers_by_subgroup(entity_name, users)
+        view = DayView.for_timetable(timetable)
+        week_number = week_number_for(day)
+        day_name = DAY_NAMES[day.weekday()]
+
+        # Подгруппы с одинаковым набором занятий получают один текст; занятия
+        # подгрупп помечены в самом тексте, поэтому заголовок общий
+        variants: Dict[Tuple[int, ...], Tuple[list, List[int], List[str]]] = {}
+        for subgroup, subgroup_users in audience.items():
+            lessons = view.lessons(
+                ScheduleType.REGULAR, week_number, day_name, subgroup
+            )
+            if not lessons:
+                report.empty += len(subgroup_users)
+                continue
+            key = tuple(map(id, lessons))
+            if key in variants:
+                variants[key][1].extend(subgroup_users)
+                variants[key][2].append(subgroup.value)
+            else:
+                variants[key] = (lessons, list(subgroup_users), [subgroup.value])
+
+        for lessons, variant_users, subgroups in variants.values():
+            parts = await self._render(timetable, lessons, day, day_name)
+            report.renders += 1
+            if await self.outbox.enqueue(
+                f"tomorrow:{day.isoformat()}",
+                ",".join(sorted(subgroups)),
+                entity_name,
+                parts,
+                variant_users,
+                ParseMode.HTML,
+            ):
+                report.sends += len(variant_users)
+
+    async def _render(
+        self,
+        timetable: TimetableData,
+        lessons: list,
+        day: date,
+        day_name: DayName,
+    ) -> List[str]:
+        entity = timetable.entity
+        link = await deep_links.link(self.bot, entity.name)
+        title = (
+            f"🌙 <b>Завтра, {day:%d.%m} ({day_name.value.lower()}): "
+            f"<a href='{link}'>{entity.name}</a></b>\n\n"
+        )
+        return paginate_html([title, await format_lessons(entity, lessons, self.bot)])
@@ -0,0 +1,176 @@
+import asyncio
+import multiprocessing
+import signal
+from typing import Any, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+
+from profiler import metrics
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    # Обновления обрабатываются в фоне, но не больше max_concurrent одновременно:
+    # пока все слоты заняты, ответ Telegram задерживается, и тот сам снижает
+    # поток (не больше max_connections соединений на бота)
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        max_concurrent: int = 64,
+        secret_token: Optional[str] = None,
+        **data: Any,
+    ):
+        super().__init__(
+            dispatcher,
+            bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data,
+        )
+        self._slots = asyncio.Semaphore(max(max_concurrent, 1))
+        self._closing = False
+
+    async def _handle_request_background(
+        self, bot: Bot, request: web.Request
+    ) -> web.Response:
+        if self._closing:
+            # Telegram повторит обновление, его примет другой процесс
+            return web.Response(status=503)
+
+        await self._slots.acquire()
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except Exception:
+            self._slots.release()
+            raise
+
+        task = asyncio.create_task(self._feed_update(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        metrics.gauge(
+            "webhook_updates_in_flight", len(self._background_feed_update_tasks)
+        )
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed_update(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot, update)
+            metrics.increment("webhook_updates")
+        except Exception as e:
+            metrics.increment("webhook_update_errors")
+            logger.error(f"Ошибка обработки обновления: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float):
+        self._closing = True
+        tasks = list(self._background_feed_update_tasks)
+        if not tasks:
+            return
+
+        logger.info(f"Ожидание обработки {len(tasks)} обновлений")
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            logger.warning(f"Прервана обработка {len(pending)} обновлений")
+
+    async def close(self):
+        # Сессию бота закрывает владелец: после остановки сервера она еще нужна
+        # для отправки уведомлений при завершении
+        pass
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    # Метрики процесса, принявшего запрос: при нескольких процессах на одном
+    # порту их различает метка pid
+    return web.Response(
+        body=metrics.render_prometheus().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    base_url: str,
+    path: str = "/telegram/webhook",
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    secret_token: Optional[str] = None,
+    max_concurrent: int = 64,
+    max_connections: int = 40,
+    shutdown_timeout: float = 30.0,
+    reuse_port: bool = False,
+    register: bool = True,
+):
+    # Работает до SIGTERM/SIGINT: сервер перестает принимать обновления,
+    # начатые дорабатываются не дольше shutdown_timeout
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dispatcher, bot, max_concurrent=max_concurrent, secret_token=secret_token
+    )
+    handler.register(app, path=path)
+    app.router.add_get("/health", lambda request: web.json_response({"ok": True}))
+    app.router.add_get("/metrics", metrics_view)
+    setup_application(app, dispatcher, bot=bot)
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port)
+    await site.start()
+    logger.info(f"Webhook сервер слушает {host}:{port}{path}")
+
+    if register:
+        url = base_url.rstrip("/") + path
+        await bot.set_webhook(
+            url,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+        logger.info(f"Webhook зарегистрирован: {url}")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    try:
+        await stopping.wait()
+        logger.info("Остановка webhook сервера")
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signum)
+        await site.stop()
+        await handler.drain(shutdown_timeout)
+        await runner.cleanup()
+
+
+def run_worker_processes(target: Callable[[int], None], count: int):
+    # Несколько процессов слушают один порт (SO_REUSEPORT), ядро распределяет
+    # соединения между ними. Сигналы остановки пересылаются всем процессам
+    processes = [
+        multiprocessing.Process(
+            target=target, args=(index,), name=f"bot-worker-{index}"
+        )
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено процессов: {count}")
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    for process in processes:
+        process.join()
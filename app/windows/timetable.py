@@ -4,12 +4,21 @@ from aiogram_dialog import Window, DialogManager
 from windows.states import BotStates
 from parser_types import WeekNumber, DayName, ScheduleType, Subgroup
 from datetime import datetime, timedelta
-from parser_types import TimetableData, EntityType
-from database import database
-from database_searcher import SearchTimetableDataBuilder, FilteredLessonsBuilder
+from parser_types import TimetableData
+from database import (
+    database,
+    SubscriptionModel,
+    DELIVERY_DAILY,
+    DELIVERY_HOURLY,
+    DELIVERY_IMMEDIATE,
+)
+from config import settings
+from typing import List, Optional, Tuple
 from aiogram.enums import ParseMode
 from parser_types import Entity
-from aiogram.utils.deep_linking import create_start_link
+from deep_links import deep_links
+from timetable_registry import timetables
+from timetable_pages import precompute_pages, render_day, week_number_for
 from aiogram import Bot
 from profiler import profile
 from aiogram_dialog.widgets.link_preview import LinkPreview
@@ -18,12 +27,11 @@ from loguru import logger
 
 @profile(func_name="timetable_get_timetable_data")
 async def _get_timetable_data(entity: Entity, dialog_manager: DialogManager):
-    timetable_data: TimetableData = dialog_manager.dialog_data.get("timetable_data")
-    if not timetable_data:
-        timetable_data = (
-            await SearchTimetableDataBuilder(database).entity_id(entity.id).fetch()
-        )
-        dialog_manager.dialog_data["timetable_data"] = timetable_data
+    # В состоянии диалога только имя сущности и фильтры: расписание общее для
+    # всех диалогов процесса и берется из реестра по id сущности
+    timetable_data: TimetableData = await timetables.get(entity.id)
+    if timetable_data:
+        dialog_manager.dialog_data["entity_name"] = timetable_data.entity.name
 
     return timetable_data
 
@@ -63,8 +71,7 @@ def _get_relative_day_info(offset=0):
 
 
 def _get_current_week_number():
-    today = datetime.now()
-    return WeekNumber.EVEN if today.isocalendar()[1] % 2 != 0 else WeekNumber.ODD
+    return week_number_for(datetime.now())
 
 
 @profile(func_name="timetable_get_day_offset_from_today")
@@ -98,17 +105,13 @@ def _get_day_offset_from_today(day_name, selected_week_number):
 
 @profile(func_name="timetable_get_quick_link")
 async def _get_quick_link(bot: Bot, entity_name: str):
-    return await create_start_link(bot, f"{entity_name}", encode=True)
+    return await deep_links.link(bot, entity_name)
 
 
 def _html_wrap_bold(text):
     return f"<b>{text}</b>"
 
 
-def _html_wrap_link(text, url):
-    return f"<a href='{url}'>{text}</a>"
-
-
 @profile(func_name="timetable_getter")
 async def timetable_getter(dialog_manager: DialogManager, **kwargs):
     entity: Entity = dialog_manager.start_data.get("entity")
@@ -118,7 +121,8 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
     user_id = dialog_manager.event.from_user.id
 
     current_week = _get_current_week_number()
-    if "is_first_open" not in dialog_manager.dialog_data:
+    first_open = "is_first_open" not in dialog_manager.dialog_data
+    if first_open:
         day_name, suffix = _get_relative_day_info(0)
         dialog_manager.dialog_data["filter_day_name"] = day_name
         dialog_manager.dialog_data["filter_day_suffix"] = "(" + suffix + ")"
@@ -146,6 +150,13 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
                     user_id, timetable_data.entity.name
                 )
                 dialog_manager.dialog_data["filter_subgroup"] = saved_subgroup
+
+                _load_subscription_settings(
+                    dialog_manager.dialog_data,
+                    await database.get_subscription(
+                        user_id, timetable_data.entity.name
+                    ),
+                )
             except Exception:
                 dialog_manager.dialog_data["is_subscribed"] = False
                 dialog_manager.dialog_data["filter_subgroup"] = Subgroup.COMMON
@@ -169,6 +180,13 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
         "is_subscribed", False
     )
 
+    if first_open and settings.TIMETABLE_PRECOMPUTE_PAGES and timetable_data:
+        # Дальше пользователь обычно листает дни и недели: все страницы его
+        # подгруппы готовы заранее, переходы берут их из кеша
+        await precompute_pages(
+            timetable_data, dialog_manager.dialog_data["filter_subgroup"], bot
+        )
+
     selected_day = dialog_manager.dialog_data["filter_day_name"]
     selected_week = dialog_manager.dialog_data["filter_week_number"]
 
@@ -192,23 +210,15 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
     day_index = day_names.index(dialog_manager.dialog_data["filter_day_name"]) + 1
     dialog_manager.dialog_data["day_index"] = day_index
 
-    builder = FilteredLessonsBuilder(timetable_data.lessons)
-    builder = (
-        builder.week_number(dialog_manager.dialog_data["filter_week_number"])
-        .day_name(dialog_manager.dialog_data["filter_day_name"])
-        .schedule_type(dialog_manager.dialog_data["filter_schedule_type"])
+    formatted_lessons = await render_day(
+        timetable_data,
+        dialog_manager.dialog_data["filter_schedule_type"],
+        dialog_manager.dialog_data["filter_week_number"],
+        dialog_manager.dialog_data["filter_day_name"],
+        dialog_manager.dialog_data["filter_subgroup"],
+        bot,
     )
 
-    current_subgroup = dialog_manager.dialog_data["filter_subgroup"]
-    if current_subgroup == Subgroup.COMMON:
-        pass
-    else:
-        builder = builder.subgroup(current_subgroup)
-
-    filtered_lessons = builder.build()
-
-    formatted_lessons = await format_lessons(timetable_data.entity, filtered_lessons, bot)
-
     week_text = f"{1 if dialog_manager.dialog_data['filter_week_number'] == WeekNumber.ODD else 2}/2"
     day_text = f"{day_index}/7"
 
@@ -220,6 +230,10 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
         subgroup_text = "2 подгруппа"
 
     subscribe_icon = "🔔" if not dialog_manager.dialog_data["is_subscribed"] else "🔕"
+    delivery_text = _delivery_text(
+        dialog_manager.dialog_data.get("delivery_mode", DELIVERY_IMMEDIATE),
+        dialog_manager.dialog_data.get("digest_time"),
+    )
 
     tab_regular_text = (
         ".."
@@ -245,6 +259,13 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
         "day_text": day_text,
         "subgroup_text": subgroup_text,
         "subscribe_icon": subscribe_icon,
+        "is_subscribed": dialog_manager.dialog_data["is_subscribed"],
+        "delivery_text": delivery_text,
+        "tomorrow_text": "🌙 вкл"
+        if dialog_manager.dialog_data.get("tomorrow_push")
+        else "🌙 выкл",
+        "tomorrow_push_enabled": dialog_manager.dialog_data["is_subscribed"]
+        and bool(settings.TOMORROW_PUSH_TIME),
         "tab_regular_text": tab_regular_text,
         "tab_consultations_text": tab_consultations_text,
         "tab_session_text": tab_session_text,
@@ -255,107 +276,13 @@ async def timetable_getter(dialog_manager: DialogManager, **kwargs):
     }
 
 
-@profile(func_name="timetable_format_lessons")
-async def format_lessons(entity, lessons, bot=None):
-    if not lessons:
-        return "Занятия не найдены для выбранных фильтров"
-
-    lesson_times = [
-        ("08:00", "09:30", "1"),
-        ("09:40", "11:10", "2"),
-        ("11:30", "13:00", "3"),
-        ("13:30", "15:00", "4"),
-        ("15:10", "16:40", "5"),
-        ("16:50", "18:20", "6"),
-        ("18:30", "20:00", "7"),
-        ("20:10", "21:40", "8"),
-    ]
-
-    result = ""
-    for i, lesson in enumerate(lessons):
-        result += f"<b>{lesson.lesson_name}</b>\n"
-
-        time_str = lesson.time_begin.strftime("%H:%M") if lesson.time_begin else "??:??"
-
-        lesson_number = ""
-        for idx, (start, end, num) in enumerate(lesson_times):
-            if time_str == start:
-                lesson_number = num
-                break
-
-        if lesson_number:
-            cube_emoji = {
-                "1": "1️⃣",
-                "2": "2️⃣",
-                "3": "3️⃣",
-                "4": "4️⃣",
-                "5": "5️⃣",
-                "6": "6️⃣",
-                "7": "7️⃣",
-                "8": "8️⃣",
-            }.get(lesson_number, "🔹")
-            result += f"{cube_emoji} "
-        else:
-            result += "🔹 "
-
-        duration = lesson.duration.total_seconds() // 60 if lesson.duration else 90
-        end_time = (
-            (
-                datetime.combine(datetime.today(), lesson.time_begin)
-                + timedelta(minutes=duration)
-            ).time()
-            if lesson.time_begin
-            else None
-        )
-        end_time_str = end_time.strftime("%H:%M") if end_time else "??:??"
-
-        result += f"<b>{time_str}-{end_time_str}</b>"
-        if lesson.lesson_type:
-            result += f" | {lesson.lesson_type.value}"
-        if lesson.subgroups and lesson.subgroups != Subgroup.COMMON:
-            result += f" | {lesson.subgroups.value}"
-        result += "\n"
-
-        location = []
-        if lesson.auditorium and entity.type != EntityType.AUDITORIUM:
-            if bot:
-                link = await _get_quick_link(bot, lesson.auditorium)
-                location.append(_html_wrap_link(lesson.auditorium, link))
-
-        if location:
-            twogis_link_sign = (
-                f'<a href="https://2gis.ru/krasnoyarsk/search/{lesson.location}">📍</a>'
-            )
-            result += f"{' '.join(location)} {twogis_link_sign} \n"
-
-        if lesson.professors and len(lesson.professors) > 0:
-            professors_links = []
-            for professor in lesson.professors:
-                if bot:
-                    link = await _get_quick_link(bot, professor)
-                    professors_links.append(_html_wrap_link(professor, link))
-            result += f"{', '.join(professors_links)}\n"
-
-        if lesson.groups and len(lesson.groups) > 0:
-            groups_links = []
-            for group in lesson.groups:
-                if bot:
-                    link = await _get_quick_link(bot, group)
-                    groups_links.append(_html_wrap_link(group, link))
-            result += f"{', '.join(groups_links)}\n"
-
-        result += "\n"
-
-    return result
-
-
 @profile(func_name="timetable_subscribe_click")
 async def subscribe_click(callback, widget, manager: DialogManager, **kwargs):
     new_subscription_state = not manager.dialog_data.get("is_subscribed", False)
     manager.dialog_data["is_subscribed"] = new_subscription_state
 
     user_id = callback.from_user.id
-    entity_name = manager.dialog_data.get("timetable_data").entity.name
+    entity_name = manager.dialog_data.get("entity_name")
 
     success = False
     if new_subscription_state:
@@ -366,6 +293,10 @@ async def subscribe_click(callback, widget, manager: DialogManager, **kwargs):
     if success:
         is_subscribed = await database.user_is_subscribed(user_id, entity_name)
         manager.dialog_data["is_subscribed"] = is_subscribed
+        _load_subscription_settings(
+            manager.dialog_data,
+            await database.get_subscription(user_id, entity_name),
+        )
 
         await callback.answer(
             "Отслеживание расписания включено"
@@ -489,6 +420,79 @@ async def day_next_click(callback, widget, manager: DialogManager, **kwargs):
         manager.dialog_data["filter_day_suffix"] = ""
 
 
+def _load_subscription_settings(
+    dialog_data: dict, subscription: Optional[SubscriptionModel]
+):
+    dialog_data["delivery_mode"] = (
+        subscription.delivery_mode if subscription else DELIVERY_IMMEDIATE
+    )
+    dialog_data["digest_time"] = subscription.digest_time if subscription else None
+    dialog_data["tomorrow_push"] = subscription.tomorrow_push if subscription else False
+
+
+@profile(func_name="timetable_tomorrow_switch_click")
+async def tomorrow_switch_click(callback, widget, manager: DialogManager, **kwargs):
+    enabled = not manager.dialog_data.get("tomorrow_push", False)
+
+    user_id = callback.from_user.id
+    entity_name = manager.dialog_data.get("entity_name")
+
+    if await database.save_tomorrow_push(user_id, entity_name, enabled):
+        manager.dialog_data["tomorrow_push"] = enabled
+        await callback.answer(
+            f"Расписание на завтра будет приходить в {settings.TOMORROW_PUSH_TIME}"
+            if enabled
+            else "Рассылка расписания на завтра выключена"
+        )
+    else:
+        await callback.answer(
+            "Не удалось изменить рассылку. Попробуйте позже.",
+            show_alert=True,
+        )
+
+
+def _delivery_options() -> List[Tuple[str, Optional[str]]]:
+    return [(DELIVERY_IMMEDIATE, None), (DELIVERY_HOURLY, None)] + [
+        (DELIVERY_DAILY, digest_time) for digest_time in settings.DIGEST_DAILY_TIMES
+    ]
+
+
+def _delivery_text(delivery_mode: str, digest_time: Optional[str]) -> str:
+    if delivery_mode == DELIVERY_HOURLY:
+        return "🕐 раз в час"
+    if delivery_mode == DELIVERY_DAILY:
+        return f"📅 в {digest_time}"
+    return "⚡ сразу"
+
+
+@profile(func_name="timetable_delivery_switch_click")
+async def delivery_switch_click(callback, widget, manager: DialogManager, **kwargs):
+    options = _delivery_options()
+    current = (
+        manager.dialog_data.get("delivery_mode", DELIVERY_IMMEDIATE),
+        manager.dialog_data.get("digest_time"),
+    )
+    index = options.index(current) if current in options else -1
+    delivery_mode, digest_time = options[(index + 1) % len(options)]
+
+    user_id = callback.from_user.id
+    entity_name = manager.dialog_data.get("entity_name")
+
+    if await database.save_delivery_mode(
+        user_id, entity_name, delivery_mode, digest_time
+    ):
+        manager.dialog_data["delivery_mode"] = delivery_mode
+        manager.dialog_data["digest_time"] = digest_time
+        await callback.answer(
+            "Уведомления: " + _delivery_text(delivery_mode, digest_time)
+        )
+    else:
+        await callback.answer(
+            "Не удалось изменить режим уведомлений. Попробуйте позже.",
+            show_alert=True,
+        )
+
+
 @profile(func_name="timetable_subgroup_switch_click")
 async def subgroup_switch_click(callback, widget, manager: DialogManager, **kwargs):
     current_subgroup = manager.dialog_data.get("filter_subgroup", Subgroup.COMMON)
@@ -500,7 +504,7 @@ async def subgroup_switch_click(callback, widget, manager: DialogManager, **kwar
 
     # Сохраняем настройку пользователя в базе данных
     user_id = callback.from_user.id
-    entity_name = manager.dialog_data.get("timetable_data").entity.name
+    entity_name = manager.dialog_data.get("entity_name")
 
     await database.save_user_subgroup(user_id, entity_name, new_subgroup)
 
@@ -558,6 +562,18 @@ timetable_window = Window(
             id="subscribe",
             on_click=subscribe_click,
         ),
+        Button(
+            Format("{delivery_text}"),
+            id="delivery_switch",
+            on_click=delivery_switch_click,
+            when="is_subscribed",
+        ),
+        Button(
+            Format("{tomorrow_text}"),
+            id="tomorrow_switch",
+            on_click=tomorrow_switch_click,
+            when="tomorrow_push_enabled",
+        ),
         Button(
             Format("{subgroup_text}"),
             id="subgroup_switch",
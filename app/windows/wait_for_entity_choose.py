@@ -1,5 +1,5 @@
 from aiogram_dialog.widgets.text import Const, Format
-from aiogram_dialog.widgets.kbd import Button, ListGroup
+from aiogram_dialog.widgets.kbd import Button, ListGroup, ScrollingGroup
 from aiogram_dialog import Window
 from windows.states import BotStates
 from aiogram_dialog import StartMode
@@ -30,15 +30,22 @@ async def on_entity_selected(callback, widget, manager):
             return
 
 
+ENTITIES_PAGE_SIZE = 7
+
 entity_btn = Button(Format("{item.name}"), id="entity_btn", on_click=on_entity_selected)
 
 wait_for_entity_choose_window = Window(
     Const("Выберите вариант из списка:"),
-    ListGroup(
-        entity_btn,
-        id="entity_list",
-        item_id_getter=lambda item: item.name,
-        items="entities",
+    ScrollingGroup(
+        ListGroup(
+            entity_btn,
+            id="entity_list",
+            item_id_getter=lambda item: item.name,
+            items="entities",
+        ),
+        id="entity_pages",
+        height=ENTITIES_PAGE_SIZE,
+        hide_on_single_page=True,
     ),
     LinkPreview(is_disabled=True),
     state=BotStates.wait_for_entity_choose,